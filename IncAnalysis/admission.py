@@ -0,0 +1,107 @@
+import itertools
+import resource
+import threading
+from typing import Dict, Optional
+
+from IncAnalysis.logger import logger
+from IncAnalysis.utils import get_process_rss
+
+MB = 1024 * 1024
+
+
+class AdmissionController:
+    # Delay launching analyzer processes when the memory of running ones plus
+    # the projected memory of the new one would exceed `budget`. Memory of a
+    # running process is the larger one of its projection and the RSS of its
+    # process tree sampled from /proc, and its peak is reported on release.
+    def __init__(self, budget: int, memory_limit: int = 0, interval: float = 0.5):
+        self.budget = budget
+        self.memory_limit = memory_limit
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.counter = itertools.count()
+        # token -> projected memory, pid and peak RSS.
+        self.projected: Dict[int, int] = {}
+        self.pids: Dict[int, int] = {}
+        self.peaks: Dict[int, int] = {}
+        self.delayed = 0
+        self.stopped = threading.Event()
+        self.sampler: Optional[threading.Thread] = None
+
+    def start(self):
+        self.stopped.clear()
+        self.sampler = threading.Thread(target=self.sample, daemon=True)
+        self.sampler.start()
+
+    def stop(self):
+        self.stopped.set()
+        if self.sampler is not None:
+            self.sampler.join()
+            self.sampler = None
+        if self.delayed:
+            logger.info(
+                f"[Admission Control] {self.delayed} processes were delayed by memory budget {self.budget // MB}MB."
+            )
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def used_memory(self) -> int:
+        return sum(
+            max(projected, self.peaks.get(token, 0))
+            for token, projected in self.projected.items()
+        )
+
+    def admit(self, projected: int) -> int:
+        with self.cond:
+            if self.budget > 0:
+                delayed = False
+                # Always admit one process, even it's larger than budget.
+                while self.projected and self.used_memory() + projected > self.budget:
+                    delayed = True
+                    self.cond.wait(self.interval)
+                if delayed:
+                    self.delayed += 1
+            token = next(self.counter)
+            self.projected[token] = projected
+            return token
+
+    def register(self, token: int, pid: int):
+        with self.cond:
+            self.pids[token] = pid
+
+    def release(self, token: int) -> int:
+        # Return the peak RSS observed.
+        with self.cond:
+            self.projected.pop(token, None)
+            self.pids.pop(token, None)
+            peak = self.peaks.pop(token, 0)
+            self.cond.notify_all()
+        return peak
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            with self.cond:
+                pids = list(self.pids.items())
+            rss = {token: get_process_rss(pid) for token, pid in pids}
+            with self.cond:
+                for token, value in rss.items():
+                    if token in self.projected and value > self.peaks.get(token, 0):
+                        self.peaks[token] = value
+                self.cond.notify_all()
+
+    def limit_child(self, pid: int):
+        # Applied right after spawning, `preexec_fn` may deadlock in the child
+        # because processes are spawned from worker threads.
+        if self.memory_limit > 0:
+            try:
+                resource.prlimit(
+                    pid, resource.RLIMIT_AS, (self.memory_limit, self.memory_limit)
+                )
+            except OSError as e:
+                # The process may have exited already.
+                logger.debug(f"[Admission Control] Cannot limit memory of {pid}: {e}")
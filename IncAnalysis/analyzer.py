@@ -1,24 +1,38 @@
-import concurrent.futures
 import os
-import shlex
 import shutil
 import subprocess
 from abc import ABC, abstractmethod
 from subprocess import run
-from typing import List
+from typing import Dict, List, Optional
 
+from IncAnalysis.admission import AdmissionController
 from IncAnalysis.analyzer_config import *
 from IncAnalysis.file_in_cdb import FileInCDB, FileKind
 from IncAnalysis.logger import logger
 from IncAnalysis.process import Process
-from IncAnalysis.utils import commands_to_shell_script, makedir
+from IncAnalysis.scheduler import JobQueue
+from IncAnalysis.utils import (
+    commands_to_shell_script,
+    get_file_size,
+    makedir,
+    remove_file,
+)
 
 
 class Analyzer(ABC):
+    # Whether files can be analyzed one by one with `analyze_one_file`, or the
+    # analyzer handles the whole compile database in `analyze_all_files`.
+    analyze_per_file = True
+
     def __init__(self, analyzer_config: AnalyzerConfig, file_list: List[FileInCDB]):
         super().__init__()
         self.analyzer_config: AnalyzerConfig = analyzer_config
         self.file_list: List[FileInCDB] = file_list
+        # Set by configuration to share memory budget between analyzers.
+        self.admission: Optional[AdmissionController] = None
+        self.memory_predictions: Dict[str, int] = {}
+        # Timeout of every file derived from history.
+        self.timeouts: Dict[str, float] = {}
 
     @abstractmethod
     def get_analyzer_name(self):
@@ -32,69 +46,142 @@ class Analyzer(ABC):
         self.analyzer_config.inc_mode = inc_mode
 
     def analyze_all_files(self):
+        self.prepare()
+        # Open one process in every thread to simulate multi-process.
+        # Files are submitted in order, `file_list` has been sorted by
+        # predicted cost so the longest ones start first.
+        queue = JobQueue(self.get_workers())
+        queue.add(self, self.file_list)
+        (results, _) = queue.run()
+        return results[self]
+
+    def prepare(self):
         makedir(str(self.analyzer_config.workspace))
-        ret = True
 
-        # with mp.Pool(self.analyzer_config.env.analyze_opts.jobs) as p:
-        #     for retcode in p.map(self.analyze_one_file, [i for i in self.file_list]):
-        #         ret = ret and retcode
-
-        # Open one process in every thread to simulate multi-process.
-        ret = True
+    def get_workers(self) -> int:
         workers = self.analyzer_config.jobs
         if self.analyzer_config.max_workers > 0:
             workers = min(workers, self.analyzer_config.max_workers)
-        with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
-            futures = [
-                executor.submit(self.analyze_one_file, file) for file in self.file_list
-            ]
-
-            for idx, future in enumerate(
-                concurrent.futures.as_completed(futures), start=1
-            ):
-                stat, file_identifier = future.result()
-                logger.info(
-                    f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) Analyze {idx}/{len(self.file_list)}] [{stat}] {file_identifier}"
-                )
-                ret = ret and stat == Process.Stat.ok
-        return ret
+        return workers
+
+    def log_result(
+        self, idx: int, total: int, stat, file_identifier: str, degraded=False
+    ):
+        mode = "Degraded Analyze" if degraded else "Analyze"
+        logger.info(
+            f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) {mode} {idx}/{total}] [{stat}] {file_identifier}"
+        )
 
-    def analyze_one_file(self, file: FileInCDB):
-        analyzer_cmd = self.generate_analyzer_cmd(file)
+    def can_degrade(self) -> bool:
+        # Whether timed out files can be re-analyzed with cheaper settings.
+        return False
+
+    def generate_degraded_cmd(self, file: FileInCDB):
+        return None
+
+    def analyze_one_file(self, file: FileInCDB, degraded: bool = False):
+        if degraded:
+            analyzer_cmd = self.generate_degraded_cmd(file)
+        else:
+            analyzer_cmd = self.generate_analyzer_cmd(file)
         if analyzer_cmd is None:
             return Process.Stat.skipped, file.identifier
         script = commands_to_shell_script(analyzer_cmd)
+        mode = "Degraded Analyze" if degraded else "Analyze"
         if not isinstance(self, ClangTidy):
             # ClangTidy commands are too long to be printed.
             logger.debug(
-                f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) Analyze Script] {script}"
+                f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) {mode} Script] {script}"
             )
 
-        process = Process(analyzer_cmd, file.compile_command.directory)
-        file.analyzers_time[f"{self.get_analyzer_name()} ({self.analyzer_config.inc_mode})"] = process.timecost  # type: ignore
+        analyzer_key = f"{self.get_analyzer_name()} ({self.analyzer_config.inc_mode})"
+        timeout = self.timeouts.get(file.identifier, self.analyzer_config.timeout)
+        file.analyzers_timeout[analyzer_key] = timeout
+        # Stream output into files, large outputs are not buffered in memory.
+        log_file = self.get_log_file(file)
+        if degraded:
+            log_file = log_file[: -len(".log")] + ".degraded.log"
+        makedir(os.path.dirname(log_file))
+        output_file = self.get_output_file(file)
+        if output_file is not None:
+            makedir(os.path.dirname(output_file))
+        process = Process(
+            analyzer_cmd,
+            file.compile_command.directory,
+            timeout=timeout,
+            admission=self.admission,
+            memory=self.memory_predictions.get(file.identifier, 0),
+            stdout_file=log_file,
+            stderr_file=output_file,
+        )
+        if degraded:
+            # Keep the result of the first run, so history still shows the
+            # file timed out with normal settings.
+            if process.stat == Process.Stat.ok:
+                file.analyzers_degraded[analyzer_key] = process.timecost  # type: ignore
+            file.analyzers_memory[analyzer_key] = max(
+                file.analyzers_memory[analyzer_key], process.peak_memory
+            )
+            if process.usage is not None:
+                file.analyzers_usage[analyzer_key].merge(process.usage)
+        else:
+            file.analyzers_time[analyzer_key] = process.timecost  # type: ignore
+            file.analyzers_memory[analyzer_key] = process.peak_memory
+            if process.usage is not None:
+                file.analyzers_usage[analyzer_key] = process.usage
+        if process.stat == Process.Stat.ok:
+            file.analyzers_status[analyzer_key] = "degraded" if degraded else "ok"
+        elif not degraded:
+            file.analyzers_status[analyzer_key] = (
+                "timeout" if process.stat == Process.Stat.timeout else "error"
+            )
         if process.stat == Process.Stat.ok:
             stat = Process.Stat.ok
             # logger.debug(f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) Analyze OK]\nstdout:\n{process.stdout}\nstderr:\n{process.stderr}")
         else:
             stat = (process.stat)[0]
+            output = process.stdout
+            if process.stderr:
+                output += f"\nstderr:\n{process.stderr}"
             logger.error(
-                f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) Analyze {stat}] {script}\nstdout:\n{process.stdout}\nstderr:\n{process.stderr}"
+                f"[{self.get_analyzer_name()} ({self.analyzer_config.inc_mode}) {mode} {stat}] {script}\nlog: {log_file}\n{output}"
             )
 
         # Record time cost.
         if isinstance(self, CSA):
-            if process.stderr:
-                for line in process.stderr.splitlines():
-                    if line.startswith("  Total Execution Time"):  # type: ignore
-                        file.csa_analyze_time = line.split(" ")[5]  # type: ignore
-                        break
-        elif isinstance(self, GSA):
-            if process.stat == Process.Stat.ok and process.stderr:
-                makedir(file.parent.gsa_output_path)
-                with open(file.get_file_path(FileKind.GCC), "w") as f:
-                    f.write(process.stderr)  # type: ignore
+            if degraded:
+                return stat, file.identifier
+            if os.path.exists(log_file):
+                with open(log_file, "r", errors="replace") as f:
+                    for line in f:
+                        if line.startswith("  Total Execution Time"):
+                            file.csa_analyze_time = line.split(" ")[5]
+                            break
+        elif output_file is not None:
+            # Only keep complete and non-empty output.
+            if process.stat != Process.Stat.ok or get_file_size(output_file) == 0:
+                remove_file(output_file)
+        if process.stat == Process.Stat.ok and get_file_size(log_file) == 0:
+            remove_file(log_file)
         return stat, file.identifier
 
+    def get_log_file(self, file: FileInCDB) -> str:
+        config = file.parent
+        return (
+            str(
+                config.workspace
+                / self.get_analyzer_name()
+                / f"{self.analyzer_config.inc_mode}-logs"
+                / config.version_stamp
+            )
+            + file.identifier
+            + ".log"
+        )
+
+    def get_output_file(self, file: FileInCDB) -> Optional[str]:
+        # Results written to stderr by the analyzer are streamed into this file.
+        return None
+
     @staticmethod
     def __str_to_analyzer_class__(analyzer_name: str):
         if analyzer_name == "clangsa":
@@ -117,17 +204,26 @@ class CSA(Analyzer):
         self.analyzer_config: CSAConfig
 
     def generate_analyzer_cmd(self, file: FileInCDB):
+        return self.generate_cmd(file, self.analyzer_config.analyze_args())
+
+    def can_degrade(self) -> bool:
+        return self.analyzer_config.degraded_retry
+
+    def generate_degraded_cmd(self, file: FileInCDB):
+        return self.generate_cmd(file, self.analyzer_config.degraded_analyze_args())
+
+    def generate_cmd(self, file: FileInCDB, analyze_args: List[str]):
         compiler = self.analyzer_config.compilers[file.compile_command.language]
-        analyzer_cmd = (
-            [compiler] + file.compile_command.arguments + ["-Qunused-arguments"]
-        )
+        analyzer_cmd = [compiler, *file.compile_command.arguments, "-Qunused-arguments"]
         output_path = str(file.parent.csa_output_path / file.identifier[1:])
         makedir(output_path)
         analyzer_cmd.extend(["--analyze", "-o", output_path])
-        analyzer_cmd.extend(self.analyzer_config.analyze_args())
+        analyzer_cmd.extend(analyze_args)
         # Add file specific args.
         if self.analyzer_config.inc_mode.value >= IncrementalMode.FuncitonLevel.value:
-            if file.cf_num == 0 or file.rf_num == 0:
+            # Callers of functions changed in other TUs are reanalyzed even if
+            # no function changes in this file.
+            if file.rf_num == 0 or (file.cf_num == 0 and not file.cross_tu_rf_num):
                 logger.debug(
                     f"[{__class__.__name__} No Functions] Don't need to analyze {file.identifier}"
                 )
@@ -202,6 +298,8 @@ class ClangTidy(Analyzer):
 
 
 class CppCheck(Analyzer):
+    analyze_per_file = False
+
     def __init__(self, analyzer_config: CppCheckConfig, file_list: List[FileInCDB]):
         super().__init__(analyzer_config, file_list)
         self.analyzer_config: CppCheckConfig
@@ -309,6 +407,8 @@ class CppCheck(Analyzer):
 
 
 class Infer(Analyzer):
+    analyze_per_file = False
+
     def __init__(self, analyzer_config: InferConfig, file_list: List[FileInCDB]):
         super().__init__(analyzer_config, file_list)
         self.analyzer_config: InferConfig
@@ -373,8 +473,8 @@ class Infer(Analyzer):
 
         cmd_filtered = []
 
-        if file.compile_command.origin_cmd is not None:
-            for cmd in shlex.split(file.compile_command.origin_cmd):
+        if file.compile_command.origin_arguments:
+            for cmd in file.compile_command.origin_arguments:
                 if IGNORED_OPTIONS_GCC.match(cmd) and file.compile_command.language in [
                     "c",
                     "c++",
@@ -461,5 +561,9 @@ class GSA(Analyzer):
                 )
         return analyzer_cmd
 
+    def get_output_file(self, file: FileInCDB) -> Optional[str]:
+        # GSA writes SARIF results to stderr.
+        return file.get_file_path(FileKind.GCC)
+
     def get_analyzer_name(self):
         return __class__.__name__
@@ -25,6 +25,7 @@ class AnalyzerConfig(ABC):
         self.inc_mode: IncrementalMode = env.inc_mode
         self.ctu = env.ctu
         self.jobs = env.analyze_opts.jobs
+        self.timeout = env.analyze_opts.analyze_timeout
         self.verbose = env.analyze_opts.verbose
 
         self.workspace: Path = workspace
@@ -101,6 +102,12 @@ class IPAKind(Enum):
     IPAK_DynamicDispatchBifurcate = auto()
 
 
+# Default `max-nodes` of CSA.
+CSA_MAX_NODES = 225000
+# Degraded retries explore at most 1/3 of the configured `max-nodes`.
+DEGRADED_MAX_NODES_DIVISOR = 3
+
+
 class CSAConfig(AnalyzerConfig):
     def __init__(
         self, env: Environment, csa_workspace: Path, config_file: Optional[str] = None
@@ -120,6 +127,9 @@ class CSAConfig(AnalyzerConfig):
         self.IPAMode = IPAKind.IPAK_DynamicDispatchBifurcate
         self.CTUImportCppThreshold = 8
         self.CTUImportThreshold = 24
+        # Re-analyze timed out files with `degraded_analyze_args`.
+        self.degraded_retry = env.analyze_opts.degraded_retry
+        self.degraded_args = None
         self.parse_json_config()
 
     def inc_level_check(self):
@@ -224,6 +234,46 @@ class CSAConfig(AnalyzerConfig):
             ]
         return self.args
 
+    def degraded_analyze_args(self):
+        # Cheaper settings for files timed out: fewer nodes, basic inlining
+        # and no CTU. Bounds set by the user are only lowered, never raised.
+        if self.degraded_args is not None:
+            return self.degraded_args
+        max_nodes = CSA_MAX_NODES
+        for option in self.csa_config:
+            if option.startswith("max-nodes="):
+                max_nodes = int(option[len("max-nodes=") :]) or CSA_MAX_NODES
+        ipa = "none" if self.IPAMode == IPAKind.IPAK_None else "basic-inlining"
+        csa_config = [
+            option
+            for option in self.csa_config
+            if not option.startswith(
+                (
+                    "max-nodes=",
+                    "ipa=",
+                    "experimental-enable-naive-ctu-analysis=",
+                    "ctu-",
+                    "display-ctu-progress=",
+                )
+            )
+        ]
+        csa_config.extend(
+            [
+                f"max-nodes={max(1, max_nodes // DEGRADED_MAX_NODES_DIVISOR)}",
+                f"ipa={ipa}",
+            ]
+        )
+        self.degraded_args = []
+        for option in self.csa_options:
+            self.degraded_args += ["-Xanalyzer", option]
+        self.degraded_args += [
+            "-Xanalyzer",
+            "-analyzer-config",
+            "-Xanalyzer",
+            ",".join(csa_config),
+        ]
+        return self.degraded_args
+
 
 class ClangTidyConfig(AnalyzerConfig):
     def __init__(
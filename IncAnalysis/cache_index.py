@@ -0,0 +1,372 @@
+import os
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from IncAnalysis.logger import logger
+
+# Increase it when the layout of tables changes, old index will be rebuilt.
+SCHEMA_VERSION = 6
+
+
+class CachedFile:
+    def __init__(self, row: Tuple):
+        (
+            self.identifier,
+            self.prep_file,
+            self.digest,
+            self.command_digest,
+            self.status,
+        ) = row
+
+
+class CacheIndex:
+    # History of every file in the repo, replace the flat `identifier prep_file`
+    # text cache. Lookups are answered by the primary key index of sqlite, so
+    # there is no need to load the whole cache at startup.
+    #   files: latest preprocessed file, its digest, compile command digest
+    #       and status of latest diff.
+    #   outputs: latest output location and analysis result (ok, timeout,
+    #       error or degraded) of every analyzer.
+    #   costs: latest analysis time with the size and rf num it was measured
+    #       on, peak memory, timeout and whether the latest run timed out of
+    #       every analyzer, used by scheduler and admission control.
+    #   cg_functions, cg_calls: latest call graph of every file, functions
+    #       are identified by USRs. Used to propagate changes across TUs, and
+    #       patched with calls of changed functions in later versions.
+    def __init__(self, index_file):
+        self.index_file = Path(index_file)
+        self.index_file.parent.mkdir(parents=True, exist_ok=True)
+        # Files may be looked up in worker threads.
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(str(self.index_file), check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        if version != SCHEMA_VERSION:
+            if version != 0:
+                logger.info(
+                    f"[Cache Index] Rebuild index, schema version {version} is outdated."
+                )
+            self.conn.executescript(
+                """
+                DROP TABLE IF EXISTS files;
+                DROP TABLE IF EXISTS outputs;
+                DROP TABLE IF EXISTS costs;
+                DROP TABLE IF EXISTS call_graphs;
+                DROP TABLE IF EXISTS external_calls;
+                DROP TABLE IF EXISTS cg_functions;
+                DROP TABLE IF EXISTS cg_calls;
+                """
+            )
+        self.conn.executescript(
+            f"""
+            CREATE TABLE IF NOT EXISTS files (
+                identifier TEXT PRIMARY KEY,
+                prep_file TEXT NOT NULL,
+                digest TEXT,
+                command_digest TEXT,
+                status TEXT
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS outputs (
+                identifier TEXT NOT NULL,
+                analyzer TEXT NOT NULL,
+                path TEXT,
+                status TEXT,
+                PRIMARY KEY (identifier, analyzer)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS costs (
+                identifier TEXT NOT NULL,
+                analyzer TEXT NOT NULL,
+                time REAL,
+                size INTEGER,
+                rf_num INTEGER,
+                peak_memory INTEGER,
+                timeout REAL,
+                timed_out INTEGER,
+                PRIMARY KEY (identifier, analyzer)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS cg_functions (
+                identifier TEXT NOT NULL,
+                usr TEXT NOT NULL,
+                name TEXT NOT NULL,
+                has_body INTEGER NOT NULL,
+                PRIMARY KEY (identifier, usr)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cg_functions_usr ON cg_functions (usr);
+            CREATE TABLE IF NOT EXISTS cg_calls (
+                identifier TEXT NOT NULL,
+                callee TEXT NOT NULL,
+                caller TEXT NOT NULL,
+                PRIMARY KEY (identifier, callee, caller)
+            ) WITHOUT ROWID;
+            CREATE INDEX IF NOT EXISTS cg_calls_caller ON cg_calls (identifier, caller);
+            PRAGMA user_version={SCHEMA_VERSION};
+            """
+        )
+        self.conn.commit()
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+    def __len__(self):
+        with self.lock:
+            return self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.conn.execute("SELECT 1 FROM files LIMIT 1").fetchone() is None
+
+    def get(self, identifier: str) -> Optional[CachedFile]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT identifier, prep_file, digest, command_digest, status "
+                "FROM files WHERE identifier = ?",
+                (identifier,),
+            ).fetchone()
+        return CachedFile(row) if row else None
+
+    def get_output(self, identifier: str, analyzer: str) -> Optional[str]:
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT path FROM outputs WHERE identifier = ? AND analyzer = ?",
+                (identifier, analyzer),
+            ).fetchone()
+        return row[0] if row else None
+
+    def update_files(self, rows: Iterable[Tuple]):
+        # rows: (identifier, prep_file, digest, command_digest, status)
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?)", rows
+                )
+
+    def get_status(self, identifier: str, analyzer: str) -> Optional[str]:
+        # Result of the latest analysis of the file.
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM outputs WHERE identifier = ? AND analyzer = ?",
+                (identifier, analyzer),
+            ).fetchone()
+        return row[0] if row else None
+
+    def update_outputs(
+        self, analyzer: str, rows: Iterable[Tuple[str, Optional[str], Optional[str]]]
+    ):
+        # rows: (identifier, path, status)
+        # Unknown path or status (None) keeps the recorded one.
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO outputs VALUES (?, ?, ?, ?) "
+                    "ON CONFLICT (identifier, analyzer) DO UPDATE SET "
+                    "path = COALESCE(excluded.path, path), "
+                    "status = COALESCE(excluded.status, status)",
+                    (
+                        (identifier, analyzer, path, status)
+                        for identifier, path, status in rows
+                    ),
+                )
+
+    def get_cost(self, identifier: str, analyzer: str) -> Optional[Tuple]:
+        # (time, size, rf_num, peak_memory, timeout, timed_out)
+        with self.lock:
+            return self.conn.execute(
+                "SELECT time, size, rf_num, peak_memory, timeout, timed_out "
+                "FROM costs "
+                "WHERE identifier = ? AND analyzer = ?",
+                (identifier, analyzer),
+            ).fetchone()
+
+    def get_total_cost(self, analyzer: str) -> Tuple[float, int]:
+        # Total time and size of files with known size.
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT SUM(time), SUM(size) FROM costs "
+                "WHERE analyzer = ? AND time IS NOT NULL AND size > 0",
+                (analyzer,),
+            ).fetchone()
+        return (row[0] or 0.0, row[1] or 0)
+
+    def get_times(self, analyzer: str) -> List[float]:
+        # Sorted analysis time of files finished in time.
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT time FROM costs WHERE analyzer = ? AND time IS NOT NULL "
+                    "ORDER BY time",
+                    (analyzer,),
+                )
+            ]
+
+    def update_costs(self, analyzer: str, rows: Iterable[Tuple]):
+        # rows: (identifier, time, size, rf_num, peak_memory, timeout, timed_out)
+        # Unknown values (None) keep the recorded ones. Size and rf num are
+        # only updated with time, so the recorded time is always measured on
+        # the recorded size and rf num.
+        with self.lock:
+            with self.conn:
+                self.conn.executemany(
+                    "INSERT INTO costs VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (identifier, analyzer) DO UPDATE SET "
+                    "size = CASE WHEN excluded.time IS NULL THEN size "
+                    "ELSE excluded.size END, "
+                    "rf_num = CASE WHEN excluded.time IS NULL THEN rf_num "
+                    "ELSE excluded.rf_num END, "
+                    "time = COALESCE(excluded.time, time), "
+                    "peak_memory = COALESCE(excluded.peak_memory, peak_memory), "
+                    "timeout = COALESCE(excluded.timeout, timeout), "
+                    "timed_out = COALESCE(excluded.timed_out, timed_out)",
+                    ((identifier, analyzer, *row) for identifier, *row in rows),
+                )
+
+    def has_call_graph(self, identifier: str) -> bool:
+        with self.lock:
+            return (
+                self.conn.execute(
+                    "SELECT 1 FROM cg_functions WHERE identifier = ? LIMIT 1",
+                    (identifier,),
+                ).fetchone()
+                is not None
+            )
+
+    def get_defined_functions(self, identifier: str) -> List[str]:
+        # USRs of functions defined in the file.
+        with self.lock:
+            return [
+                row[0]
+                for row in self.conn.execute(
+                    "SELECT usr FROM cg_functions "
+                    "WHERE identifier = ? AND has_body = 1",
+                    (identifier,),
+                )
+            ]
+
+    def get_external_callers(self, usrs: Iterable[str]) -> Dict[str, List[str]]:
+        # identifier -> USRs in `usrs` the file calls but doesn't define.
+        callers: Dict[str, List[str]] = {}
+        with self.lock:
+            for usr in usrs:
+                for (identifier,) in self.conn.execute(
+                    "SELECT identifier FROM cg_functions "
+                    "WHERE usr = ? AND has_body = 0",
+                    (usr,),
+                ):
+                    callers.setdefault(identifier, []).append(usr)
+        return callers
+
+    def get_reachable_callers(
+        self, identifier: str, usrs: List[str]
+    ) -> List[Tuple[str, str]]:
+        # (USR, name) of functions defined in the file which call any of `usrs`
+        # directly or transitively.
+        functions = set()
+        with self.lock:
+            for start in range(0, len(usrs), 500):
+                seeds = usrs[start : start + 500]
+                functions.update(
+                    self.conn.execute(
+                        "WITH RECURSIVE reach(usr) AS ("
+                        f"VALUES {', '.join('(?)' for _ in seeds)} "
+                        "UNION SELECT cg_calls.caller FROM cg_calls "
+                        "JOIN reach ON cg_calls.callee = reach.usr "
+                        "WHERE cg_calls.identifier = ?) "
+                        "SELECT usr, name FROM cg_functions JOIN reach USING (usr) "
+                        "WHERE identifier = ? AND has_body = 1",
+                        (*seeds, identifier, identifier),
+                    )
+                )
+        return list(functions)
+
+    def replace_call_graph(
+        self,
+        identifier: str,
+        functions: Iterable[Tuple[str, str, int]],
+        calls: Iterable[Tuple[str, str]],
+    ):
+        # functions: (usr, name, has_body), calls: (callee, caller)
+        with self.lock:
+            with self.conn:
+                self.conn.execute(
+                    "DELETE FROM cg_functions WHERE identifier = ?", (identifier,)
+                )
+                self.conn.execute(
+                    "DELETE FROM cg_calls WHERE identifier = ?", (identifier,)
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO cg_functions VALUES (?, ?, ?, ?)",
+                    ((identifier, *row) for row in functions),
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO cg_calls VALUES (?, ?, ?)",
+                    ((identifier, *row) for row in calls),
+                )
+
+    def patch_call_graph(
+        self,
+        identifier: str,
+        functions: Dict[str, Tuple[str, int]],
+        calls: Dict[str, List[str]],
+    ):
+        # Replace calls of changed functions, `calls` maps every changed
+        # function to the functions it calls now. `functions` are the latest
+        # (name, has_body) of them.
+        with self.lock:
+            with self.conn:
+                removed_callees = set()
+                for caller, callees in calls.items():
+                    removed_callees.update(
+                        row[0]
+                        for row in self.conn.execute(
+                            "SELECT callee FROM cg_calls "
+                            "WHERE identifier = ? AND caller = ?",
+                            (identifier, caller),
+                        )
+                    )
+                    self.conn.execute(
+                        "DELETE FROM cg_calls WHERE identifier = ? AND caller = ?",
+                        (identifier, caller),
+                    )
+                    self.conn.executemany(
+                        "INSERT OR IGNORE INTO cg_calls VALUES (?, ?, ?)",
+                        ((identifier, callee, caller) for callee in callees),
+                    )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO cg_functions VALUES (?, ?, ?, ?)",
+                    (
+                        (identifier, usr, name, has_body)
+                        for usr, (name, has_body) in functions.items()
+                    ),
+                )
+                # Functions declared but not defined are in the graph because
+                # they are called, remove them if nothing calls them now.
+                self.conn.executemany(
+                    "DELETE FROM cg_functions "
+                    "WHERE identifier = ? AND usr = ? AND has_body = 0 "
+                    "AND NOT EXISTS (SELECT 1 FROM cg_calls "
+                    "WHERE identifier = ? AND callee = ?)",
+                    (
+                        (identifier, usr, identifier, usr)
+                        for usr in removed_callees
+                    ),
+                )
+
+    def import_text_cache(self, cache_file) -> bool:
+        # Cache generated by old versions, every line is `identifier prep_file`.
+        if not os.path.exists(cache_file):
+            return False
+        rows = []
+        with open(cache_file, "r") as f:
+            for line in f:
+                line = line.strip()
+                if len(line) == 0:
+                    continue
+                (identifier, prep_file) = line.split(" ")
+                rows.append((identifier, prep_file, None, None, None))
+        self.update_files(rows)
+        logger.info(f"[Cache Index] Import {len(rows)} files from {cache_file}")
+        return True
@@ -0,0 +1,322 @@
+import mmap
+import struct
+import sys
+from array import array
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+)
+
+
+class CSRCallGraph:
+    # Reverse call graph with nodes numbered from 0, callers of node i are
+    # caller_indices[caller_offsets[i]:caller_offsets[i + 1]]. Reanalyze flags
+    # are kept in a bitmap instead of node objects.
+    def __init__(self, cg_file_path: str, is_baseline=False):
+        self.cg_file_path = cg_file_path
+        self.is_baseline: bool = is_baseline
+        self.functions_need_reanalyzed: Set[str] = set()
+        self.node_num = 0
+        self.caller_offsets = array("I", [0])
+        self.caller_indices = array("I")
+        self.reanalyze = bytearray()
+
+    def __len__(self) -> int:
+        return self.node_num
+
+    def fname(self, node: int) -> str:
+        raise NotImplementedError
+
+    def get_node_if_exist(self, fname: str) -> Optional[int]:
+        raise NotImplementedError
+
+    def callers(self, node: int):
+        return self.caller_indices[
+            self.caller_offsets[node] : self.caller_offsets[node + 1]
+        ]
+
+    def should_reanalyze(self, node: int) -> bool:
+        return self.reanalyze[node] != 0
+
+    def mark_as_reanalye(self, node: int):
+        self.reanalyze[node] = 1
+        self.functions_need_reanalyzed.add(self.fname(node))
+
+    def mark_reachable_callers(
+        self,
+        nodes: Iterable[int],
+        stop_at: Optional[Callable[[List[int]], Sequence[bool]]] = None,
+    ) -> List[int]:
+        # Mark `nodes` and all their transitive callers as reanalyze, by one
+        # breadth-first search from all of them. Return newly marked nodes.
+        # stop_at(frontier) flags callers that are marked but not traversed
+        # upward, it's called once for every frontier.
+        (offsets, indices, reanalyze) = (
+            self.caller_offsets,
+            self.caller_indices,
+            self.reanalyze,
+        )
+        frontier = []
+        for node in nodes:
+            if not reanalyze[node]:
+                reanalyze[node] = 1
+                frontier.append(node)
+        marked = list(frontier)
+        while frontier:
+            next_frontier = []
+            for node in frontier:
+                for caller in indices[offsets[node] : offsets[node + 1]]:
+                    if not reanalyze[caller]:
+                        reanalyze[caller] = 1
+                        next_frontier.append(caller)
+            marked.extend(next_frontier)
+            if stop_at is not None and next_frontier:
+                stops = stop_at(next_frontier)
+                next_frontier = [
+                    node for node, stop in zip(next_frontier, stops) if not stop
+                ]
+            frontier = next_frontier
+        self.functions_need_reanalyzed.update(self.fname(node) for node in marked)
+        return marked
+
+    def __repr__(self) -> str:
+        ret = ""
+        for node in range(self.node_num):
+            ret += f"{self.fname(node)}" + ":{"
+            for caller in self.callers(node):
+                ret += "\t"
+                ret += f"{self.fname(caller)}\n"
+            ret += "}\n"
+        return ret
+
+
+class ArrayCallGraph(CSRCallGraph):
+    # Reverse call graph parsed from .cg, function names are interned to
+    # node numbers.
+    def __init__(self, cg_file_path: str, is_baseline=False):
+        super().__init__(cg_file_path, is_baseline)
+        self.names: List[str] = []
+        self.name_to_node: Dict[str, int] = {}
+        # Edges in the order of .cg.
+        callees = array("I")
+        callers = array("I")
+        # .cg file format, functions are in reverse post order:
+        # function
+        # [
+        # callers of function
+        # ]
+        with open(cg_file_path, "r") as f:
+            callee: Optional[int] = None
+            is_callee = True
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                if line.startswith("["):
+                    is_callee = False
+                elif line.startswith("]"):
+                    is_callee = True
+                elif is_callee:
+                    callee = self.get_or_insert_node(line)
+                elif callee is not None:
+                    callees.append(callee)
+                    callers.append(self.get_or_insert_node(line))
+        self.build(callees, callers)
+
+    def get_or_insert_node(self, fname: str) -> int:
+        node = self.name_to_node.get(fname)
+        if node is None:
+            node = len(self.names)
+            self.name_to_node[fname] = node
+            self.names.append(fname)
+        return node
+
+    def build(self, callees: array, callers: array):
+        # Group edges by callee with counting sort.
+        self.node_num = len(self.names)
+        offsets = array("I", bytes(4 * (self.node_num + 1)))
+        for callee in callees:
+            offsets[callee + 1] += 1
+        for node in range(self.node_num):
+            offsets[node + 1] += offsets[node]
+        indices = array("I", bytes(4 * len(callers)))
+        next_slot = offsets[:-1]
+        for callee, caller in zip(callees, callers):
+            indices[next_slot[callee]] = caller
+            next_slot[callee] += 1
+        self.caller_offsets = offsets
+        self.caller_indices = indices
+        self.reanalyze = bytearray(self.node_num)
+
+    def fname(self, node: int) -> str:
+        return self.names[node]
+
+    def get_node_if_exist(self, fname: str) -> Optional[int]:
+        return self.name_to_node.get(fname)
+
+
+class BinaryCallGraph(CSRCallGraph):
+    # Reverse call graph in .cgb, written by `collectIncInfo -dump-cg-binary`.
+    # Arrays are used in place in the mapped file, so no Python object is
+    # created per node.
+    MAGIC = b"ICGB"
+    VERSION = 2
+    # magic, version, node num, edge num, name bytes, USR bytes
+    HEADER = struct.Struct("<4s5I")
+
+    def __init__(self, cg_file_path: str, is_baseline=False):
+        super().__init__(cg_file_path, is_baseline)
+        with open(cg_file_path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            self.load()
+        except ValueError:
+            self.close()
+            raise
+
+    def load(self):
+        if len(self.map) < self.HEADER.size:
+            raise ValueError(f"{self.cg_file_path} is truncated")
+        (magic, version, node_num, edge_num, name_size, usr_size) = (
+            self.HEADER.unpack_from(self.map)
+        )
+        if magic != self.MAGIC or version != self.VERSION:
+            raise ValueError(
+                f"{self.cg_file_path} is not a version {self.VERSION} .cgb file"
+            )
+        size = (
+            self.HEADER.size
+            + 4 * (5 * node_num + 3 + edge_num)
+            + node_num
+            + name_size
+            + usr_size
+        )
+        if len(self.map) < size:
+            raise ValueError(f"{self.cg_file_path} is truncated")
+        self.node_num = node_num
+        self.view = memoryview(self.map)
+        offset = self.HEADER.size
+
+        def uint32_array(length):
+            nonlocal offset
+            data = self.view[offset : offset + 4 * length]
+            offset += 4 * length
+            if sys.byteorder == "little":
+                return data.cast("I")
+            values = array("I", data.tobytes())
+            values.byteswap()
+            return values
+
+        self.name_offsets = uint32_array(node_num + 1)
+        self.usr_offsets = uint32_array(node_num + 1)
+        self.caller_offsets = uint32_array(node_num + 1)
+        self.caller_indices = uint32_array(edge_num)
+        self.nodes_by_name = uint32_array(node_num)
+        self.nodes_by_usr = uint32_array(node_num)
+        self.has_body = self.view[offset : offset + node_num]
+        self.names_start = offset + node_num
+        self.usrs_start = self.names_start + name_size
+        self.reanalyze = bytearray(node_num)
+
+    def close(self):
+        for attr in (
+            "name_offsets",
+            "usr_offsets",
+            "caller_offsets",
+            "caller_indices",
+            "nodes_by_name",
+            "nodes_by_usr",
+            "has_body",
+            "view",
+        ):
+            value = getattr(self, attr, None)
+            if isinstance(value, memoryview):
+                value.release()
+        self.map.close()
+
+    def name_bytes(self, node: int) -> bytes:
+        start = self.names_start + self.name_offsets[node]
+        end = self.names_start + self.name_offsets[node + 1]
+        return self.map[start:end]
+
+    def usr_bytes(self, node: int) -> bytes:
+        start = self.usrs_start + self.usr_offsets[node]
+        end = self.usrs_start + self.usr_offsets[node + 1]
+        return self.map[start:end]
+
+    def fname(self, node: int) -> str:
+        return self.name_bytes(node).decode(errors="replace")
+
+    def usr(self, node: int) -> str:
+        return self.usr_bytes(node).decode(errors="replace")
+
+    def is_defined(self, node: int) -> bool:
+        # The function has body in this TU.
+        return self.has_body[node] != 0
+
+    def search(self, sorted_nodes, key_of, key: str) -> Optional[int]:
+        # Binary search on nodes sorted by `key_of`.
+        key_bytes = key.encode()
+        (low, high) = (0, self.node_num)
+        while low < high:
+            mid = (low + high) // 2
+            if key_of(sorted_nodes[mid]) < key_bytes:
+                low = mid + 1
+            else:
+                high = mid
+        if low < self.node_num and key_of(sorted_nodes[low]) == key_bytes:
+            return sorted_nodes[low]
+        return None
+
+    def get_node_if_exist(self, fname: str) -> Optional[int]:
+        return self.search(self.nodes_by_name, self.name_bytes, fname)
+
+    def function_rows(self) -> Iterator[Tuple[str, str, int]]:
+        # (USR, name, has body) of every function.
+        for node in range(self.node_num):
+            yield (self.usr(node), self.fname(node), self.has_body[node])
+
+    def call_rows(self) -> Iterator[Tuple[str, str]]:
+        # (callee USR, caller USR) of every call.
+        usrs = [self.usr(node) for node in range(self.node_num)]
+        for node in range(self.node_num):
+            for caller in self.callers(node):
+                yield (usrs[node], usrs[caller])
+
+    def get_node_by_usr(self, usr: str) -> Optional[int]:
+        return self.search(self.nodes_by_usr, self.usr_bytes, usr)
+
+
+class CallGraphDelta:
+    # Calls of changed functions in .cgd, written by `collectIncInfo
+    # -dump-cg-binary -cg-delta-file`, see `DumpCallGraphDelta`.
+    def __init__(self, cgd_file_path: str):
+        # USR -> (name, has body) of changed functions and their callees.
+        self.functions: Dict[str, Tuple[str, int]] = {}
+        # USR of changed function -> USRs of functions it calls.
+        self.calls: Dict[str, List[str]] = {}
+        # USRs of functions need reanalyze.
+        self.reanalyzed: List[str] = []
+        with open(cgd_file_path, "r") as f:
+            caller: Optional[str] = None
+            for line in f:
+                fields = line.rstrip("\n").split("\t", 3)
+                if fields[0] == "R" and len(fields) == 2:
+                    self.reanalyzed.append(fields[1])
+                    continue
+                if len(fields) != 4:
+                    continue
+                (kind, has_body, usr, name) = fields
+                self.functions[usr] = (name, int(has_body))
+                if kind == "F":
+                    caller = usr
+                    self.calls.setdefault(caller, [])
+                elif kind == "C" and caller is not None:
+                    self.calls[caller].append(usr)
@@ -1,25 +1,138 @@
 import json
 import os
+import shlex
+import sys
+from typing import Dict, List, Optional, Tuple
 
 from IncAnalysis.logger import logger
 
 
+def intern_arguments(arguments) -> Tuple[str, ...]:
+    # Most files in a target share nearly all flags, intern them so every
+    # CompileCommand only holds references.
+    return tuple(sys.intern(argument) for argument in arguments)
+
+
+class FlagSet:
+    # Distinct adjusted arguments without the source file, shared by all files
+    # compiled with the same flags.
+    __slots__ = ("id", "compiler", "flags", "source_index", "scripts")
+
+    def __init__(
+        self, id: int, compiler: str, flags: Tuple[str, ...], source_index: int
+    ):
+        self.id = id
+        self.compiler = compiler
+        self.flags = flags
+        # Where the source file is in arguments.
+        self.source_index = source_index
+        # Shell script before and after the source file, keyed by extra args.
+        self.scripts: Dict[Tuple[str, ...], Tuple[str, str]] = {}
+
+    def arguments(self, source: Optional[str]) -> Tuple[str, ...]:
+        if source is None:
+            return self.flags
+        return (
+            self.flags[: self.source_index]
+            + (source,)
+            + self.flags[self.source_index :]
+        )
+
+    def shell_script(self, source: Optional[str], extra_args=()) -> str:
+        # Same as `commands_to_shell_script([compiler, *arguments, *extra_args])`,
+        # but flags are only quoted once per flag set.
+        extra_args = tuple(extra_args)
+        scripts = self.scripts.get(extra_args)
+        if scripts is None:
+            scripts = self.scripts[extra_args] = (
+                shlex.join((self.compiler,) + self.flags[: self.source_index]),
+                shlex.join(self.flags[self.source_index :] + extra_args),
+            )
+        prefix, suffix = scripts
+        if source is not None:
+            prefix = f"{prefix} {shlex.quote(source)}"
+        return f"{prefix} {suffix}" if suffix else prefix
+
+
+class FlagSetTable:
+    def __init__(self):
+        self.flag_sets: List[FlagSet] = []
+        self.index: Dict[Tuple, FlagSet] = {}
+
+    def __len__(self):
+        return len(self.flag_sets)
+
+    def __getitem__(self, id: int) -> FlagSet:
+        return self.flag_sets[id]
+
+    def get_or_insert(
+        self, compiler: str, flags: Tuple[str, ...], source_index: int
+    ) -> FlagSet:
+        key = (compiler, flags, source_index)
+        flag_set = self.index.get(key)
+        if flag_set is None:
+            flag_set = FlagSet(len(self.flag_sets), compiler, flags, source_index)
+            self.flag_sets.append(flag_set)
+            self.index[key] = flag_set
+        return flag_set
+
+
+# Flag sets of all compile commands, shared by all versions.
+FLAG_SET_TABLE = FlagSetTable()
+
+
+def group_by_flag_set(files, key=lambda file: file.compile_command):
+    # Group files compiled with the same flags, keep the order of files.
+    groups: Dict[int, List] = {}
+    for file in files:
+        groups.setdefault(key(file).flag_set.id, []).append(file)
+    return groups
+
+
 class CompileCommand:
+    __slots__ = (
+        "directory",
+        "language",
+        "file_as_identifier",
+        "file",
+        "identifier",
+        "output",
+        "compiler",
+        "origin_arguments",
+        "flag_set",
+        "source",
+    )
+
     def __init__(self, ccmd, file_as_identifier=True):
         self.directory = None
         self.language = "Unknown"
         self.file_as_identifier = file_as_identifier
-
-        if "command" in ccmd:
-            self.origin_cmd = ccmd["command"]
-        else:
-            self.origin_cmd = " ".join(ccmd["arguments"])
+        self.identifier: Optional[str] = None
+        # Arguments before adjusted, `command` is split to arguments.
+        self.origin_arguments: Tuple[str, ...] = ()
+        self.flag_set: Optional[FlagSet] = None
+        # The source file as it appears in arguments.
+        self.source: Optional[str] = None
         self.parse(ccmd)
 
+    @property
+    def origin_cmd(self) -> str:
+        return shlex.join(self.origin_arguments)
+
+    @property
+    def arguments(self) -> Tuple[str, ...]:
+        if self.flag_set is None:
+            return ()
+        return self.flag_set.arguments(self.source)
+
+    def shell_script(self, extra_args=()) -> str:
+        assert self.flag_set is not None
+        return self.flag_set.shell_script(self.source, extra_args)
+
     def __str__(self):
         return json.dumps(
             {
-                "arguments": self.arguments,
+                "arguments": list(self.arguments),
                 "directory": self.directory,
                 "file": self.file,
                 "compiler": self.compiler,
@@ -78,18 +191,18 @@ class CompileCommand:
         # command => arguments
         arguments = None
         if "command" in ccmd:
-            from shlex import split
-
-            arguments = split(ccmd["command"])
+            arguments = shlex.split(ccmd["command"])
         else:
             arguments = ccmd["arguments"]
+        arguments = intern_arguments(arguments)
+        self.origin_arguments = arguments
 
         # compiler
         self.compiler = arguments[0]
 
         # Adjust arguments.
         i, n = 0, len(arguments)
-        self.arguments = []
+        adjusted_arguments = []
         prune1 = {"-c", "-fsyntax-only", "-save-temps"}
         prune2 = {"-o", "-MF", "-MT", "-MQ", "-MJ"}
         prunes2 = {"-M", "-W", "-g"}
@@ -114,12 +227,27 @@ class CompileCommand:
                 continue
             if arguments[i][:2] in prunes2:
                 continue
-            self.arguments.append(arguments[i])
+            adjusted_arguments.append(arguments[i])
             # Reset language if provided in command line arguments.
             if arguments[i] == "-x":
                 self.language = arguments[i + 1]
             elif arguments[i][:2] == "-x":
                 self.language = arguments[i][2:]
+        # Split the source file out, the rest are shared by files with same flags.
+        source_index = len(adjusted_arguments)
+        basename = os.path.basename(self.file)
+        for idx in range(len(adjusted_arguments) - 1, -1, -1):
+            argument = adjusted_arguments[idx]
+            if argument.endswith(basename) and self.file == os.path.abspath(
+                os.path.join(self.directory, argument)
+            ):
+                source_index = idx
+                self.source = argument
+                del adjusted_arguments[idx]
+                break
+        self.flag_set = FLAG_SET_TABLE.get_or_insert(
+            self.compiler, tuple(adjusted_arguments), source_index
+        )
 
         return self
 
@@ -130,3 +258,45 @@ class CompileCommand:
             and "directory" in ccmd
             and ("arguments" in ccmd or "command" in ccmd)
         )
+
+
+def iter_compile_commands(cdb_file, chunk_size: int = 1 << 20):
+    # Yield entries of compilation database one by one, only the entry being
+    # decoded is held in memory instead of the whole database.
+    decoder = json.JSONDecoder()
+    with open(cdb_file, "r") as f:
+        buf = f.read(chunk_size)
+        pos = 0
+        eof = not buf
+        # Skip the opening '['.
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf) or eof:
+                break
+            buf, pos = f.read(chunk_size), 0
+            eof = not buf
+        if pos >= len(buf):
+            return
+        if buf[pos] != "[":
+            raise ValueError(f"{cdb_file} is not a list of compile commands")
+        pos += 1
+        while True:
+            while pos < len(buf) and (buf[pos].isspace() or buf[pos] == ","):
+                pos += 1
+            if pos < len(buf) and buf[pos] == "]":
+                return
+            try:
+                if pos >= len(buf):
+                    raise json.JSONDecodeError("Need more data", buf, pos)
+                ccmd, pos = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                # The entry is incomplete, read more.
+                if eof:
+                    raise
+                chunk = f.read(chunk_size)
+                eof = not chunk
+                buf = buf[pos:] + chunk
+                pos = 0
+                continue
+            yield ccmd
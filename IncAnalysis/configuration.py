@@ -1,21 +1,50 @@
+import concurrent.futures
+import heapq
 import json
 import multiprocessing as mp
 import os
 import shutil
 import subprocess
+import threading
 import time
 from pathlib import Path
 from subprocess import run
-from typing import Dict, List, Optional, Union
+from typing import Dict, List, Optional, Set, Union
 
+from IncAnalysis.admission import MB, AdmissionController
 from IncAnalysis.analyzer import *
 from IncAnalysis.analyzer_config import *
-from IncAnalysis.compile_command import CompileCommand
+from IncAnalysis.cache_index import CacheIndex
+from IncAnalysis.call_graph import BinaryCallGraph, CallGraphDelta
+from IncAnalysis.compile_command import (
+    CompileCommand,
+    group_by_flag_set,
+    iter_compile_commands,
+)
 from IncAnalysis.environment import *
 from IncAnalysis.file_in_cdb import *
+from IncAnalysis.inc_info_server import IncInfoServerPool
+from IncAnalysis.line_diff import diff_preprocessed_files
 from IncAnalysis.logger import logger
+from IncAnalysis.orchestrator import (
+    Stage,
+    process_context,
+    run_file_pipeline,
+    run_file_tasks,
+)
+from IncAnalysis.preprocess_cache import PreprocessCache
+from IncAnalysis.process import ResourceUsage
+from IncAnalysis.scheduler import (
+    TIMEOUT_WARNING_RATIO,
+    CostModel,
+    JobQueue,
+    TimeoutPolicy,
+)
 from IncAnalysis.utils import *
 
+# Versions skipped because no file changed, one version stamp per line.
+SKIPPED_VERSIONS_FILE = "skipped_versions.txt"
+
 
 class Option:
     def __init__(self, cmd: str):
@@ -209,8 +238,10 @@ class Configuration:
         self.version_stamp = version_stamp
         self.cdb = cdb
         logger.TAG = f"{self.name}/{self.version_stamp}"
-        # Record all files' latest version in repo history.
+        # Record all files' latest version in repo history, files not touched
+        # in this run are loaded from cache_index on demand.
         self.global_file_dict: Dict[str, FileInCDB] = {}
+        self.cache_index: Optional[CacheIndex] = None
         # We traverse file_list most of the time, so we don't use Dict[str, FileInCDB].
         self.file_list_index: Dict[str, int] = {}
         # Files in workspace, only record files exists and has normal extname.
@@ -249,8 +280,16 @@ class Configuration:
         makedir(str(self.workspace))
         self.update_workspace_path()
         self.update_analyzers_path(self.env.inc_mode)
+        # Preprocessed files store shared by all versions.
+        self.preprocess_cache: Optional[PreprocessCache] = None
+        if self.env.analyze_opts.preprocess_cache:
+            self.preprocess_cache = PreprocessCache(
+                self.workspace / "preprocess" / "store"
+            )
 
         self.diff_file_list = []
+        # Unchanged files need reanalyze because of changes in other TUs.
+        self.cross_tu_affected_files: List[FileInCDB] = []
         self.status = "WAIT"
         self.incrementable = False
         self.session_times = {}
@@ -339,6 +378,7 @@ class Configuration:
             self.cache_file = self.env.analyze_opts.cache
         else:
             self.cache_file = self.workspace / "preprocess" / "cache.txt"
+        self.cache_index_file = Path(self.cache_file).with_suffix(".db")
         self.preprocess_path = self.workspace / "preprocess" / self.version_stamp
         self.compile_commands_used_by_pre = (
             self.preprocess_path / "compile_commands_used_by_pre.json"
@@ -396,6 +436,9 @@ class Configuration:
     def clean_inc_files(self):
         for file in self.diff_file_list:
             file.clean_files()
+        for file in self.cross_tu_affected_files:
+            # Other files of unchanged files belong to the baseline.
+            remove_file(file.get_file_path(FileKind.RF))
 
     def process_this_config(self, can_skip_configure: bool, has_init: bool):
         # 1. configure & build
@@ -408,6 +451,8 @@ class Configuration:
         if not self.prepare_file_list():
             logger.info("[Process Config] prepare file list failed.")
             return False
+        if self.can_pipeline(has_init):
+            return self.process_pipelined()
 
         # Record real runtime and CPU time for tasks
         # related to incremental analysis preparation.
@@ -422,6 +467,10 @@ class Configuration:
             self.file_basic_statistics()
         if self.env.analyze_opts.prep_only:
             return True
+        if self.incrementable and not self.diff_file_list:
+            self.prepare_for_inc_info_real_time = time.time() - start_real_time
+            self.skip_unchanged_version()
+            return True
         # 3. extract inc info
         if self.env.inc_mode.value >= IncrementalMode.FuncitonLevel.value:
             self.extract_inc_info(has_init)
@@ -446,29 +495,166 @@ class Configuration:
 
         return True
 
+    def can_pipeline(self, has_init: bool) -> bool:
+        # Files can go from preprocess to analyzers one by one only if no
+        # session needs the results of all files, such as the external function
+        # map of CTU.
+        opts = self.env.analyze_opts
+        return (
+            opts.pipeline
+            and has_init
+            and self.env.inc_mode
+            in (
+                IncrementalMode.FileLevel,
+                IncrementalMode.FuncitonLevel,
+                IncrementalMode.InlineLevel,
+            )
+            and not self.env.ctu
+            and not opts.udp
+            and not opts.basic_info
+            and not opts.prep_only
+            and (self.update_mode or self.baseline != self)
+        )
+
+    def process_pipelined(self):
+        # A changed file is analyzed as soon as its inc info is extracted,
+        # while other files are still being preprocessed and diffed. So
+        # `prepare_for_inc_info_real_time` overlaps `analyze_real_time`.
+        logger.info("[Process Config] Prepare and analyze files in pipeline.")
+        start_real_time = time.time()
+        self.status = "DIFF"
+        self.incrementable = True
+        self.analyze(pipelined=True)
+        if not self.diff_file_list:
+            # Nothing was fed to analyzers.
+            self.mark_skipped_version()
+        self.output_analysis_time()
+        if self.env.analyze_opts.clean_inc:
+            self.clean_inc_files()
+        self.analyze_real_time = time.time() - start_real_time
+        return True
+
+    def skip_unchanged_version(self):
+        # No file reaching any TU changed, e.g. commits touch only docs or
+        # tests. Don't run analyzers.
+        start_real_time = time.time()
+        logger.info("[Skip Analysis] No file changed, skip analysis.")
+        self.session_times["extract_inc_info"] = SessionStatus.Skipped
+        self.mark_skipped_version()
+        for inc_level in self.inc_levels:
+            for analyzer in self.analyzers:
+                self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = 0.0
+            self.session_times[f"analyze ({inc_level})"] = 0.0
+        self.analyze_real_time = time.time() - start_real_time
+
+    def mark_skipped_version(self):
+        # Like every incremental version, reports directories only have reports
+        # of reanalyzed files, so they are empty here. Record the version, then
+        # postprocessing can tell it from a version analyzed without reports.
+        with open(self.workspace / SKIPPED_VERSIONS_FILE, "a") as f:
+            f.write(f"{self.version_stamp}\n")
+        logger.info(
+            f"[Skip Analysis] {self.version_stamp} is recorded in {SKIPPED_VERSIONS_FILE}."
+        )
+
+    def pipeline_stages(self) -> List[Stage]:
+        jobs = self.env.analyze_opts.jobs
+        stages = [
+            Stage(
+                "preprocess_file",
+                FileInCDB.preprocess_task,
+                FileInCDB.preprocess_done,
+                self.preprocess_jobs(),
+            )
+        ]
+        if self.env.DIFF_COMMAND is None:
+            stages.append(
+                Stage(
+                    "diff_with_baseline",
+                    FileInCDB.native_diff_task,
+                    FileInCDB.native_diff_done,
+                    jobs,
+                )
+            )
+        else:
+            stages.append(
+                Stage(
+                    "diff_with_baseline",
+                    FileInCDB.diff_task,
+                    FileInCDB.diff_done,
+                    jobs,
+                )
+            )
+        if self.env.inc_mode.value >= IncrementalMode.FuncitonLevel.value:
+            # collectIncInfo runs once per file, a file can't wait for a batch.
+            stages.append(
+                Stage(
+                    "extract_inc_info",
+                    FileInCDB.inc_info_task,
+                    FileInCDB.inc_info_done,
+                    jobs,
+                    accept=FileInCDB.is_changed,
+                )
+            )
+        return stages
+
     def read_cache(self):
-        if os.path.exists(self.cache_file):
-            with open(self.cache_file, "r") as f:
-                for line in f.readlines():
-                    line = line.strip()
-                    if len(line) == 0:
-                        continue
-                    (file, cache_file) = line.split(" ")
-                    self.global_file_dict[file] = FileInCDB(
-                        None, None, cache_file=cache_file
-                    )
+        if (
+            self.cache_index is None
+            or self.cache_index.index_file != self.cache_index_file
+        ):
+            self.cache_index = CacheIndex(self.cache_index_file)
+            if self.cache_index.is_empty() and Path(self.cache_file).suffix != ".db":
+                # Convert text cache generated by old versions.
+                self.cache_index.import_text_cache(self.cache_file)
+        if not self.cache_index.is_empty():
             logger.info("[Read Cache] Read cache successfully.")
             return True
         logger.info("[Read Cache] No cache, do full analysis.")
         return False
 
+    def get_cached_file(self, identifier: str) -> Optional[FileInCDB]:
+        file_in_cdb = self.global_file_dict.get(identifier)
+        if file_in_cdb is not None or self.cache_index is None:
+            return file_in_cdb
+        cached_file = self.cache_index.get(identifier)
+        if cached_file is None:
+            return None
+        file_in_cdb = FileInCDB(None, None, cache_file=cached_file.prep_file)
+        file_in_cdb.digest = cached_file.digest
+        self.global_file_dict[identifier] = file_in_cdb
+        return file_in_cdb
+
     def update_cache(self):
-        if self.env.analyze_opts.not_update_cache:
+        if self.env.analyze_opts.not_update_cache or self.cache_index is None:
             return
-        # update cache
-        with open(self.cache_file, "w") as f:
-            for identifier, file_in_cdb in self.global_file_dict.items():
-                f.write(f"{identifier} {file_in_cdb.prep_file}\n")
+        # update cache, only files in this version may be changed.
+        self.cache_index.update_files(
+            (
+                file.identifier,
+                file.prep_file,
+                file.digest,
+                PreprocessCache.command_digest(
+                    file.compile_command.arguments, file.compile_command.directory
+                ),
+                file.status.name,
+            )
+            for file in self.file_list
+        )
+
+    def update_cache_outputs(
+        self, analyzer_name: str, inc_level, file_list: List[FileInCDB]
+    ):
+        if self.env.analyze_opts.not_update_cache or self.cache_index is None:
+            return
+        analyzer_key = f"{analyzer_name} ({inc_level})"
+        rows = []
+        for file in file_list:
+            output = file.get_output_path(analyzer_name) or None
+            status = file.analyzers_status.get(analyzer_key)
+            if output or status:
+                rows.append((file.identifier, output, status))
+        self.cache_index.update_outputs(analyzer_key, rows)
 
     def prepare_file_list(self):
         # Don't invoke this function after `configure & build` automatically,
@@ -481,61 +667,64 @@ class Configuration:
         self.file_list = []
         self.file_list_index = {}
         self.diff_file_list = []
+        self.cross_tu_affected_files = []
         self.abnormal_file_list = []
         self.merged_files = 0
-        with open(self.compile_database, "r") as f:
-            cdb = json.load(f)
-            for idx, ccdb in enumerate(cdb):
-                compile_command = CompileCommand(
-                    ccdb, self.env.analyze_opts.file_identifier == "file"
-                )
-                if compile_command.identifier is None:
-                    continue
-                if "-cc1" in compile_command.arguments:
-                    # Skip clang frontend compile command.
-                    continue
+        for ccdb in iter_compile_commands(self.compile_database):
+            compile_command = CompileCommand(
+                ccdb, self.env.analyze_opts.file_identifier == "file"
+            )
+            if compile_command.identifier is None:
+                continue
+            if "-cc1" in compile_command.arguments:
+                # Skip clang frontend compile command.
+                continue
 
-                same_file_idx = self.file_list_index.get(compile_command.file)
-                this_file_idx = len(self.file_list)
-                if same_file_idx is not None:
-                    # There maybe same 'file' (different 'output') in compile_commands.json.
-                    if compile_command.file_as_identifier:
-                        # If file name used as identifier, only record latest compile command.
-                        this_file_idx = same_file_idx
-                        compile_command.identifier = compile_command.file
-                    else:
-                        # Otherwise, record 'output' as identifier.
-                        compile_command.identifier = compile_command.output
-                else:
-                    # This file is the first time to appear in compile_commands.json.
-                    # Use file name as identifier prior to target file (although `opts.file_identifier` is `target`).
+            same_file_idx = self.file_list_index.get(compile_command.file)
+            this_file_idx = len(self.file_list)
+            if same_file_idx is not None:
+                # There maybe same 'file' (different 'output') in compile_commands.json.
+                if compile_command.file_as_identifier:
+                    # If file name used as identifier, only record latest compile command.
+                    this_file_idx = same_file_idx
                     compile_command.identifier = compile_command.file
-
-                file_in_cdb = FileInCDB(self, compile_command)
-                if (
-                    file_in_cdb.status == FileStatus.UNKNOWN
-                    or file_in_cdb.status == FileStatus.UNEXIST
-                ):
-                    self.abnormal_file_list.append(file_in_cdb)
                 else:
-                    if this_file_idx == len(self.file_list):
-                        self.file_list.append(file_in_cdb)
-                    else:
-                        self.file_list[this_file_idx] = file_in_cdb
-                    self.file_list_index[file_in_cdb.identifier] = this_file_idx
-                    if this_file_idx == same_file_idx:
-                        self.merged_files += 1
+                    # Otherwise, record 'output' as identifier.
+                    compile_command.identifier = compile_command.output
+            else:
+                # This file is the first time to appear in compile_commands.json.
+                # Use file name as identifier prior to target file (although `opts.file_identifier` is `target`).
+                compile_command.identifier = compile_command.file
+
+            file_in_cdb = FileInCDB(self, compile_command)
+            if (
+                file_in_cdb.status == FileStatus.UNKNOWN
+                or file_in_cdb.status == FileStatus.UNEXIST
+            ):
+                self.abnormal_file_list.append(file_in_cdb)
+            else:
+                if this_file_idx == len(self.file_list):
+                    self.file_list.append(file_in_cdb)
+                else:
+                    self.file_list[this_file_idx] = file_in_cdb
+                self.file_list_index[file_in_cdb.identifier] = this_file_idx
+                if this_file_idx == same_file_idx:
+                    self.merged_files += 1
 
         makedir(self.preprocess_path)
-        with open(self.compile_commands_used_by_analyzers, "w") as f:
-            cdb = []
-            for file_in_cdb in self.file_list:
-                # Update global_file_dict after file_list has been initialzed,
-                # make sure there is no duplicate file name.
-                self.global_file_dict[file_in_cdb.identifier] = file_in_cdb
-                # Remove duplicate file in compile database.
-                cdb.append(file_in_cdb.compile_command.restore_to_json())
-            json.dump(cdb, f, indent=4)
+        logger.info(
+            f"[Prepare File List] {len(self.file_list)} files use "
+            f"{len(group_by_flag_set(self.file_list))} flag sets."
+        )
+        for file_in_cdb in self.file_list:
+            # Update global_file_dict after file_list has been initialzed,
+            # make sure there is no duplicate file name.
+            self.global_file_dict[file_in_cdb.identifier] = file_in_cdb
+        # Remove duplicate file in compile database.
+        dump_json_list(
+            (file.compile_command.restore_to_json() for file in self.file_list),
+            self.compile_commands_used_by_analyzers,
+        )
 
         # update compiler environment
         for file in self.file_list:
@@ -635,22 +824,20 @@ class Configuration:
         # We don't diff -r preprocess dir anymore, no need to remake dir.
         makedir(self.preprocess_path, "[Preprocess Files DIR exists]")
 
-        cdb = []
-        for file in self.file_list:
-            prep_arguments = file.compile_command.arguments + ["-D__clang_analyzer__"]
-            cdb.append(
+        dump_json_list(
+            (
                 {
                     "directory": file.compile_command.directory,
-                    "command": commands_to_shell_script(
-                        [file.compile_command.compiler] + prep_arguments
+                    "command": file.compile_command.shell_script(
+                        ["-D__clang_analyzer__"]
                     ),
                     "file": file.file_name,
                     "output": file.compile_command.output,
                 }
-            )
-        pre_cdb = open(self.compile_commands_used_by_pre, "w")
-        json.dump(cdb, pre_cdb, indent=4)
-        pre_cdb.close()
+                for file in self.file_list
+            ),
+            self.compile_commands_used_by_pre,
+        )
 
         plugin_path = self.preprocess_path / "compile_action.json"
         with open(plugin_path, "w") as f:
@@ -669,34 +856,21 @@ class Configuration:
         if self.env.analyze_opts.verbose:
             commands.extend(["--verbose"])
         preprocess_script = commands_to_shell_script(commands)
+        if self.preprocess_cache is not None:
+            self.preprocess_cache.reset_statistics()
         try:
             # process = run(preprocess_script, shell=True, capture_output=True, text=True, check=True)
-            preprocess_result = process_file_list(
-                FileInCDB.preprocess_file, self.file_list, self.env.analyze_opts.jobs
+            preprocess_result = run_file_tasks(
+                "preprocess_file",
+                self.file_list,
+                FileInCDB.preprocess_task,
+                FileInCDB.preprocess_done,
+                self.preprocess_jobs(),
             )
+            self.log_preprocess_statistics()
             self.status = "PREPROCESSED"
             self.session_times["preprocess_repo"] = time.time() - start_time
-            cdb = []
-            for file in self.file_list:
-                # Preprocessed files still need compile options, such as c++ version and so on.
-                # And it's no need to add flags like '-xc++', because clang is able to identify
-                # preprocessed files automatically, unless open the '-P' option.
-                #
-                # When use CSA analyze the file, macro `__clang_analyzer__` will defined automatically.
-                prep_arguments = file.compile_command.arguments + [
-                    "-D__clang_analyzer__"
-                ]
-                cdb.append(
-                    {
-                        "directory": file.compile_command.directory,
-                        "command": commands_to_shell_script(
-                            [file.compile_command.compiler] + prep_arguments
-                        ),
-                        "file": file.prep_file,
-                    }
-                )
-            with open(self.preprocess_compile_database, "w") as f:
-                json.dump(cdb, f, indent=4)
+            self.dump_preprocess_compile_database()
             if preprocess_result:
                 logger.debug("[Preprocess Files Success]")
             else:
@@ -709,12 +883,53 @@ class Configuration:
                 f"[Preprocess Files Failed] stdout: {e.stdout}\n stderr: {e.stderr}"
             )
 
+    def preprocess_jobs(self) -> int:
+        jobs = memory_capped_jobs(
+            self.env.analyze_opts.jobs, self.env.analyze_opts.preprocess_job_memory
+        )
+        if jobs < self.env.analyze_opts.jobs:
+            logger.info(f"[Preprocess Files] Limit jobs to {jobs} by memory.")
+        return jobs
+
+    def log_preprocess_statistics(self):
+        slowest_files = sorted(
+            self.file_list, key=lambda file: file.preprocess_time, reverse=True
+        )[:10]
+        for file in slowest_files:
+            logger.debug(
+                f"[Preprocess Time] {file.preprocess_time:.3f}s {file.identifier}"
+            )
+        if self.preprocess_cache is not None:
+            logger.info(
+                f"[Preprocess Cache] hits: {self.preprocess_cache.hits}, misses: {self.preprocess_cache.misses}"
+            )
+
+    def dump_preprocess_compile_database(self):
+        # Preprocessed files still need compile options, such as c++ version and so on.
+        # And it's no need to add flags like '-xc++', because clang is able to identify
+        # preprocessed files automatically, unless open the '-P' option.
+        #
+        # When use CSA analyze the file, macro `__clang_analyzer__` will defined automatically.
+        dump_json_list(
+            (
+                {
+                    "directory": file.compile_command.directory,
+                    "command": file.compile_command.shell_script(
+                        ["-D__clang_analyzer__"]
+                    ),
+                    "file": file.prep_file,
+                }
+                for file in self.file_list
+            ),
+            self.preprocess_compile_database,
+        )
+
     def extract_inc_info(self, has_init):
         """
         use clang_tool/CollectIncInfo.cpp to generate information used by incremental analysis
         """
         self.session_times["extract_inc_info"] = SessionStatus.Skipped
-        if not has_init:
+        if not has_init and not self.cross_tu_propagation():
             logger.info(
                 "[Extract Inc Info] Don't need to extract inc info when baseline analysis."
             )
@@ -726,14 +941,240 @@ class Configuration:
             return
         start_time = time.time()
         makedir(self.preprocess_path, "[Inc Info Files DIR exists]")
-        process_file_list(
-            FileInCDB.extract_inc_info,
-            self.diff_file_list if self.incrementable else self.file_list,
-            self.env.analyze_opts.jobs,
-        )
+        file_list = self.diff_file_list if self.incrementable else self.file_list
+        if self.cross_tu_propagation():
+            # Call graphs of last run are recorded, don't read them again.
+            for file in file_list:
+                remove_file(file.get_file_path(FileKind.CGB))
+                remove_file(file.get_file_path(FileKind.CGD))
+        if self.env.analyze_opts.inc_info_mode == "server":
+            self.extract_inc_info_with_servers(file_list)
+        elif self.env.analyze_opts.inc_info_mode == "batch":
+            self.extract_inc_info_in_batch(file_list)
+        else:
+            self.extract_inc_info_per_file(file_list)
+        if self.cross_tu_propagation():
+            # Call graphs of all files are recorded in baseline analysis.
+            self.propagate_across_tu(file_list, has_init)
         logger.info("[Extract Inc Info Finish]")
         self.session_times["extract_inc_info"] = time.time() - start_time
 
+    def inc_info_options(self) -> List[str]:
+        # Options of collectIncInfo shared by all files.
+        options = []
+        if self.env.ctu:
+            options.append("-ctu")
+        # ClangTidy line-level filter.
+        if self.enable_clangtidy:
+            options.append("--dump-anr")
+        if self.cross_tu_propagation():
+            options.append("-dump-cg-binary")
+        return options
+
+    def cross_tu_propagation(self) -> bool:
+        # CTU analysis inlines functions defined in other TUs, so changes of a
+        # function affect analysis of its callers in all TUs.
+        return (
+            self.env.ctu
+            and self.env.inc_mode.value >= IncrementalMode.FuncitonLevel.value
+        )
+
+    def propagate_across_tu(self, file_list: List[FileInCDB], has_init: bool):
+        # Record call graphs of `file_list` in cache index, then mark callers of
+        # their changed functions in other TUs as reanalyze, transitively across
+        # TUs. Call graphs of files recorded before are patched with .cgd, which
+        # only has calls of changed functions, others are replaced with .cgb.
+        if self.cache_index is None:
+            return
+        start_time = time.time()
+        update_cache = not self.env.analyze_opts.not_update_cache
+        (patched, replaced) = (0, 0)
+        changed_usrs = set()
+        for file in file_list:
+            cgd_file = file.get_file_path(FileKind.CGD)
+            cgb_file = file.get_file_path(FileKind.CGB)
+            usrs: List[str] = []
+            if os.path.exists(cgd_file):
+                delta = CallGraphDelta(cgd_file)
+                if update_cache:
+                    self.cache_index.patch_call_graph(
+                        file.identifier, delta.functions, delta.calls
+                    )
+                usrs = delta.reanalyzed
+                patched += 1
+            elif os.path.exists(cgb_file):
+                try:
+                    call_graph = BinaryCallGraph(cgb_file)
+                except ValueError as e:
+                    logger.error(f"[Cross TU Propagation] Cannot load {cgb_file}: {e}")
+                    continue
+                if update_cache:
+                    self.cache_index.replace_call_graph(
+                        file.identifier,
+                        call_graph.function_rows(),
+                        call_graph.call_rows(),
+                    )
+                usrs = file.changed_usrs(call_graph)
+                call_graph.close()
+                replaced += 1
+            elif not file.has_rf:
+                # Failed to extract inc info, all recorded functions may change.
+                usrs = self.cache_index.get_defined_functions(file.identifier)
+            if has_init:
+                changed_usrs.update(usrs)
+        logger.info(
+            f"[Cross TU Propagation] Patch call graphs of {patched} files, "
+            f"replace call graphs of {replaced} files."
+        )
+        if not changed_usrs:
+            return
+
+        in_file_list = set(file.identifier for file in file_list)
+        # identifier -> names of functions marked in the file.
+        affected: Dict[str, Set[str]] = {}
+        # Functions marked in one TU affect their callers in other TUs too,
+        # propagate from newly marked functions until nothing new is marked.
+        reached = set(changed_usrs)
+        frontier = changed_usrs
+        rounds = 0
+        while frontier:
+            rounds += 1
+            next_frontier = set()
+            for identifier, usrs in self.cache_index.get_external_callers(
+                frontier
+            ).items():
+                file = self.get_file(identifier, report=False)
+                if file is None:
+                    continue
+                if identifier in in_file_list and not file.has_rf:
+                    # The whole file is analyzed.
+                    continue
+                for usr, name in self.cache_index.get_reachable_callers(
+                    identifier, usrs
+                ):
+                    affected.setdefault(identifier, set()).add(name)
+                    if usr not in reached:
+                        reached.add(usr)
+                        next_frontier.add(usr)
+            frontier = next_frontier
+        affected_functions = 0
+        for identifier, functions in affected.items():
+            file = self.get_file(identifier, report=False)
+            affected_functions += len(functions)
+            file.add_reanalyzed_functions(list(functions))  # type: ignore
+            if identifier not in in_file_list:
+                self.cross_tu_affected_files.append(file)  # type: ignore
+        logger.info(
+            f"[Cross TU Propagation] {len(changed_usrs)} changed functions affect "
+            f"{affected_functions} functions in {rounds} rounds, "
+            f"{len(self.cross_tu_affected_files)} unchanged files need reanalyze "
+            f"in {time.time() - start_time:.3f}s."
+        )
+
+    def extract_inc_info_in_batch(self, file_list: List[FileInCDB]):
+        # Every worker processes a shard of files in one collectIncInfo run,
+        # avoid paying clang startup for every file.
+        if not file_list:
+            return
+        shards: List[List[FileInCDB]] = [
+            [] for _ in range(min(self.env.analyze_opts.jobs, len(file_list)))
+        ]
+        # Balance shards by size of preprocessed files.
+        loads = [(0, idx) for idx in range(len(shards))]
+        for size, file in sorted(
+            ((get_file_size(file.prep_file), file) for file in file_list),
+            key=lambda item: item[0],
+            reverse=True,
+        ):
+            load, idx = heapq.heappop(loads)
+            shards[idx].append(file)
+            heapq.heappush(loads, (load + size, idx))
+
+        def extract_shard(idx: int) -> bool:
+            batch_file = str(self.preprocess_path / f"inc_info_batch_{idx}.json")
+            for file in shards[idx]:
+                # Outputs of this run are used to check if the file succeeded.
+                remove_file(file.get_file_path(FileKind.INCSUM))
+            dump_json_list(
+                (file.inc_info_batch_job() for file in shards[idx]), batch_file
+            )
+            commands = [self.env.EXTRACT_II, "-batch", batch_file]
+            commands.extend(self.inc_info_options())
+            process = run(commands, capture_output=True, text=True)
+            logger.info(
+                f"[Extract Inc Info Batch {idx+1}/{len(shards)}] [{process.returncode == 0}] {len(shards[idx])} files"
+            )
+            if process.returncode != 0:
+                logger.debug(
+                    f"[Extract Inc Info Batch {idx+1}] stderr: {process.stderr}"
+                )
+            remove_file(batch_file)
+            return process.returncode == 0
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=len(shards)) as executor:
+            list(executor.map(extract_shard, range(len(shards))))
+        self.collect_inc_info_results(file_list)
+
+    def extract_inc_info_with_servers(self, file_list: List[FileInCDB]):
+        # Dispatch files to a pool of `collectIncInfo -serve` workers, clang
+        # keeps file system state warm between files.
+        if not file_list:
+            return
+        jobs = min(self.env.analyze_opts.jobs, len(file_list))
+        commands = [self.env.EXTRACT_II, "-serve"]
+        commands.extend(self.inc_info_options())
+        # Start from large files to balance workers.
+        file_list = sorted(
+            file_list, key=lambda file: get_file_size(file.prep_file), reverse=True
+        )
+
+        try:
+            timeout = self.env.analyze_opts.inc_info_timeout
+            with IncInfoServerPool(
+                commands,
+                str(self.preprocess_path / "inc_info_server"),
+                jobs,
+                timeout if timeout > 0 else None,
+            ) as pool:
+
+                def extract_file(file: FileInCDB) -> bool:
+                    remove_file(file.get_file_path(FileKind.INCSUM))
+                    return pool.request(file.inc_info_batch_job())
+
+                with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
+                    for idx, (file, result) in enumerate(
+                        zip(file_list, executor.map(extract_file, file_list))
+                    ):
+                        logger.info(
+                            f"[extract_inc_info {idx+1}/{len(file_list)}] [{result}] {file.identifier}"
+                        )
+        except OSError as e:
+            logger.error(f"[Inc Info Server] Start servers failed: {e}")
+        self.collect_inc_info_results(file_list)
+
+    def collect_inc_info_results(self, file_list: List[FileInCDB]):
+        failed_files = []
+        for file in file_list:
+            if os.path.exists(file.get_file_path(FileKind.INCSUM)):
+                file.parse_inc_sum()
+            else:
+                failed_files.append(file)
+        if failed_files:
+            # Retry one by one, so that errors are reported for every file.
+            logger.info(
+                f"[Extract Inc Info] {len(failed_files)} files failed, extract them one by one."
+            )
+            self.extract_inc_info_per_file(failed_files)
+
+    def extract_inc_info_per_file(self, file_list: List[FileInCDB]):
+        run_file_tasks(
+            "extract_inc_info",
+            file_list,
+            FileInCDB.inc_info_task,
+            FileInCDB.inc_info_done,
+            self.env.analyze_opts.jobs,
+        )
+
     def extract_basic_info(self):
         """
         File statistics: CG nodes, Virtual functions, Function pointers, preprocess coverage, etc.
@@ -746,9 +1187,11 @@ class Configuration:
             return
         start_time = time.time()
         makedir(self.preprocess_path, "[basic Info Files DIR exists]")
-        process_file_list(
-            FileInCDB.extract_basic_info,
+        run_file_tasks(
+            "extract_basic_info",
             self.diff_file_list if self.incrementable else self.file_list,
+            FileInCDB.basic_info_task,
+            FileInCDB.basic_info_done,
             self.env.analyze_opts.jobs,
         )
         logger.info("[Extract basic Info Finish]")
@@ -886,34 +1329,222 @@ class Configuration:
                             self.global_efm[usr] = ast_file
         self.session_times["merge_efm"] = time.time() - start_time
 
-    def analyze(self):
-        for inc_level in self.inc_levels:
-            start_time = time.time()
-            self.update_analyzers_path(inc_level)
-            for analyzer in self.analyzers:
-                analyzer.update_inc_mode(inc_level)
-                analyzer_time = time.time()
-                self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = (
-                    SessionStatus.Skipped
+    def analyze(self, pipelined: bool = False):
+        job_memory = self.env.analyze_opts.analyzer_job_memory * MB
+        cost_model = CostModel(self.cache_index, job_memory)
+        memory_budget = self.env.analyze_opts.memory_budget * MB
+        if memory_budget < 0:
+            memory_budget = get_available_memory() or 0
+        if 0 < memory_budget < self.env.analyze_opts.jobs * job_memory:
+            logger.info(
+                f"[Admission Control] Memory budget {memory_budget // MB}MB fits about {max(1, memory_budget // job_memory)} analyzer processes without history, fewer than -j{self.env.analyze_opts.jobs}."
+            )
+        admission = AdmissionController(
+            memory_budget, self.env.analyze_opts.analyzer_memory_limit * MB
+        )
+        timeout_policy = TimeoutPolicy(
+            cost_model,
+            self.env.analyze_opts.analyze_timeout,
+            self.env.analyze_opts.min_analyze_timeout,
+            self.env.analyze_opts.max_analyze_timeout,
+        )
+        with admission:
+            for inc_level in self.inc_levels:
+                self.analyze_inc_level(
+                    inc_level, cost_model, admission, timeout_policy, pipelined
                 )
-                if isinstance(analyzer, CSA):
-                    # prepare for CSA
-                    if self.env.ctu:
-                        self.generate_efm()
-                        self.merge_efm()
-
-                if (
-                    self.incrementable
-                    and inc_level.value >= IncrementalMode.FileLevel.value
-                ):
-                    analyzer.file_list = self.diff_file_list
-                else:
-                    analyzer.file_list = self.file_list
-                analyzer.analyze_all_files()
-                self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = (
-                    time.time() - analyzer_time
+
+    def analyze_inc_level(
+        self,
+        inc_level,
+        cost_model: CostModel,
+        admission: AdmissionController,
+        timeout_policy: TimeoutPolicy,
+        pipelined: bool = False,
+    ):
+        start_time = time.time()
+        self.update_analyzers_path(inc_level)
+        # Per-file jobs of all analyzers share one queue and `-j` budget,
+        # analyzers handle the whole project are executed after them.
+        # If pipelined, files are fed to the queue once they are prepared.
+        job_queue = JobQueue(self.env.analyze_opts.jobs, closed=not pipelined)
+        per_file_analyzers = []
+        for analyzer in self.analyzers:
+            analyzer.update_inc_mode(inc_level)
+            self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = (
+                SessionStatus.Skipped
+            )
+            if isinstance(analyzer, CSA):
+                # prepare for CSA
+                if self.env.ctu:
+                    self.generate_efm()
+                    self.merge_efm()
+
+            if self.incrementable and inc_level.value >= IncrementalMode.FileLevel.value:
+                analyzer.file_list = self.diff_file_list
+                if isinstance(analyzer, CSA) and self.cross_tu_affected_files:
+                    # Only CSA sees functions of other TUs.
+                    analyzer.file_list = (
+                        self.diff_file_list + self.cross_tu_affected_files
+                    )
+            else:
+                analyzer.file_list = self.file_list
+            if analyzer.analyze_per_file:
+                analyzer_key = f"{analyzer.get_analyzer_name()} ({inc_level})"
+                (analyzer.file_list, costs) = cost_model.schedule(
+                    analyzer.file_list, analyzer_key
+                )
+                analyzer.admission = admission
+                analyzer.memory_predictions = cost_model.predict_memories(
+                    analyzer.file_list, analyzer_key
+                )
+                analyzer.timeouts = timeout_policy.timeouts(
+                    analyzer.file_list, analyzer_key, costs
+                )
+                analyzer.prepare()
+                job_queue.add(analyzer, analyzer.file_list, costs)
+                per_file_analyzers.append(analyzer)
+
+        if pipelined:
+            (_, finish_times) = self.run_pipeline(
+                job_queue, per_file_analyzers, inc_level, cost_model, timeout_policy
+            )
+        else:
+            (_, finish_times) = job_queue.run()
+        for analyzer in per_file_analyzers:
+            # Analyzers run together, record the time its last job finished.
+            self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = (
+                finish_times[analyzer]
+            )
+            self.update_cache_outputs(
+                analyzer.get_analyzer_name(), inc_level, analyzer.file_list
+            )
+            analyzer_key = f"{analyzer.get_analyzer_name()} ({inc_level})"
+            self.log_timeout_statistics(analyzer.file_list, analyzer_key)
+            if not self.env.analyze_opts.not_update_cache:
+                cost_model.record(analyzer.file_list, analyzer_key)
+
+        for analyzer in self.analyzers:
+            if analyzer.analyze_per_file:
+                continue
+            analyzer_time = time.time()
+            analyzer.analyze_all_files()
+            self.session_times[f"{analyzer.__class__.__name__} ({inc_level})"] = (
+                time.time() - analyzer_time
+            )
+            self.update_cache_outputs(
+                analyzer.get_analyzer_name(), inc_level, analyzer.file_list
+            )
+        self.session_times[f"analyze ({inc_level})"] = time.time() - start_time
+
+    def run_pipeline(
+        self,
+        job_queue: JobQueue,
+        analyzers: List[Analyzer],
+        inc_level,
+        cost_model: CostModel,
+        timeout_policy: TimeoutPolicy,
+    ):
+        # Analyze files in another thread, changed files are fed to analyzers
+        # when they leave the pipeline. The pipeline runs in this thread, so
+        # its event loop can handle SIGINT/SIGTERM. Analyzers handle the whole
+        # project read `diff_file_list`, it's filled after all files are
+        # prepared.
+        start_time = time.time()
+        makedir(self.preprocess_path, "[Preprocess Files DIR exists]")
+        self.prepare_diff_dir()
+        if self.preprocess_cache is not None:
+            self.preprocess_cache.reset_statistics()
+        analyzer_keys = {
+            analyzer: f"{analyzer.get_analyzer_name()} ({inc_level})"
+            for analyzer in analyzers
+        }
+        rates = {
+            analyzer: cost_model.seconds_per_byte(analyzer_key)
+            for analyzer, analyzer_key in analyzer_keys.items()
+        }
+
+        def feed_analyzers(file: FileInCDB):
+            if not file.is_changed():
+                return
+            for analyzer, analyzer_key in analyzer_keys.items():
+                cost = cost_model.predict(file, analyzer_key, rates[analyzer])
+                analyzer.memory_predictions[file.identifier] = (
+                    cost_model.predict_memory(file, analyzer_key)
+                )
+                analyzer.timeouts.update(
+                    timeout_policy.timeouts(
+                        [file], analyzer_key, {file.identifier: cost}
+                    )
+                )
+                analyzer.file_list.append(file)
+                job_queue.feed(analyzer, file, cost)
+
+        queue_results = []
+        errors = []
+
+        def analyze_files():
+            try:
+                queue_results.append(job_queue.run())
+            except BaseException as e:
+                errors.append(e)
+
+        def prepare_files():
+            try:
+                (results, stage_times) = run_file_pipeline(
+                    self.file_list,
+                    self.pipeline_stages(),
+                    feed_analyzers,
+                    self.env.analyze_opts.jobs if self.env.DIFF_COMMAND is None else 0,
+                    self.env.analyze_opts.jobs,
                 )
-            self.session_times[f"analyze ({inc_level})"] = time.time() - start_time
+                self.prepare_for_inc_info_real_time = time.time() - start_time
+                self.log_preprocess_statistics()
+                self.dump_preprocess_compile_database()
+                self.collect_diff_results()
+                # Stages overlap, record the time their last file finished.
+                self.session_times["preprocess_repo"] = stage_times["preprocess_file"]
+                self.session_times["diff_with_other"] = stage_times[
+                    "diff_with_baseline"
+                ]
+                if "extract_inc_info" in stage_times:
+                    self.session_times["extract_inc_info"] = stage_times[
+                        "extract_inc_info"
+                    ]
+                if not results["preprocess_file"]:
+                    logger.debug("[Preprocess Files Failed]")
+            except BaseException:
+                # Interrupted, don't start analyzers on queued files.
+                job_queue.cancel()
+                raise
+            finally:
+                job_queue.close()
+
+        thread = threading.Thread(target=analyze_files, daemon=True)
+        thread.start()
+        try:
+            prepare_files()
+        finally:
+            thread.join()
+        if errors:
+            raise errors[0]
+        return queue_results[0]
+
+    def log_timeout_statistics(self, file_list: List[FileInCDB], analyzer_key: str):
+        # How close files came to their timeout.
+        timeout_num = close_num = 0
+        for file in file_list:
+            timecost = file.analyzers_time.get(analyzer_key)
+            timeout = file.analyzers_timeout.get(analyzer_key)
+            if timecost == "timeout":
+                timeout_num += 1
+            elif isinstance(timecost, float) and timeout:
+                if timecost > timeout * TIMEOUT_WARNING_RATIO:
+                    close_num += 1
+        if timeout_num or close_num:
+            logger.info(
+                f"[{analyzer_key} Timeout] {timeout_num} files timed out, {close_num} files used more than {int(TIMEOUT_WARNING_RATIO * 100)}% of timeout."
+            )
 
     def prepare_diff_dir(self):
         if not self.env.analyze_opts.udp:
@@ -934,6 +1565,27 @@ class Configuration:
                 ],
             )
 
+    def diff_with_native_engine(self):
+        # Digests are computed in threads, remaining files are diffed by
+        # processes, only the two files being diffed are held in every worker.
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.env.analyze_opts.jobs
+        ) as executor:
+            decided = list(
+                executor.map(lambda file: file.diff_with_digest(), self.file_list)
+            )
+        pending_files = [file for file, ret in zip(self.file_list, decided) if not ret]
+        if not pending_files:
+            return
+        with process_context().Pool(self.env.analyze_opts.jobs) as p:
+            results = p.map(
+                diff_preprocessed_files,
+                [file.get_diff_task() for file in pending_files],
+                chunksize=1,
+            )
+        for file, result in zip(pending_files, results):
+            file.apply_diff_result(result)
+
     def diff_with_other(self, other, skip_diff: bool = False):
         # Replace all preprocess location info to empty lines.
         self.prepare_diff_dir()
@@ -959,9 +1611,23 @@ class Configuration:
                 return
         self.status = "DIFF"
         # We just need to diff files in compile database.
-        process_file_list(
-            FileInCDB.diff_with_baseline, self.file_list, self.env.analyze_opts.jobs
-        )
+        if self.env.DIFF_COMMAND is None:
+            self.diff_with_native_engine()
+        else:
+            run_file_tasks(
+                "diff_with_baseline",
+                self.file_list,
+                FileInCDB.diff_task,
+                FileInCDB.diff_done,
+                self.env.analyze_opts.jobs,
+            )
+        self.collect_diff_results()
+        if self.status == "DIFF":
+            self.session_times["diff_with_other"] = time.time() - start_time
+        else:
+            self.session_times["diff_with_other"] = SessionStatus.Failed
+
+    def collect_diff_results(self):
         for file in self.file_list:
             if file.baseline_file is not None:
                 # If this file is not changed, we reuse any files in baseline path.
@@ -991,16 +1657,12 @@ class Configuration:
             f_diff_files.close()
             f_prep_diff_files.close()
 
-            with open(self.compile_commands_used_by_analyzers, "w") as f:
-                cdb = []
-                for file in self.diff_file_list:
-                    cdb.append(file.compile_command.restore_to_json())
-                json.dump(cdb, f, indent=4)
+            dump_json_list(
+                (file.compile_command.restore_to_json() for file in self.diff_file_list),
+                self.compile_commands_used_by_analyzers,
+            )
 
             self.incrementable = self.env.inc_mode != IncrementalMode.NoInc
-            self.session_times["diff_with_other"] = time.time() - start_time
-        else:
-            self.session_times["diff_with_other"] = SessionStatus.Failed
 
     def propagate_reanalyze_attr(self):
         self.session_times["propagate_reanalyze_attr"] = SessionStatus.Skipped
@@ -1071,11 +1733,20 @@ class Configuration:
                 self.total_csa_analyze_time += float(file.csa_analyze_time)
         return self.total_csa_analyze_time
 
+    def get_each_analyzer_total_usage(self):
+        self.total_analyzers_usage = {i: ResourceUsage() for i in self.analyzers_keys}
+        for file in self.file_list:
+            for k, v in file.analyzers_usage.items():
+                self.total_analyzers_usage[k].merge(v)
+        return self.total_analyzers_usage
+
     def get_each_analyzer_total_time(self):
         self.total_analyzers_time = {}
-        self.file_analyze_status = {"ok": 0, "timeout": 0, "error": 0}
+        self.file_analyze_status = {"ok": 0, "timeout": 0, "error": 0, "degraded": 0}
         for file in self.file_list:
             timeout = error = False
+            if file.analyzers_degraded:
+                self.file_analyze_status["degraded"] += 1
             for k, v in file.analyzers_time.items():
                 if k not in self.total_analyzers_time:
                     self.total_analyzers_time[k] = 0.0
@@ -1161,8 +1832,18 @@ class Configuration:
             "affected vf indirect calls",
             "function pointer types",
             "affected fp indirect calls",
+            "preprocess time",
+            "degraded",
         ]
         headers.extend(self.analyzers_keys)
+        headers.extend(
+            [
+                f"{i} {field}"
+                for i in self.analyzers_keys
+                for field in ResourceUsage.FIELDS
+            ]
+        )
+        headers.extend([f"{i} timeout" for i in self.analyzers_keys])
         datas = []
         for file in self.file_list:
             # file, status, analyze time, cg nodes num, cf num, rf num, baseline fs num
@@ -1183,11 +1864,18 @@ class Configuration:
                     file.affected_vf_indirect_calls,
                     file.function_pointer_types,
                     file.affected_fp_indirect_calls,
+                    round(file.preprocess_time, 3),
+                    # Analyzers finished this file with degraded settings.
+                    ";".join(file.analyzers_degraded.keys()),
                 ]
             )
             datas.append(data)
             for analyzer in self.analyzers_keys:
                 data.append(file.analyzers_time[analyzer])  # type: ignore
+            for analyzer in self.analyzers_keys:
+                data.extend(file.analyzers_usage[analyzer].values())
+            for analyzer in self.analyzers_keys:
+                data.append(round(file.analyzers_timeout[analyzer], 3))
         return headers, datas
 
     def file_basic_statistics(self):
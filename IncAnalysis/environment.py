@@ -192,27 +192,31 @@ class Environment:
 
         # 查找cmake命令的位置
         self.CMAKE_PATH = shutil.which("cmake")
-        self.DIFF_PATH = shutil.which("diff")
+        self.DIFF_PATH = None
+        self.DIFF_COMMAND = None
 
-        if self.DIFF_PATH:
-            logger.info(f"diff found at: {self.CMAKE_PATH}")
-            # -b, -B: Try to ignore more space.
-            # -d: Identify smaller changes.
-            self.DIFF_COMMAND = [self.DIFF_PATH, "-b", "-B", "-d"]
-            if not self.analyze_opts.udp:
-                self.DIFF_COMMAND.extend(["-I", "'^# [[:digit:]]'"])
-            # Only output line change, don't output specific code.
-            self.DIFF_COMMAND.extend(
-                [
-                    "--old-group-format='%de,%dn %dE,%dN\n'",
-                    "--unchanged-group-format=''",
-                    "--new-group-format='%de,%dn %dE,%dN\n'",
-                    "--changed-group-format='%de,%dn %dE,%dN\n'",
-                ]
-            )
-        else:
-            logger.error("diff not found in the system path")
-            exit_if_inc()
+        if self.analyze_opts.diff_engine == "gnu":
+            self.DIFF_PATH = shutil.which("diff")
+            if self.DIFF_PATH:
+                logger.info(f"diff found at: {self.DIFF_PATH}")
+                # -b, -B: Try to ignore more space.
+                # -d: Identify smaller changes.
+                self.DIFF_COMMAND = [self.DIFF_PATH, "-b", "-B", "-d"]
+                if not self.analyze_opts.udp:
+                    self.DIFF_COMMAND.extend(["-I", "^# [[:digit:]]"])
+                # Only output line change, don't output specific code.
+                # Arguments are passed without shell, so they are not quoted.
+                self.DIFF_COMMAND.extend(
+                    [
+                        "--old-group-format=%de,%dn %dE,%dN\n",
+                        "--unchanged-group-format=",
+                        "--new-group-format=%de,%dn %dE,%dN\n",
+                        "--changed-group-format=%de,%dn %dE,%dN\n",
+                    ]
+                )
+            else:
+                logger.error("diff not found in the system path")
+                exit_if_inc()
         if self.EXTRACT_II:
             logger.info(f"Inc info extractor found at: {self.EXTRACT_II}")
         else:
@@ -305,6 +309,40 @@ class ArgumentParser:
             dest="udp",
             help="Use files in diff path to `diff`.",
         )
+        self.parser.add_argument(
+            "--diff-engine",
+            type=str,
+            dest="diff_engine",
+            choices=["native", "gnu"],
+            default="native",
+            help="Compute line changes of preprocessed files in process (native), "
+            "or with GNU diff (gnu).",
+        )
+        self.parser.add_argument(
+            "--inc-info-mode",
+            type=str,
+            dest="inc_info_mode",
+            choices=["file", "batch", "server"],
+            default="file",
+            help="Run collectIncInfo once per file (file), once per worker over "
+            "a shard of files (batch), or as long-lived workers receiving files "
+            "one by one (server). batch and server are experimental.",
+        )
+        self.parser.add_argument(
+            "--prepare-timeout",
+            type=int,
+            dest="prepare_timeout",
+            default=600,
+            help="Timeout (s) of preprocessing or diffing one file, 0 means no limit.",
+        )
+        self.parser.add_argument(
+            "--inc-info-timeout",
+            type=int,
+            dest="inc_info_timeout",
+            default=600,
+            help="Timeout (s) of collectIncInfo on one file in file and server "
+            "modes, a server exceeding it is killed and restarted. 0 means no limit.",
+        )
         supported_analyzers = ["clangsa", "clang-tidy", "cppcheck", "gsa"]
         self.parser.add_argument(
             "--analyzers",
@@ -381,6 +419,81 @@ class ArgumentParser:
             dest="basic_info",
             help="Record basic information (CG node number, etc.).",
         )
+        self.parser.add_argument(
+            "--no-preprocess-cache",
+            dest="preprocess_cache",
+            action="store_false",
+            help="Disable reusing preprocessed files whose compile command and dependencies are unchanged.",
+        )
+        self.parser.add_argument(
+            "--preprocess-job-memory",
+            type=int,
+            dest="preprocess_job_memory",
+            default=512,
+            help="Memory (MB) reserved for every preprocess job, the number of "
+            "parallel jobs is limited by available memory. 0 means no limit.",
+        )
+        self.parser.add_argument(
+            "--analyze-timeout",
+            type=int,
+            dest="analyze_timeout",
+            default=600,
+            help="Timeout (s) of an analyzer process when there is no analysis "
+            "history, otherwise the timeout is derived from history.",
+        )
+        self.parser.add_argument(
+            "--min-analyze-timeout",
+            type=int,
+            dest="min_analyze_timeout",
+            default=60,
+            help="Lower bound (s) of the timeout derived from history.",
+        )
+        self.parser.add_argument(
+            "--max-analyze-timeout",
+            type=int,
+            dest="max_analyze_timeout",
+            default=3600,
+            help="Upper bound (s) of the timeout derived from history.",
+        )
+        self.parser.add_argument(
+            "--memory-budget",
+            type=int,
+            dest="memory_budget",
+            default=0,
+            help="Memory (MB) shared by all analyzer processes, new processes are "
+            "delayed when the projected total exceeds it, so fewer than -j "
+            "analyzers may run at once. -1 means the available memory at "
+            "startup. Default is 0, no limit.",
+        )
+        self.parser.add_argument(
+            "--analyzer-job-memory",
+            type=int,
+            dest="analyzer_job_memory",
+            default=1024,
+            help="Memory (MB) expected for an analyzer process without history.",
+        )
+        self.parser.add_argument(
+            "--analyzer-memory-limit",
+            type=int,
+            dest="analyzer_memory_limit",
+            default=0,
+            help="Address space limit (MB) of every analyzer process, so a runaway "
+            "file fails alone. 0 means no limit.",
+        )
+        self.parser.add_argument(
+            "--no-degraded-retry",
+            dest="degraded_retry",
+            action="store_false",
+            help="Disable re-analyzing timed out files by CSA with cheaper settings.",
+        )
+        self.parser.add_argument(
+            "--no-pipeline",
+            dest="pipeline",
+            action="store_false",
+            help="Disable analyzing a changed file as soon as it's prepared, wait "
+            "for all files to be preprocessed, diffed and extracted first. The "
+            "pipeline is only used for incremental analysis without CTU.",
+        )
         self.parser.add_argument(
             "--no-clean-inc",
             dest="clean_inc",
@@ -1,14 +1,24 @@
 import hashlib
 import os
 import subprocess
+import time
 from enum import Enum, auto
-from subprocess import run
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
 
 from IncAnalysis.analyzer_config import *
+from IncAnalysis.call_graph import ArrayCallGraph, BinaryCallGraph, CSRCallGraph
 from IncAnalysis.compile_command import CompileCommand
+from IncAnalysis.function_summary import FunctionSummaryTable, load_function_summaries
+from IncAnalysis.line_diff import diff_preprocessed_files
 from IncAnalysis.logger import logger
-from IncAnalysis.utils import commands_to_shell_script, makedir, remove_file
+from IncAnalysis.orchestrator import CommandResult, CommandTask, FunctionTask
+from IncAnalysis.process import ResourceUsage
+from IncAnalysis.utils import (
+    commands_to_shell_script,
+    makedir,
+    preprocessed_file_digest,
+    remove_file,
+)
 
 
 def get_sha256_hash(data, encoding="utf-8"):
@@ -24,6 +34,8 @@ class FileKind(Enum):
     AST = auto()
     EFM = auto()
     CG = auto()
+    CGB = auto()  # Binary call graph.
+    CGD = auto()  # Calls of changed functions.
     CF = auto()
     INCSUM = auto()
     BASIC = auto()
@@ -76,86 +88,49 @@ class DiffResult:
         return ret
 
 
-class FunctionSummary:
-    def __init__(self, fs: List[int]) -> None:
-        self.TotalBasicBlocks = fs[0]
-        self.InlineChecked = fs[1]
-        self.MayInline = fs[2]
-        self.TimesInlined = fs[3]
-
-    def __repr__(self) -> str:
-        return f"[TB:{self.TotalBasicBlocks}, IC:{self.InlineChecked}, MI:{self.MayInline}, TI:{self.TimesInlined}]"
-
-    def ok_to_ignore(self):
-        return (
-            self.InlineChecked != 0 and self.MayInline == 0 and self.TimesInlined == 0
-        )
-
-
-class CallGraphNode:
-    def __init__(self, fname):
-        # Function name
-        self.fname: str = fname
-        self.callers: List[CallGraphNode] = []
-        self.callers_set: set = set()
-        self.should_reanalyze = False
-
-    def add_caller(self, caller):
-        self.callers_set.add(caller.fname)
-        self.callers.append(caller)
-
-    def in_callers(self, fname):
-        # Maybe there should be a `callers_set` to accelerate this function.
-        return fname in self.callers_set
-
-    def __repr__(self) -> str:
-        ret = f"{self.fname}" + ":{"
-        for caller in self.callers:
-            ret += "\t"
-            ret += f"{caller.fname}\n"
-        ret += "}\n"
-        return ret
-
-
-class CallGraph:
-    def __init__(self, cg_file_path: str, is_baseline=False):
-        self.fname_to_cg_node: Dict[str, CallGraphNode] = {}
-        self.is_baseline: bool = is_baseline
-        self.functions_need_reanalyzed: set = set()
-        self.cg_file_path = cg_file_path
-
-    def get_node_if_exist(self, fname: str):
-        if fname in self.fname_to_cg_node:
-            return self.fname_to_cg_node[fname]
-        return None
-
-    def get_or_insert_node(self, fname: str) -> CallGraphNode:
-        assert fname
-        if fname not in self.fname_to_cg_node:
-            self.fname_to_cg_node[fname] = CallGraphNode(fname)
-        return self.fname_to_cg_node[fname]
-
-    def add_node(self, caller, callee=None):
-        caller_node = self.get_or_insert_node(caller)
-        if callee:
-            callee_node = self.get_or_insert_node(callee)
-            callee_node.add_caller(caller_node)
-
-    def mark_as_reanalye(self, node: CallGraphNode):
-        node.should_reanalyze = True
-        self.functions_need_reanalyzed.add(node.fname)
-
-    def __repr__(self) -> str:
-        ret = ""
-        for cn in self.fname_to_cg_node.values():
-            ret += cn.__repr__()
-        return ret
-
-
 class FileInCDB:
+    # Latest version of every file is kept alive across versions, don't use
+    # per instance dict.
+    __slots__ = (
+        "digest",
+        "prep_file",
+        "baseline_file",
+        "parent",
+        "file_name",
+        "identifier",
+        "_sha256",
+        "status",
+        "compile_command",
+        "efm",
+        "extname",
+        "cf_num",
+        "has_cf",
+        "cg_node_num",
+        "has_cg",
+        "rf_num",
+        "has_rf",
+        "cross_tu_rf_num",
+        "affected_virtual_functions",
+        "affected_vf_indirect_calls",
+        "function_pointer_types",
+        "affected_fp_indirect_calls",
+        "basline_fs_num",
+        "baseline_has_fs",
+        "csa_analyze_time",
+        "analyzers_time",
+        "analyzers_memory",
+        "analyzers_usage",
+        "analyzers_timeout",
+        "analyzers_degraded",
+        "analyzers_status",
+        "preprocess_time",
+    )
+
     def __init__(
         self, parent, compile_command: Optional[CompileCommand], cache_file=None
     ):
+        # Digest of preprocessed file, ignore line markers and blank lines.
+        self.digest: Optional[str] = None
         if cache_file:
             self.prep_file: str = cache_file
             self.baseline_file = None
@@ -167,9 +142,8 @@ class FileInCDB:
         self.parent: Configuration = parent
         self.file_name: str = compile_command.file
         self.identifier: str = compile_command.identifier
-        self.sha256 = get_sha256_hash(self.identifier)
+        self._sha256: Optional[str] = None
         self.status = FileStatus.NEW
-        self.csa_file: str = str(self.parent.csa_path) + self.identifier
         self.compile_command: CompileCommand = compile_command
         self.efm: Dict[str, str] = {}
 
@@ -181,6 +155,8 @@ class FileInCDB:
         self.has_cg = False  # File has .cg.
         self.rf_num = "All"
         self.has_rf = False  # Propagate reanalyze attribute(if needed) successfully.
+        # Functions reanalyzed because of changes in other TUs.
+        self.cross_tu_rf_num = 0
         self.affected_virtual_functions = 0
         self.affected_vf_indirect_calls = 0
         self.function_pointer_types = 0
@@ -189,6 +165,17 @@ class FileInCDB:
         self.baseline_has_fs = False  # Analysis finished successfully.
         self.csa_analyze_time = "Unknown"
         self.analyzers_time = {i: 0.0 for i in self.parent.analyzers_keys}
+        # Peak RSS of analyzer processes, in bytes.
+        self.analyzers_memory = {i: 0 for i in self.parent.analyzers_keys}
+        self.analyzers_usage = {i: ResourceUsage() for i in self.parent.analyzers_keys}
+        self.analyzers_timeout = {i: 0.0 for i in self.parent.analyzers_keys}
+        # Time cost of successful re-analysis with degraded settings after
+        # timeout.
+        self.analyzers_degraded = {}
+        # Result of analysis in this version: ok, timeout, error or degraded
+        # (finished with degraded settings after timeout).
+        self.analyzers_status = {}
+        self.preprocess_time = 0.0
         self.extname = ""
         if self.compile_command.language == "c++":
             self.extname = ".ii"
@@ -211,7 +198,7 @@ class FileInCDB:
             return
         self.baseline_file: Optional[FileInCDB] = None
         if self.parent.update_mode:
-            old_file = self.parent.global_file_dict.get(self.identifier)
+            old_file = self.parent.get_cached_file(self.identifier)
             if old_file is not None:
                 self.status = FileStatus.UNCHANGED
                 self.baseline_file = old_file
@@ -235,6 +222,16 @@ class FileInCDB:
                     pass
                     # logger.debug(f"[FileInCDB Init] Find new file {self.file_name}")
 
+    @property
+    def sha256(self) -> str:
+        if self._sha256 is None:
+            self._sha256 = get_sha256_hash(self.identifier)
+        return self._sha256
+
+    @property
+    def csa_file(self) -> str:
+        return str(self.parent.csa_path) + self.identifier
+
     def clean_cache(self):
         if hasattr(self, "prep_file"):
             remove_file(self.prep_file)
@@ -290,6 +287,10 @@ class FileInCDB:
             return str(self.parent.gsa_output_path) + "/" + self.sha256 + ".sarif"
         elif kind == FileKind.CG:
             return (self.prep_file) + ".cg"
+        elif kind == FileKind.CGB:
+            return (self.prep_file) + ".cgb"
+        elif kind == FileKind.CGD:
+            return (self.prep_file) + ".cgd"
         elif kind == FileKind.CF:
             return (self.prep_file) + ".cf"
         elif kind == FileKind.INCSUM:
@@ -297,7 +298,11 @@ class FileInCDB:
         elif kind == FileKind.BASIC:
             return (self.prep_file) + ".json"
         elif kind == FileKind.RF:
-            return (self.prep_file) + ".rf"
+            # Unchanged files may be reanalyzed because of changes in other TUs,
+            # don't rely on the prep_file, because it may change to baseline path.
+            return (
+                str(self.parent.preprocess_path) + self.identifier + self.extname + ".rf"
+            )
         elif kind == FileKind.ANR:
             return (self.prep_file) + ".anr"
         elif kind == FileKind.CPPRF:
@@ -308,7 +313,21 @@ class FileInCDB:
             logger.error(f"[Get File Path] Unknown file kind {kind}")
             return ""
 
-    def preprocess_file(self) -> bool:
+    def get_output_path(self, analyzer_name: str) -> Optional[str]:
+        # Where the analyzer writes reports of this file.
+        if analyzer_name == "CSA":
+            return str(self.parent.csa_output_path / self.identifier[1:])
+        elif analyzer_name == "ClangTidy":
+            return self.get_file_path(FileKind.FIX)
+        elif analyzer_name == "CppCheck":
+            return self.get_file_path(FileKind.CPPCHECK)
+        elif analyzer_name == "Infer":
+            return self.get_file_path(FileKind.INFER)
+        elif analyzer_name == "GSA":
+            return self.get_file_path(FileKind.GCC)
+        return None
+
+    def preprocess_task(self) -> Union[CommandTask, bool]:
         commands = [
             (
                 self.parent.env.analyze_opts.cc
@@ -316,36 +335,125 @@ class FileInCDB:
                 else self.parent.env.analyze_opts.cxx
             )
         ]
-        commands.extend(self.compile_command.arguments + ["-D__clang_analyzer__"])
+        commands.extend(self.compile_command.arguments)
+        commands.append("-D__clang_analyzer__")
         commands.extend(["-E"])
-        commands.extend(["-o", f"{self.prep_file}"])
         makedir(os.path.dirname(self.prep_file))
 
-        try:
-            logger.debug(f"[Preprocess Script] {commands_to_shell_script(commands)}")
-            run(
-                commands_to_shell_script(commands),
-                capture_output=True,
-                text=True,
-                check=True,
-                shell=True,
-                cwd=self.compile_command.directory,
+        cache = self.parent.preprocess_cache
+        context = None
+        if cache is not None:
+            # Output path changes every version, don't take it into account.
+            command_digest = cache.command_digest(
+                commands, self.compile_command.directory
             )
-        except subprocess.CalledProcessError as e:
+            if cache.restore(self.identifier, command_digest, self.prep_file):
+                logger.debug(f"[Preprocess Cache Hit] {self.prep_file}")
+                return True
+            # Record dependencies to validate this file next time.
+            dep_file = self.prep_file + ".d"
+            commands.extend(["-MD", "-MF", dep_file])
+            context = (command_digest, dep_file, time.time_ns())
+        commands.extend(["-o", f"{self.prep_file}"])
+        # Launch compiler directly, output is written to prep_file.
+        return CommandTask(
+            commands,
+            cwd=self.compile_command.directory,
+            timeout=self.prepare_timeout(),
+            stdout=subprocess.DEVNULL,
+            context=context,
+        )
+
+    def prepare_timeout(self) -> Optional[float]:
+        # Timeout of preprocessing and diffing this file.
+        timeout = self.parent.env.analyze_opts.prepare_timeout
+        return timeout if timeout > 0 else None
+
+    def preprocess_done(self, task: CommandTask, result: CommandResult) -> bool:
+        self.preprocess_time = result.timecost
+        cache = self.parent.preprocess_cache
+        if result.returncode != 0:
             self.status = FileStatus.PREPROCESS_FAILED
             logger.error(
-                f"[Preprocess Failed] {self.prep_file}\nscript:\n{commands_to_shell_script(commands)}\nstdout:\n{e.stdout}\nstderr:\n{e.stderr}"
+                f"[Preprocess Failed] {self.prep_file}\nscript:\n{commands_to_shell_script(task.commands)}\nstderr:\n{result.stderr_text}"
             )
+            if cache is not None:
+                remove_file(task.context[1])
             return False
 
+        if cache is not None:
+            (command_digest, dep_file, start_time_ns) = task.context
+            cache.store(
+                self.identifier,
+                command_digest,
+                dep_file,
+                self.prep_file,
+                self.compile_command.directory,
+                start_time_ns,
+            )
         return True
 
-    def diff_with_baseline(self) -> bool:
+    def diff_with_digest(self) -> bool:
+        # Return True if the diff result is decided without diffing contents.
         if self.baseline_file is None:
             # This is a new file.
             with open(self.get_file_path(FileKind.DIFF_INFO), "w") as f:
                 f.write("new")
             return True
+        # Most files don't change between versions, compare digests first
+        # to avoid diffing contents.
+        self.digest = preprocessed_file_digest(self.prep_file)
+        if self.baseline_file.digest is None:
+            self.baseline_file.digest = preprocessed_file_digest(
+                self.baseline_file.prep_file
+            )
+        if self.digest is not None and self.digest == self.baseline_file.digest:
+            self.status = FileStatus.UNCHANGED
+            return True
+        return False
+
+    def get_diff_task(self):
+        # Arguments of `diff_preprocessed_files`.
+        if self.parent.env.analyze_opts.udp:
+            return (
+                str(self.baseline_file.get_file_path(FileKind.DIFF)),
+                str(self.get_file_path(FileKind.DIFF)),
+                str(self.get_file_path(FileKind.DIFF_INFO)),
+                False,
+            )
+        return (
+            str(self.baseline_file.prep_file),
+            str(self.prep_file),
+            str(self.get_file_path(FileKind.DIFF_INFO)),
+            True,
+        )
+
+    def apply_diff_result(self, result: Optional[bool]) -> bool:
+        if result is None:
+            self.status = FileStatus.DIFF_FAILED
+            return False
+        self.status = FileStatus.CHANGED if result else FileStatus.UNCHANGED
+        return True
+
+    def native_diff_task(self) -> Union[FunctionTask, bool]:
+        # Diff with native engine in a worker process.
+        if self.diff_with_digest():
+            return True
+        return FunctionTask(
+            diff_preprocessed_files,
+            (self.get_diff_task(),),
+            timeout=self.prepare_timeout(),
+        )
+
+    def native_diff_done(self, task: FunctionTask, result: CommandResult) -> bool:
+        if result.error is not None:
+            logger.error(f"[Native Diff Failed] {self.prep_file}: {result.error}")
+        return self.apply_diff_result(result.value)
+
+    def diff_task(self) -> Union[CommandTask, bool]:
+        # Diff with external diff command.
+        if self.diff_with_digest():
+            return True
         commands = self.parent.env.DIFF_COMMAND.copy()
         if self.parent.env.analyze_opts.udp:
             commands.extend(
@@ -356,60 +464,86 @@ class FileInCDB:
             )
         else:
             commands.extend([str(self.baseline_file.prep_file), str(self.prep_file)])
-        diff_script = " ".join(commands)
-        # logger.debug("[Diff Files Script] " + diff_script)
-        process = run(diff_script, shell=True, capture_output=True, text=True)
-        if process.returncode == 0 or process.returncode == 1:
-            if process.returncode == 0:
+        return CommandTask(commands, timeout=self.prepare_timeout())
+
+    def diff_done(self, task: CommandTask, result: CommandResult) -> bool:
+        if result.returncode == 0 or result.returncode == 1:
+            if result.returncode == 0:
                 # There is no change between this file and baseline.
                 self.status = FileStatus.UNCHANGED
                 return True
             self.status = FileStatus.CHANGED
             # Don't record diff_info anymore, but write them to correspond files.
-            with open(self.get_file_path(FileKind.DIFF_INFO), "w") as f:
-                f.write(process.stdout)
-            # logger.debug(f"[Diff Files Output] \n{process.stdout}")
+            with open(self.get_file_path(FileKind.DIFF_INFO), "wb") as f:
+                f.write(result.stdout)
         else:
             self.status = FileStatus.DIFF_FAILED
             logger.error(
-                f"[Diff Files Failed] stdout: {process.stdout}\n stderr: {process.stderr}"
+                f"[Diff Files Failed] stdout: {result.stdout_text}\n stderr: {result.stderr_text}"
             )
             return False
         return True
 
-    def extract_inc_info(self) -> bool:
-        commands = [self.parent.env.EXTRACT_II]
-        commands.append(self.prep_file)
+    def inc_info_file_options(self) -> Dict[str, str]:
+        # Options of collectIncInfo specific to this file.
+        options = {}
         if self.parent.incrementable:
-            commands.extend(["-diff", self.get_file_path(FileKind.DIFF_INFO)])
-        if self.parent.env.ctu:
-            commands += ["-ctu"]
-        commands.extend(["-rf-file", self.get_file_path(FileKind.RF)])
-        # ClangTidy line-level filter.
-        if self.parent.enable_clangtidy:
-            commands.extend(["--dump-anr"])
+            options["diff"] = self.get_file_path(FileKind.DIFF_INFO)
+        options["rf-file"] = self.get_file_path(FileKind.RF)
+        # Patch the recorded call graph instead of dumping the whole one.
+        if (
+            self.parent.cross_tu_propagation()
+            and self.parent.incrementable
+            and self.parent.cache_index is not None
+            and self.parent.cache_index.has_call_graph(self.identifier)
+        ):
+            options["cg-delta-file"] = self.get_file_path(FileKind.CGD)
         # Cppcheck function-level incremental.
         if self.parent.enable_cppcheck:
-            commands.extend(["-file-path", self.identifier])
-            commands.extend(["-cppcheck-rf-file", self.get_file_path(FileKind.CPPRF)])
+            options["file-path"] = self.identifier
+            options["cppcheck-rf-file"] = self.get_file_path(FileKind.CPPRF)
         # GSA function-level incremental.
         if self.parent.enable_gsa:
-            commands.extend(["-gcc-rf-file", self.get_file_path(FileKind.GCCRF)])
-        commands += (
-            ["--", "-w"] + self.compile_command.arguments + ["-D__clang_analyzer__"]
-        )
-        ii_script = commands_to_shell_script(commands)
-        try:
-            run(commands, capture_output=True, text=True, check=True)
-            logger.debug(f"[File Inc Info Success] {ii_script}")
-            # Parse rf_num to skip some files not need to be reanalyzed.
-            self.parse_inc_sum()
-            return True
-        except subprocess.CalledProcessError as e:
+            options["gcc-rf-file"] = self.get_file_path(FileKind.GCCRF)
+        return options
+
+    def inc_info_batch_job(self) -> Dict:
+        # Job of `collectIncInfo -batch`, the source file is not in arguments.
+        job = {
+            "file": self.prep_file,
+            "directory": self.compile_command.directory,
+            "arguments": [
+                "-w",
+                *self.compile_command.flag_set.flags,
+                "-D__clang_analyzer__",
+            ],
+        }
+        job.update(self.inc_info_file_options())
+        return job
+
+    def inc_info_task(self) -> CommandTask:
+        commands = [self.parent.env.EXTRACT_II]
+        commands.append(self.prep_file)
+        for option, value in self.inc_info_file_options().items():
+            commands.extend([f"-{option}", value])
+        commands.extend(self.parent.inc_info_options())
+        commands += [
+            "--", "-w", *self.compile_command.arguments, "-D__clang_analyzer__"
+        ]
+        timeout = self.parent.env.analyze_opts.inc_info_timeout
+        return CommandTask(commands, timeout=timeout if timeout > 0 else None)
+
+    def inc_info_done(self, task: CommandTask, result: CommandResult) -> bool:
+        ii_script = commands_to_shell_script(task.commands)
+        if result.returncode != 0:
             logger.error(
-                f"[File Inc Info Failed] {ii_script}\n stdout: {e.stdout}\n stderr: {e.stderr}"
+                f"[File Inc Info Failed] {ii_script}\n stdout: {result.stdout_text}\n stderr: {result.stderr_text}"
             )
             return False
+        logger.debug(f"[File Inc Info Success] {ii_script}")
+        # Parse rf_num to skip some files not need to be reanalyzed.
+        self.parse_inc_sum()
+        return True
 
     def parse_inc_sum(self) -> bool:
         inc_sum_file = self.get_file_path(FileKind.INCSUM)
@@ -444,79 +578,64 @@ class FileInCDB:
                     self.affected_fp_indirect_calls = int(val)
         return True
 
-    def extract_basic_info(self) -> bool:
+    def basic_info_task(self) -> Union[CommandTask, bool]:
         if not self.parent.env.EXTRACT_BASIC_II:
             # Can not find extract basic info tool.
             return True
         commands = [self.parent.env.EXTRACT_BASIC_II]
         commands.append(self.file_name)
         commands.extend(["-o", self.get_file_path(FileKind.BASIC)])
-        commands += (
-            ["--", "-w"] + self.compile_command.arguments + ["-D__clang_analyzer__"]
-        )
+        commands += [
+            "--", "-w", *self.compile_command.arguments, "-D__clang_analyzer__"
+        ]
         compiler = self.compile_command.compiler
         commands += [
             "-isystem",
             os.path.join(self.parent.env.system_dir[compiler], "include"),
         ]
-        basic_ii_script = commands_to_shell_script(commands)
-        try:
-            run(
-                commands,
-                capture_output=True,
-                text=True,
-                check=True,
-                cwd=self.compile_command.directory,
-            )
-            logger.debug(f"[Basic Info Success] {basic_ii_script}")
-            statistics_json = json.load(open(self.get_file_path(FileKind.BASIC), "r"))
-            for file, statistics in statistics_json.items():
-                if statistics["kind"] == "SYSTEM":
-                    # Some times user header will be recognize as system header.
-                    # Fix it by checking if the file is in src or build directory.
-                    if file.startswith(str(self.parent.src_path)) or file.startswith(
-                        str(self.parent.build_path)
-                    ):
-                        statistics["kind"] = "USER"
-            json.dump(statistics_json, open(self.get_file_path(FileKind.BASIC), "w"))
-            return True
-        except subprocess.CalledProcessError as e:
+        return CommandTask(commands, cwd=self.compile_command.directory)
+
+    def basic_info_done(self, task: CommandTask, result: CommandResult) -> bool:
+        basic_ii_script = commands_to_shell_script(task.commands)
+        if result.returncode != 0:
             logger.error(
-                f"[Basic Info Failed] {basic_ii_script}\n stdout: {e.stdout}\n stderr: {e.stderr}"
+                f"[Basic Info Failed] {basic_ii_script}\n stdout: {result.stdout_text}\n stderr: {result.stderr_text}"
             )
             return False
+        logger.debug(f"[Basic Info Success] {basic_ii_script}")
+        statistics_json = json.load(open(self.get_file_path(FileKind.BASIC), "r"))
+        for file, statistics in statistics_json.items():
+            if statistics["kind"] == "SYSTEM":
+                # Some times user header will be recognize as system header.
+                # Fix it by checking if the file is in src or build directory.
+                if file.startswith(str(self.parent.src_path)) or file.startswith(
+                    str(self.parent.build_path)
+                ):
+                    statistics["kind"] = "USER"
+        json.dump(statistics_json, open(self.get_file_path(FileKind.BASIC), "w"))
+        return True
 
-    def parse_cg_file(self) -> Optional[CallGraph]:
-        # .cg file format:
-        # caller
-        # [
-        # callees
-        # ]
-        cg_file = self.get_file_path(FileKind.CG)
-        if not cg_file or not os.path.exists(cg_file):
-            # The reason of .cg file doesn't exists maybe the file in compile_commands.json
-            # cannot preprocess correctly.
-            logger.error(f"[Parse CG File] Callgraph file {cg_file} doesn't exist.")
-            return None
-        call_graph = CallGraph(cg_file)
+    def parse_cg_file(self) -> Optional[CSRCallGraph]:
+        # Prefer .cgb, which is mapped instead of parsed.
+        cgb_file = self.get_file_path(FileKind.CGB)
+        call_graph: Optional[CSRCallGraph] = None
+        if os.path.exists(cgb_file):
+            try:
+                call_graph = BinaryCallGraph(cgb_file)
+            except (OSError, ValueError) as e:
+                logger.error(f"[Parse CG File] Cannot load {cgb_file}: {e}")
+        if call_graph is None:
+            cg_file = self.get_file_path(FileKind.CG)
+            if not cg_file or not os.path.exists(cg_file):
+                # The reason of .cg file doesn't exists maybe the file in compile_commands.json
+                # cannot preprocess correctly.
+                logger.error(
+                    f"[Parse CG File] Callgraph file {cg_file} doesn't exist."
+                )
+                return None
+            call_graph = ArrayCallGraph(cg_file)
         self.has_cg = True
-        with open(cg_file, "r") as f:
-            caller, callee = None, None
-            is_caller = True
-            for line in f.readlines():
-                line = line.strip()
-                if line.startswith("["):
-                    is_caller = False
-                elif line.startswith("]"):
-                    is_caller = True
-                else:
-                    if is_caller:
-                        caller = line
-                        call_graph.add_node(caller)
-                    else:
-                        callee = line
-                        call_graph.add_node(caller, callee)
-        self.cg_node_num = len(call_graph.fname_to_cg_node.keys())
+        self.cg_node_num = len(call_graph)
         return call_graph
 
     def parse_cf_file(self) -> Optional[list]:
@@ -535,33 +654,18 @@ class FileInCDB:
         self.cf_num = len(functions_changed)
         return functions_changed
 
-    def parse_baseline_fs_file(self) -> Optional[Dict[str, FunctionSummary]]:
-        # .fs file format
-        # func_name
-        # TotalBasicBlocks,InlineChecked,MayInline,TimesInlined
+    def parse_baseline_fs_file(self) -> Optional[FunctionSummaryTable]:
         if self.baseline_file is None:
             return None
         fs_file = self.baseline_file.get_file_path(FileKind.FS)
-        if fs_file is None or not os.path.exists(fs_file):
+        function_summaries = None
+        if fs_file is not None:
+            function_summaries = load_function_summaries(fs_file)
+        if function_summaries is None:
             logger.error(
                 f"[Parse FS File] Function Summary file {fs_file} doesn't exist."
             )
             return None
-        function_summaries: Dict = {}
-        with open(fs_file, "r") as f:
-            is_func = True
-            func_name = None
-            for line in f.readlines():
-                line: str = line.strip()
-                if not line:
-                    break
-                if is_func:
-                    func_name = line
-                else:
-                    fs = line.split(",")
-                    fs = [int(i) for i in fs]
-                    function_summaries[func_name] = FunctionSummary(fs)
-                is_func = not is_func
         self.baseline_has_fs = True
         self.basline_fs_num = len(function_summaries)
         return function_summaries
@@ -575,27 +679,54 @@ class FileInCDB:
                 f.write(fname + "\n")
         self.has_rf = True
 
+    def changed_usrs(self, call_graph: BinaryCallGraph) -> List[str]:
+        # USRs of functions defined in this file whose analysis may change,
+        # callers in other TUs need to be reanalyzed under CTU analysis.
+        if not self.has_rf:
+            # New file or failed to extract inc info, all functions may change.
+            return [
+                call_graph.usr(node)
+                for node in range(len(call_graph))
+                if call_graph.is_defined(node)
+            ]
+        rf_path = self.get_file_path(FileKind.RF)
+        if not os.path.exists(rf_path):
+            return []
+        usrs = []
+        with open(rf_path, "r") as f:
+            for line in f:
+                node = call_graph.get_node_if_exist(line.strip())
+                if node is not None and call_graph.is_defined(node):
+                    usrs.append(call_graph.usr(node))
+        return usrs
+
+    def add_reanalyzed_functions(self, functions: List[str]):
+        # Reanalyze `functions` in addition to the ones found in this file.
+        rf_path = self.get_file_path(FileKind.RF)
+        functions_need_reanalyzed = set()
+        if self.has_rf and os.path.exists(rf_path):
+            with open(rf_path, "r") as f:
+                functions_need_reanalyzed.update(line.strip() for line in f)
+        functions_need_reanalyzed.update(functions)
+        self.cross_tu_rf_num += len(functions)
+        self.output_reanalyzed_functions(functions_need_reanalyzed)
+
     def propagate_reanalyze_attribute_without_fs(
-        self, functions_changed: List[str], call_graph: CallGraph
+        self, functions_changed: List[str], call_graph: CSRCallGraph
     ):
         # Without function summary information, we have to mark all caller as reanalyzed.
         # And the terminative rule is cannot find caller anymore, or caller has been mark as reanalyzed.
+        nodes_from_cf = []
         for fname in functions_changed:
-            # Propagate to all callers
             node_from_cf = call_graph.get_node_if_exist(fname)
-            if not node_from_cf:
+            if node_from_cf is None:
                 logger.error(
                     f"[Propagate Func Reanalyze] Can not found {fname} in call graph"
                 )
                 continue
-            worklist = [node_from_cf]
-            while len(worklist) != 0:
-                node = worklist.pop()
-                if node.should_reanalyze:
-                    continue
-                call_graph.mark_as_reanalye(node)
-                for caller in node.callers:
-                    worklist.append(caller)
+            nodes_from_cf.append(node_from_cf)
+        # Propagate to all callers of all changed functions at once.
+        call_graph.mark_reachable_callers(nodes_from_cf)
         self.output_reanalyzed_functions(call_graph.functions_need_reanalyzed)
 
     def propagate_reanalyze_attribute(self):
@@ -625,54 +756,35 @@ class FileInCDB:
             return
 
         # Step 3:Parse function summaries.
-        baseline_fs: Optional[Dict[str, FunctionSummary]] = (
-            self.parse_baseline_fs_file()
-        )
+        baseline_fs: Optional[FunctionSummaryTable] = self.parse_baseline_fs_file()
         if baseline_fs is None:
             return
 
-        # logger.debug(f"[propagate_reanalyze_attribute] Dump CallGraph\n{self.call_graph.__repr__()}")
-        # logger.debug(f"[propagate_reanalyze_attribute] Dump Baseline CG\n{baseline_cg_with_fs.__repr__()}")
-
-        # Make sure function_need_reanalyzed_from_rf sorted by reverse post order.
-        # Note: Traverse by reverse post order seem to be not neccessary, `node.should_reanalyze`
-        #       will skip
-        # There are two more terminative rules when node is in baseline call graph:
-        # 1. Caller is in baseline call graph, we just need to traverse upward it if it's
-        #    in inline_callers.
-        # 2. Caller is not in baseline call graph, which means it is a new function. Because we
-        #    traverse `fname` by reverse post order, this kind of callers have been processed before,
-        #    it's ok to terminate at these callers.
+        # Changed functions are always traversed upward, because changes on them
+        # may affect inline behavior of CSA. CSA's inline strategy consider inline
+        # times as criteria, so that inline behavior of callers may change even
+        # if they don't change.
+        # Other callers are traversed upward unless they are in baseline call
+        # graph and ok to ignore according to their function summaries. Callers
+        # not in baseline call graph are new functions, don't need to consider
+        # their inline information.
+        nodes_from_cf = []
         for fname in functions_changed:
             node_from_cf = call_graph.get_node_if_exist(fname)
-            if not node_from_cf:
+            if node_from_cf is None:
                 # If the changed function's definition in other translation unit, it may not appear
                 # in CallGraph.
                 logger.error(
                     f"[Propagate Func Reanalyze] Can not found {fname} in {self.get_file_path(FileKind.CG)}"
                 )
                 continue
-            call_graph.mark_as_reanalye(node_from_cf)
-            # For soundness, don't use the two terminative rules on `node_from_cf`'s callers,
-            # because changes on `node_from_cf` may affect inline behavior of CSA. We assume
-            # that if caller doesn't change, the inline behavior of it will not change.(If
-            # inline behavior changes actually, it doesn't influence soundness, beacuse the
-            # caller or more high level caller must be changed and mark as reanalyze.)
-            # WRONG! CSA's inline strategy consider inline times as criteria, so that inline
-            # behavior will change even caller doesn't change.
-            worklist = [caller for caller in node_from_cf.callers]
-            while len(worklist) != 0:
-                node: CallGraphNode = worklist.pop()
-                if node.should_reanalyze:
-                    continue
-                call_graph.mark_as_reanalye(node)
-                fs_in_baseline: Optional[FunctionSummary] = baseline_fs.get(node.fname)
-                if fs_in_baseline is not None:
-                    if not fs_in_baseline.ok_to_ignore():
-                        worklist.extend(node.callers)
-                else:
-                    # New function node, don't need to consider its inline information.
-                    for caller in node.callers:
-                        worklist.append(caller)
+            nodes_from_cf.append(node_from_cf)
+        # ok_to_ignore is evaluated for the whole frontier at once.
+        call_graph.mark_reachable_callers(
+            nodes_from_cf,
+            lambda frontier: baseline_fs.ok_to_ignore(
+                [call_graph.fname(node) for node in frontier]
+            ),
+        )
         # Step 4:Output functions need reanalyze.
         self.output_reanalyzed_functions(call_graph.functions_need_reanalyzed)
@@ -0,0 +1,111 @@
+import functools
+import os
+from array import array
+from typing import Dict, List, Optional, Sequence
+
+
+class FunctionSummary:
+    def __init__(self, fs: List[int]) -> None:
+        self.TotalBasicBlocks = fs[0]
+        self.InlineChecked = fs[1]
+        self.MayInline = fs[2]
+        self.TimesInlined = fs[3]
+
+    def __repr__(self) -> str:
+        return f"[TB:{self.TotalBasicBlocks}, IC:{self.InlineChecked}, MI:{self.MayInline}, TI:{self.TimesInlined}]"
+
+    def ok_to_ignore(self):
+        return (
+            self.InlineChecked != 0 and self.MayInline == 0 and self.TimesInlined == 0
+        )
+
+
+class FunctionSummaryTable:
+    # Function summaries of .fs in columns, row i is the i-th function, no
+    # object is created per function.
+    def __init__(self, fs_file: str):
+        self.fs_file = fs_file
+        self.names: List[str] = []
+        self.name_to_row: Dict[str, int] = {}
+        self.total_basic_blocks = array("q")
+        self.inline_checked = array("q")
+        self.may_inline = array("q")
+        self.times_inlined = array("q")
+        # .fs file format
+        # func_name
+        # TotalBasicBlocks,InlineChecked,MayInline,TimesInlined
+        with open(fs_file, "r") as f:
+            func_name = None
+            for line in f:
+                line = line.strip()
+                if not line:
+                    break
+                if func_name is None:
+                    func_name = line
+                    continue
+                (tb, ic, mi, ti) = line.split(",")[:4]
+                row = self.name_to_row.get(func_name)
+                if row is None:
+                    self.name_to_row[func_name] = len(self.names)
+                    self.names.append(func_name)
+                    self.total_basic_blocks.append(int(tb))
+                    self.inline_checked.append(int(ic))
+                    self.may_inline.append(int(mi))
+                    self.times_inlined.append(int(ti))
+                else:
+                    # Keep the last one like a dict.
+                    self.total_basic_blocks[row] = int(tb)
+                    self.inline_checked[row] = int(ic)
+                    self.may_inline[row] = int(mi)
+                    self.times_inlined[row] = int(ti)
+                func_name = None
+        # FunctionSummary.ok_to_ignore of every row.
+        self.ignorable = bytes(
+            ic != 0 and mi == 0 and ti == 0
+            for ic, mi, ti in zip(
+                self.inline_checked, self.may_inline, self.times_inlined
+            )
+        )
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def row(self, fname: str) -> Optional[int]:
+        return self.name_to_row.get(fname)
+
+    def get(self, fname: str) -> Optional[FunctionSummary]:
+        row = self.name_to_row.get(fname)
+        if row is None:
+            return None
+        return FunctionSummary(
+            [
+                self.total_basic_blocks[row],
+                self.inline_checked[row],
+                self.may_inline[row],
+                self.times_inlined[row],
+            ]
+        )
+
+    def ok_to_ignore(self, fnames: Sequence[str]) -> List[bool]:
+        # ok_to_ignore of every function in `fnames`, functions without
+        # summary (new functions) are not ignorable.
+        (rows, ignorable) = (self.name_to_row, self.ignorable)
+        return [
+            row is not None and ignorable[row] != 0
+            for row in map(rows.get, fnames)
+        ]
+
+
+@functools.lru_cache(maxsize=64)
+def _load_function_summaries(fs_file: str, mtime_ns: int, size: int):
+    return FunctionSummaryTable(fs_file)
+
+
+def load_function_summaries(fs_file: str) -> Optional[FunctionSummaryTable]:
+    # Tables are shared by all callers until the file changes, don't modify
+    # them.
+    try:
+        stat = os.stat(fs_file)
+    except OSError:
+        return None
+    return _load_function_summaries(fs_file, stat.st_mtime_ns, stat.st_size)
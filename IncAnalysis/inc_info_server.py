@@ -0,0 +1,146 @@
+import json
+import os
+import queue
+import select
+import subprocess
+import time
+from typing import Dict, List, Optional
+
+from IncAnalysis.logger import logger
+
+# collectIncInfo writes this line to stdout after every job.
+DONE_MARKER = b"@@done "
+
+
+class IncInfoServer:
+    # A long-lived `collectIncInfo -serve` process, jobs are sent one JSON
+    # line at a time and clang keeps file system state warm between them.
+    # A server doesn't finish a job in `timeout` seconds is killed.
+    def __init__(
+        self, commands: List[str], log_file: str, timeout: Optional[float] = None
+    ):
+        self.commands = commands
+        self.log_file = log_file
+        self.timeout = timeout
+        self.process: Optional[subprocess.Popen] = None
+        # Output read from stdout but not consumed.
+        self.buffer = b""
+
+    def start(self):
+        self.log = open(self.log_file, "a")
+        try:
+            self.process = subprocess.Popen(
+                self.commands,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=self.log,
+            )
+        except OSError:
+            self.log.close()
+            raise
+        self.buffer = b""
+
+    def is_alive(self) -> bool:
+        return self.process is not None and self.process.poll() is None
+
+    def request(self, job: Dict) -> bool:
+        if not self.is_alive():
+            self.close()
+            self.start()
+        assert self.process is not None
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        try:
+            self.process.stdin.write(json.dumps(job).encode() + b"\n")  # type: ignore
+            self.process.stdin.flush()  # type: ignore
+            while True:
+                line = self.read_line(deadline)
+                if line is None:
+                    break
+                if line.startswith(DONE_MARKER):
+                    return line[len(DONE_MARKER) :].strip() == b"0"
+        except TimeoutError:
+            # The server hangs on this job, restart it for the next one.
+            logger.error(
+                f"[Inc Info Server] Timeout after {self.timeout}s when handling {job['file']}"
+            )
+            self.close(kill=True)
+            return False
+        except (OSError, ValueError) as e:
+            logger.error(f"[Inc Info Server] {job['file']}: {e}")
+        # The server crashed on this job, restart it for the next one.
+        logger.error(f"[Inc Info Server] Server exited when handling {job['file']}")
+        self.close()
+        return False
+
+    def read_line(self, deadline: Optional[float]) -> Optional[bytes]:
+        # Next line of stdout, None if the server exited. Raise TimeoutError
+        # if no line is written before `deadline`.
+        fd = self.process.stdout.fileno()  # type: ignore
+        while b"\n" not in self.buffer:
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError
+            (readable, _, _) = select.select([fd], [], [], remaining)
+            if not readable:
+                continue
+            data = os.read(fd, 65536)
+            if not data:
+                return None
+            self.buffer += data
+        (line, _, self.buffer) = self.buffer.partition(b"\n")
+        return line
+
+    def close(self, kill: bool = False):
+        if self.process is None:
+            return
+        try:
+            if kill:
+                self.process.kill()
+            self.process.stdin.close()  # type: ignore
+            self.process.wait(timeout=10)
+        except (OSError, subprocess.TimeoutExpired):
+            self.process.kill()
+            self.process.wait()
+        self.process.stdout.close()  # type: ignore
+        self.process = None
+        self.log.close()
+
+
+class IncInfoServerPool:
+    def __init__(
+        self,
+        commands: List[str],
+        log_prefix: str,
+        size: int,
+        timeout: Optional[float] = None,
+    ):
+        self.servers: queue.Queue = queue.Queue()
+        self.all_servers: List[IncInfoServer] = []
+        try:
+            for idx in range(size):
+                server = IncInfoServer(commands, f"{log_prefix}_{idx}.log", timeout)
+                server.start()
+                self.servers.put(server)
+                self.all_servers.append(server)
+        except OSError:
+            self.close()
+            raise
+
+    def request(self, job: Dict) -> bool:
+        server = self.servers.get()
+        try:
+            return server.request(job)
+        finally:
+            self.servers.put(server)
+
+    def close(self):
+        for server in self.all_servers:
+            server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
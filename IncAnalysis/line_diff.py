@@ -0,0 +1,156 @@
+import re
+from array import array
+from difflib import SequenceMatcher
+from typing import Dict, List, Optional, Tuple
+
+from IncAnalysis.logger import logger
+
+# Same as `diff -b`, runs of white space are equivalent and trailing white space
+# is ignored.
+WHITE_SPACES = re.compile(rb"[ \t\f\v\r]+")
+# Lines occur more than this times are not used as anchors by histogram diff.
+MAX_CHAIN_LENGTH = 64
+
+
+def read_lines(file: str, line_ids: Dict[bytes, int], ignore_markers: bool):
+    # Map every line to an integer. Blank lines and line markers never make
+    # `diff -B [-I '^# [[:digit:]]']` report changes, so don't take part in
+    # diff, only record the line number of the other lines.
+    with open(file, "rb") as f:
+        lines = f.read().split(b"\n")
+    if lines and not lines[-1]:
+        lines.pop()
+    ids: List[int] = []
+    line_numbers = array("l")
+    for idx, line in enumerate(lines):
+        if ignore_markers and line.startswith(b"# ") and line[2:3].isdigit():
+            continue
+        normalized = WHITE_SPACES.sub(b" ", line).rstrip(b" ")
+        if not normalized:
+            continue
+        line_id = line_ids.get(normalized)
+        if line_id is None:
+            line_id = line_ids[normalized] = len(line_ids)
+        ids.append(line_id)
+        line_numbers.append(idx)
+    return ids, line_numbers
+
+
+def find_longest_anchor(a, a0, a1, b, b0, b1) -> Optional[Tuple[int, int, int]]:
+    # Histogram diff: find the longest common region containing the line
+    # which occurs fewest times in a[a0:a1].
+    occurrences: Dict[int, List[int]] = {}
+    for i in range(a0, a1):
+        occurrences.setdefault(a[i], []).append(i)
+    best = None
+    best_count = MAX_CHAIN_LENGTH + 1
+    best_len = 0
+    bi = b0
+    while bi < b1:
+        positions = occurrences.get(b[bi])
+        next_bi = bi + 1
+        if positions is not None and len(positions) <= best_count:
+            count = len(positions)
+            for ai in positions:
+                sa, sb = ai, bi
+                while sa > a0 and sb > b0 and a[sa - 1] == b[sb - 1]:
+                    sa -= 1
+                    sb -= 1
+                ea, eb = ai + 1, bi + 1
+                while ea < a1 and eb < b1 and a[ea] == b[eb]:
+                    ea += 1
+                    eb += 1
+                if count < best_count or ea - sa > best_len:
+                    best = (sa, sb, ea - sa)
+                    best_count = count
+                    best_len = ea - sa
+                # Lines in this region can't start a longer one.
+                next_bi = max(next_bi, eb)
+        bi = next_bi
+    return best
+
+
+def matching_blocks(a: List[int], b: List[int]) -> List[Tuple[int, int, int]]:
+    blocks: List[Tuple[int, int, int]] = []
+    worklist = [(0, len(a), 0, len(b))]
+    while worklist:
+        a0, a1, b0, b1 = worklist.pop()
+        # Common prefix and suffix.
+        start = 0
+        while a0 + start < a1 and b0 + start < b1 and a[a0 + start] == b[b0 + start]:
+            start += 1
+        if start:
+            blocks.append((a0, b0, start))
+            a0 += start
+            b0 += start
+        end = 0
+        while a0 < a1 - end and b0 < b1 - end and a[a1 - end - 1] == b[b1 - end - 1]:
+            end += 1
+        if end:
+            blocks.append((a1 - end, b1 - end, end))
+            a1 -= end
+            b1 -= end
+        if a0 == a1 or b0 == b1:
+            continue
+        anchor = find_longest_anchor(a, a0, a1, b, b0, b1)
+        if anchor is None:
+            if set(a[a0:a1]).isdisjoint(b[b0:b1]):
+                continue
+            # Only lines occur too many times are common, fall back to difflib.
+            matcher = SequenceMatcher(None, a[a0:a1], b[b0:b1], autojunk=False)
+            for i, j, n in matcher.get_matching_blocks():
+                if n:
+                    blocks.append((a0 + i, b0 + j, n))
+            continue
+        sa, sb, n = anchor
+        blocks.append((sa, sb, n))
+        worklist.append((a0, sa, b0, sb))
+        worklist.append((sa + n, a1, sb + n, b1))
+    blocks.sort()
+    return blocks
+
+
+def to_origin_range(start: int, end: int, line_numbers):
+    # Map [start, end) of non-trivial lines to [start, end) of origin lines.
+    if start == end:
+        # Empty range is just after the previous non-trivial line.
+        origin_start = line_numbers[start - 1] + 1 if start > 0 else 0
+        return origin_start, origin_start
+    return line_numbers[start], line_numbers[end - 1] + 1
+
+
+def diff_lines(old_file: str, new_file: str, ignore_markers: bool):
+    # Return hunks as [old_start, old_count, new_start, new_count], starts are
+    # the number of lines before the hunk, same as `%de,%dn %dE,%dN`.
+    line_ids: Dict[bytes, int] = {}
+    a, a_line_numbers = read_lines(old_file, line_ids, ignore_markers)
+    b, b_line_numbers = read_lines(new_file, line_ids, ignore_markers)
+    del line_ids
+    hunks = []
+    prev_a = prev_b = 0
+    for ai, bi, n in matching_blocks(a, b) + [(len(a), len(b), 0)]:
+        if ai > prev_a or bi > prev_b:
+            old_start, old_end = to_origin_range(prev_a, ai, a_line_numbers)
+            new_start, new_end = to_origin_range(prev_b, bi, b_line_numbers)
+            hunks.append(
+                [old_start, old_end - old_start, new_start, new_end - new_start]
+            )
+        prev_a, prev_b = ai + n, bi + n
+    return hunks
+
+
+def diff_preprocessed_files(task) -> Optional[bool]:
+    # Write DIFF_INFO like `diff` with `--*-group-format='%de,%dn %dE,%dN\n'`,
+    # return if there are changes, None means failed.
+    old_file, new_file, diff_info_file, ignore_markers = task
+    try:
+        hunks = diff_lines(old_file, new_file, ignore_markers)
+    except OSError as e:
+        logger.error(f"[Native Diff Failed] {old_file} {new_file}: {e}")
+        return None
+    if not hunks:
+        return False
+    with open(diff_info_file, "w") as f:
+        for old_start, old_count, new_start, new_count in hunks:
+            f.write(f"{old_start},{old_count} {new_start},{new_count}\n")
+    return True
@@ -0,0 +1,297 @@
+import asyncio
+import concurrent.futures
+import multiprocessing
+import os
+import signal
+import subprocess
+import sys
+import time
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from IncAnalysis.logger import logger
+
+# Whether children can be waited with pidfd, checked on first use.
+pidfd_supported: Optional[bool] = None
+
+
+def process_context():
+    # Don't fork, other threads may hold locks (e.g. of logging) which would
+    # never be released in children.
+    return multiprocessing.get_context(
+        "forkserver"
+        if "forkserver" in multiprocessing.get_all_start_methods()
+        else "spawn"
+    )
+
+
+class CommandTask:
+    # A command to run for one file. `context` keeps anything needed to handle
+    # the result.
+    def __init__(
+        self,
+        commands: List[str],
+        cwd=None,
+        timeout: Optional[float] = None,
+        stdout=subprocess.PIPE,
+        context=None,
+    ):
+        self.commands = commands
+        self.cwd = cwd
+        self.timeout = timeout
+        self.stdout = stdout
+        self.context = context
+
+
+class FunctionTask:
+    # A CPU bound Python function to run in a worker process, the function
+    # and its arguments must be picklable. The worker is not killed on
+    # timeout, only the result is abandoned.
+    def __init__(
+        self,
+        function: Callable,
+        args=(),
+        timeout: Optional[float] = None,
+        context=None,
+    ):
+        self.function = function
+        self.args = args
+        self.timeout = timeout
+        self.context = context
+
+
+class CommandResult:
+    def __init__(self):
+        # None if the command failed to start or timed out.
+        self.returncode: Optional[int] = None
+        # Return value of a FunctionTask.
+        self.value = None
+        self.stdout = b""
+        self.stderr = b""
+        self.timeout = False
+        self.error: Optional[str] = None
+        self.timecost = 0.0
+
+    @property
+    def stdout_text(self) -> str:
+        return self.stdout.decode(errors="replace")
+
+    @property
+    def stderr_text(self) -> str:
+        if self.error is not None:
+            return self.error
+        return self.stderr.decode(errors="replace")
+
+
+def attach_child_watcher(loop: asyncio.AbstractEventLoop):
+    # Before Python 3.12, children are waited by a global child watcher, the
+    # default one starts a thread for every child. Wait them with pidfd in
+    # this loop instead, which also works if the loop is not in main thread.
+    global pidfd_supported
+    if sys.version_info >= (3, 12):
+        return
+    if pidfd_supported is None:
+        pidfd_supported = hasattr(os, "pidfd_open")
+        if pidfd_supported:
+            try:
+                os.close(os.pidfd_open(os.getpid()))
+            except OSError:
+                pidfd_supported = False
+    if not pidfd_supported:
+        return
+    watcher = asyncio.PidfdChildWatcher()
+    asyncio.set_child_watcher(watcher)
+    watcher.attach_loop(loop)
+
+
+async def run_command(task: CommandTask) -> CommandResult:
+    result = CommandResult()
+    start_time = time.time()
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *task.commands,
+            stdin=subprocess.DEVNULL,
+            stdout=task.stdout,
+            stderr=subprocess.PIPE,
+            cwd=task.cwd,
+        )
+    except OSError as e:
+        result.error = str(e)
+        result.timecost = time.time() - start_time
+        return result
+    try:
+        (stdout, stderr) = await asyncio.wait_for(proc.communicate(), task.timeout)
+        result.returncode = proc.returncode
+        result.stdout = stdout or b""
+        result.stderr = stderr or b""
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        result.timeout = True
+        result.error = f"timeout after {task.timeout}s"
+    except asyncio.CancelledError:
+        # Interrupted, don't leave the child running.
+        proc.kill()
+        await proc.wait()
+        raise
+    result.timecost = time.time() - start_time
+    return result
+
+
+async def run_function(task: FunctionTask, executor) -> CommandResult:
+    result = CommandResult()
+    start_time = time.time()
+    try:
+        result.value = await asyncio.wait_for(
+            asyncio.get_running_loop().run_in_executor(
+                executor, task.function, *task.args
+            ),
+            task.timeout,
+        )
+        result.returncode = 0
+    except asyncio.TimeoutError:
+        result.timeout = True
+        result.error = f"timeout after {task.timeout}s"
+    except Exception as e:
+        result.error = str(e)
+    result.timecost = time.time() - start_time
+    return result
+
+
+class Stage:
+    # One step every file goes through in `run_file_pipeline`. prepare(file)
+    # returns the task to run, or the result directly if there is nothing to
+    # run; finish(file, task, result) handles the result. Both run in worker
+    # threads, so they may do file I/O and hashing without blocking the event
+    # loop. Files rejected by `accept` skip this stage. At most `jobs` files
+    # are in this stage.
+    def __init__(
+        self,
+        name: str,
+        prepare: Callable[..., Union[CommandTask, FunctionTask, bool]],
+        finish: Callable[..., bool],
+        jobs: int,
+        accept: Optional[Callable[..., bool]] = None,
+    ):
+        self.name = name
+        self.prepare = prepare
+        self.finish = finish
+        self.jobs = max(1, jobs)
+        self.accept = accept
+
+
+def run_file_tasks(
+    name: str,
+    file_list: List,
+    prepare: Callable[..., Union[CommandTask, bool]],
+    finish: Callable[..., bool],
+    jobs: int,
+) -> bool:
+    # Run one command of every file in an event loop instead of a thread per
+    # process.
+    (results, _) = run_file_pipeline(
+        file_list, [Stage(name, prepare, finish, jobs)], name=name
+    )
+    return results[name]
+
+
+def run_file_pipeline(
+    file_list: List,
+    stages: List[Stage],
+    done: Optional[Callable] = None,
+    function_workers: int = 0,
+    jobs: int = 0,
+    name: str = "Pipeline",
+) -> Tuple[Dict[str, bool], Dict[str, float]]:
+    # Every file goes through `stages` in order on its own, so a file can be
+    # in a later stage while others are still in the first one, and done(file)
+    # is called in a worker thread when it leaves the last stage. FunctionTasks
+    # are executed by `function_workers` processes. At most `jobs` tasks of all
+    # stages run at a time, 0 means only limits of stages apply.
+    # Return whether all files succeeded in every stage, and the time when
+    # its last file finished.
+    # SIGINT/SIGTERM cancel all tasks and kill running children.
+    results = {stage.name: True for stage in stages}
+    finish_times = {stage.name: 0.0 for stage in stages}
+    entered = {stage.name: 0 for stage in stages}
+    finished = {stage.name: 0 for stage in stages}
+    if not file_list:
+        return results, finish_times
+    executor = None
+    if function_workers > 0:
+        executor = concurrent.futures.ProcessPoolExecutor(
+            function_workers, mp_context=process_context()
+        )
+    total_jobs = jobs if jobs > 0 else sum(stage.jobs for stage in stages)
+    # Runs prepare, finish and done of stages.
+    hooks = concurrent.futures.ThreadPoolExecutor(total_jobs)
+    start_time = time.time()
+
+    async def run_stage(stage: Stage, file, semaphores):
+        (stage_semaphore, total_semaphore) = semaphores
+        loop = asyncio.get_running_loop()
+        async with stage_semaphore, total_semaphore:
+            task = await loop.run_in_executor(hooks, stage.prepare, file)
+            if isinstance(task, bool):
+                return task
+            if isinstance(task, FunctionTask):
+                result = await run_function(task, executor)
+            else:
+                result = await run_command(task)
+            return await loop.run_in_executor(hooks, stage.finish, file, task, result)
+
+    async def process_file(file, semaphores):
+        for stage, stage_semaphores in zip(stages, semaphores):
+            if stage.accept is not None and not stage.accept(file):
+                continue
+            entered[stage.name] += 1
+            result = await run_stage(stage, file, stage_semaphores)
+            finished[stage.name] += 1
+            logger.info(
+                f"[{stage.name} {finished[stage.name]}/{entered[stage.name]}] [{result}] {file.identifier}"
+            )
+            results[stage.name] = results[stage.name] and result
+            finish_times[stage.name] = time.time() - start_time
+        if done is not None:
+            await asyncio.get_running_loop().run_in_executor(hooks, done, file)
+
+    async def process_all():
+        loop = asyncio.get_running_loop()
+        attach_child_watcher(loop)
+        main_task = asyncio.current_task()
+        installed = []
+        for signum in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(signum, main_task.cancel)  # type: ignore
+                installed.append(signum)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Not in main thread.
+                pass
+        total_semaphore = asyncio.Semaphore(total_jobs)
+        semaphores = [
+            (asyncio.Semaphore(stage.jobs), total_semaphore) for stage in stages
+        ]
+        # Files enter the first stage in order.
+        workers = [
+            asyncio.ensure_future(process_file(file, semaphores)) for file in file_list
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except asyncio.CancelledError:
+            for task in workers:
+                task.cancel()
+            await asyncio.gather(*workers, return_exceptions=True)
+            raise
+        finally:
+            for signum in installed:
+                loop.remove_signal_handler(signum)
+
+    try:
+        asyncio.run(process_all())
+    except asyncio.CancelledError:
+        logger.error(f"[{name}] Interrupted, all running commands are killed.")
+        raise KeyboardInterrupt
+    finally:
+        hooks.shutdown(cancel_futures=True)
+        if executor is not None:
+            executor.shutdown(cancel_futures=True)
+    return results, finish_times
@@ -0,0 +1,160 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from IncAnalysis.logger import logger
+from IncAnalysis.utils import makedir, remove_file
+
+
+def parse_dependency_file(dep_file: str, directory: str) -> Optional[List[str]]:
+    # Dependency file generated by `-MD`:
+    # target: source header1 \
+    #   header2 ...
+    if not os.path.exists(dep_file):
+        return None
+    with open(dep_file, "r") as f:
+        content = f.read().replace("\\\n", " ")
+    _, sep, deps = content.partition(": ")
+    if not sep:
+        return None
+    ret = []
+    for dep in re.split(r"(?<!\\)\s+", deps):
+        if not dep:
+            continue
+        dep = dep.replace("\\ ", " ").replace("\\#", "#").replace("$$", "$")
+        ret.append(os.path.normpath(os.path.join(directory, dep)))
+    return ret
+
+
+class PreprocessCache:
+    # Content-addressed store of preprocessed files, shared by all versions.
+    #   manifests/<sha256 of identifier>.json: the compile command digest, the
+    #       dependency set captured by `-MD` and the object key of latest output.
+    #   objects/<key>: preprocessed file, key is the digest of compile command
+    #       and contents of all dependencies.
+    def __init__(self, store_path):
+        self.store_path = Path(store_path)
+        self.manifest_path = self.store_path / "manifests"
+        self.object_path = self.store_path / "objects"
+        makedir(str(self.manifest_path))
+        makedir(str(self.object_path))
+        # Dependencies are shared by many files, only hash them once per run.
+        self.dep_digests: Dict[str, Tuple[int, int, str]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def reset_statistics(self):
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def command_digest(commands: List[str], directory: str) -> str:
+        sha256 = hashlib.sha256()
+        sha256.update(json.dumps([directory, commands]).encode("utf-8"))
+        return sha256.hexdigest()
+
+    def get_manifest_file(self, identifier: str) -> str:
+        sha256 = hashlib.sha256(identifier.encode("utf-8")).hexdigest()
+        return str(self.manifest_path / (sha256 + ".json"))
+
+    def dependency_digest(self, dep: str) -> Optional[str]:
+        try:
+            st = os.stat(dep)
+        except OSError:
+            return None
+        cached = self.dep_digests.get(dep)
+        if cached and cached[0] == st.st_mtime_ns and cached[1] == st.st_size:
+            return cached[2]
+        blake2b = hashlib.blake2b(digest_size=20)
+        try:
+            with open(dep, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    blake2b.update(chunk)
+        except OSError:
+            return None
+        digest = blake2b.hexdigest()
+        self.dep_digests[dep] = (st.st_mtime_ns, st.st_size, digest)
+        return digest
+
+    def object_key(self, command_digest: str, deps: List[str]) -> Optional[str]:
+        sha256 = hashlib.sha256(command_digest.encode("utf-8"))
+        for dep in deps:
+            digest = self.dependency_digest(dep)
+            if digest is None:
+                # Some dependencies have been removed.
+                return None
+            sha256.update(f"\0{dep}\0{digest}".encode("utf-8"))
+        return sha256.hexdigest()
+
+    def read_manifest(self, identifier: str) -> Optional[dict]:
+        manifest_file = self.get_manifest_file(identifier)
+        if not os.path.exists(manifest_file):
+            return None
+        try:
+            with open(manifest_file, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            logger.error(f"[Preprocess Cache] Broken manifest {manifest_file}")
+            return None
+
+    @staticmethod
+    def link_file(src: str, dest: str):
+        remove_file(dest)
+        try:
+            os.link(src, dest)
+        except OSError:
+            # Hard link is not available across file systems.
+            shutil.copyfile(src, dest)
+
+    def restore(self, identifier: str, command_digest: str, prep_file: str) -> bool:
+        manifest = self.read_manifest(identifier)
+        if manifest is None or manifest.get("command") != command_digest:
+            self.misses += 1
+            return False
+        key = self.object_key(command_digest, manifest.get("deps", []))
+        if key is None or key != manifest.get("key"):
+            self.misses += 1
+            return False
+        obj = str(self.object_path / key)
+        if not os.path.exists(obj):
+            self.misses += 1
+            return False
+        self.link_file(obj, prep_file)
+        self.hits += 1
+        return True
+
+    def store(
+        self,
+        identifier: str,
+        command_digest: str,
+        dep_file: str,
+        prep_file: str,
+        directory: str,
+        start_time_ns: int,
+    ) -> bool:
+        deps = parse_dependency_file(dep_file, directory)
+        remove_file(dep_file)
+        if not deps:
+            logger.debug(f"[Preprocess Cache] No dependencies recorded for {prep_file}")
+            return False
+        for dep in deps:
+            # Dependency modified while preprocessing, the output may be stale.
+            if not os.path.exists(dep) or os.stat(dep).st_mtime_ns >= start_time_ns:
+                return False
+        key = self.object_key(command_digest, deps)
+        if key is None:
+            return False
+        obj = str(self.object_path / key)
+        if not os.path.exists(obj):
+            self.link_file(prep_file, obj)
+        old_manifest = self.read_manifest(identifier)
+        with open(self.get_manifest_file(identifier), "w") as f:
+            json.dump({"command": command_digest, "deps": deps, "key": key}, f)
+        # Only keep the latest object of every file.
+        if old_manifest is not None and old_manifest.get("key") not in (None, key):
+            remove_file(str(self.object_path / old_manifest["key"]))
+        return True
@@ -1,6 +1,60 @@
+import os
+import signal
 import subprocess
+import tempfile
 import time
-from subprocess import CalledProcessError, TimeoutExpired
+from subprocess import TimeoutExpired
+from typing import Optional
+
+
+# Bytes of output kept in memory when it's streamed into files.
+TAIL_SIZE = 16 * 1024
+
+
+def read_output(file) -> str:
+    # Whole output written into an opened temporary file.
+    file.seek(0)
+    return file.read().decode(errors="replace")
+
+
+def read_tail(file, size: int = TAIL_SIZE) -> str:
+    try:
+        with open(file, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            f.seek(max(0, f.tell() - size))
+            return f.read().decode(errors="replace")
+    except OSError:
+        return ""
+
+
+class ResourceUsage:
+    # Resource usage of a finished process and the descendants it waited for.
+    __slots__ = ["user_time", "sys_time", "max_rss", "read_blocks", "write_blocks"]
+    FIELDS = ["user time", "sys time", "max rss (MB)", "read blocks", "write blocks"]
+
+    def __init__(self, rusage=None):
+        self.user_time = rusage.ru_utime if rusage else 0.0
+        self.sys_time = rusage.ru_stime if rusage else 0.0
+        # ru_maxrss is in KB on Linux.
+        self.max_rss = rusage.ru_maxrss * 1024 if rusage else 0
+        self.read_blocks = rusage.ru_inblock if rusage else 0
+        self.write_blocks = rusage.ru_oublock if rusage else 0
+
+    def merge(self, other: "ResourceUsage"):
+        self.user_time += other.user_time
+        self.sys_time += other.sys_time
+        self.max_rss = max(self.max_rss, other.max_rss)
+        self.read_blocks += other.read_blocks
+        self.write_blocks += other.write_blocks
+
+    def values(self):
+        return [
+            round(self.user_time, 3),
+            round(self.sys_time, 3),
+            round(self.max_rss / (1024 * 1024), 1),
+            self.read_blocks,
+            self.write_blocks,
+        ]
 
 
 class Process:
@@ -13,41 +67,117 @@ class Process:
         ok = "OK"
         skipped = "Skipped"
 
-    def __init__(self, cmd, directory, timeout=600):
+    def __init__(
+        self,
+        cmd,
+        directory,
+        timeout=600,
+        admission=None,
+        memory=0,
+        stdout_file=None,
+        stderr_file=None,
+    ):
+        # admission: AdmissionController that may delay launching this process
+        # until `memory` bytes fit in its budget.
+        # stdout_file/stderr_file: stream output into files instead of memory,
+        # only the tail is kept in `stdout`/`stderr` for error reporting.
+        # stderr goes to `stdout_file` if `stderr_file` is not specified.
         self.cmd = cmd
         self.timeout = timeout
         self.timecost = 0.0
+        self.peak_memory = 0
+        self.usage: Optional[ResourceUsage] = None
+        self.stdout = None
+        self.stderr = None
+        token = None
+        if admission is not None:
+            token = admission.admit(memory)
+        outputs = []
         start_time = time.time()
         try:
-            proc = subprocess.run(
+            if stdout_file is not None:
+                stdout = open(stdout_file, "wb")
+                outputs.append(stdout)
+                stderr = subprocess.STDOUT
+                if stderr_file is not None:
+                    stderr = open(stderr_file, "wb")
+                    outputs.append(stderr)
+            else:
+                # Keep output in temporary files instead of pipes, so the child
+                # can be waited without draining them.
+                outputs.extend([tempfile.TemporaryFile(), tempfile.TemporaryFile()])
+                (stdout, stderr) = outputs
+            proc = subprocess.Popen(
                 self.cmd,
-                text=True,
-                timeout=self.timeout,
-                capture_output=True,
-                check=True,
+                stdout=stdout,
+                stderr=stderr,
                 cwd=directory,
             )
-            self.timecost = (
-                time.time() - start_time
-            )  # Only record time cost when process normally exited.
-            self.stat = Process.Stat.ok
-            self.stdout = proc.stdout
-            self.stderr = proc.stderr
-        except TimeoutExpired as e:
-            self.timecost = "timeout"
-            self.stat = Process.Stat.timeout
-            self.stderr = e.stderr
-            self.stdout = e.stdout
-        except CalledProcessError as e:
-            self.timecost = "error"
-            if e.returncode < 0:
-                self.stat = Process.Stat.terminated
-                self.signal = -e.returncode
-            elif e.returncode > 0:
-                self.stat = Process.Stat.error
-                self.code = e.returncode
-            self.stdout = e.stdout
-            self.stderr = e.stderr
+            if admission is not None:
+                admission.limit_child(proc.pid)
+                admission.register(token, proc.pid)
+            try:
+                self.wait(proc, self.timeout)
+            except TimeoutExpired:
+                # Not Popen.kill, it polls and may reap the child before wait4.
+                os.kill(proc.pid, signal.SIGKILL)
+                self.wait(proc, None)
+                self.timecost = "timeout"
+                self.stat = Process.Stat.timeout
+                return
+            if proc.returncode == 0:
+                self.timecost = (
+                    time.time() - start_time
+                )  # Only record time cost when process normally exited.
+                self.stat = Process.Stat.ok
+            else:
+                self.timecost = "error"
+                if proc.returncode < 0:
+                    self.stat = Process.Stat.terminated
+                    self.signal = -proc.returncode
+                else:
+                    self.stat = Process.Stat.error
+                    self.code = proc.returncode
         except Exception as e:
             self.stat = Process.Stat.unknown
             self.exception = e
+        finally:
+            if stdout_file is None and outputs:
+                self.stdout = read_output(outputs[0])
+                self.stderr = read_output(outputs[1])
+            for output in outputs:
+                output.close()
+            if stdout_file is not None and outputs:
+                self.stdout = read_tail(stdout_file)
+                if stderr_file is not None:
+                    self.stderr = read_tail(stderr_file)
+            if admission is not None:
+                self.peak_memory = admission.release(token)
+            if self.usage is not None:
+                self.peak_memory = max(self.peak_memory, self.usage.max_rss)
+
+    def wait(self, proc: subprocess.Popen, timeout):
+        # Reap the child with os.wait4 to get its resource usage, Popen.wait
+        # only gets the exit status. Poll like Popen.wait if there is timeout.
+        try:
+            if timeout is None:
+                (_, status, rusage) = os.wait4(proc.pid, 0)
+            else:
+                deadline = time.monotonic() + timeout
+                delay = 0.0005
+                while True:
+                    (pid, status, rusage) = os.wait4(proc.pid, os.WNOHANG)
+                    if pid == proc.pid:
+                        break
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutExpired(proc.args, timeout)
+                    delay = min(delay * 2, remaining, 0.05)
+                    time.sleep(delay)
+        except ChildProcessError:
+            # Already reaped through Popen, which keeps the exit status, but
+            # the resource usage is lost.
+            proc.poll()
+            return
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        self.usage = ResourceUsage(rusage)
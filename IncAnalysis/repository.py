@@ -7,6 +7,7 @@ from typing import List
 from IncAnalysis.configuration import BuildType, Configuration
 from IncAnalysis.environment import *
 from IncAnalysis.logger import logger
+from IncAnalysis.process import ResourceUsage
 from IncAnalysis.utils import *
 
 
@@ -135,6 +136,9 @@ class Repository(ABC):
         config_data.extend(config.total_analyzers_time.values())
         headers.extend(config.file_analyze_status.keys())
         config_data.extend(config.file_analyze_status.values())
+        for analyzer, usage in config.get_each_analyzer_total_usage().items():
+            headers.extend([f"{analyzer} ({field})" for field in ResourceUsage.FIELDS])
+            config_data.extend(usage.values())
         return headers, config_data
 
     @abstractmethod
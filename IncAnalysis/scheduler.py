@@ -0,0 +1,337 @@
+import concurrent.futures
+import math
+import threading
+import time
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+from IncAnalysis.cache_index import CacheIndex
+from IncAnalysis.file_in_cdb import FileInCDB
+from IncAnalysis.logger import logger
+from IncAnalysis.process import Process
+from IncAnalysis.utils import get_file_size
+
+# Used when there is no history of this analyzer, only the relative order of
+# files matters in this case.
+DEFAULT_SECONDS_PER_BYTE = 1e-5
+# Timeout is this many times of the predicted analysis time.
+TIMEOUT_FACTOR = 3
+# Files without history use this percentile of other files' analysis time.
+TIMEOUT_PERCENTILE = 0.99
+# Files used more than this ratio of their timeout are reported.
+TIMEOUT_WARNING_RATIO = 0.8
+
+
+class CostModel:
+    # Predict analysis time of every file from the history recorded in cache
+    # index, so that files can be dispatched longest-first and a large TU
+    # will not be the last one to start. Peak memory is predicted the same way
+    # for admission control.
+    def __init__(self, cache_index: Optional[CacheIndex], default_memory: int = 0):
+        self.cache_index = cache_index
+        self.default_memory = default_memory
+
+    def seconds_per_byte(self, analyzer_key: str) -> float:
+        if self.cache_index is None:
+            return DEFAULT_SECONDS_PER_BYTE
+        (total_time, total_size) = self.cache_index.get_total_cost(analyzer_key)
+        if total_time <= 0 or total_size <= 0:
+            return DEFAULT_SECONDS_PER_BYTE
+        return total_time / total_size
+
+    def predict(self, file: FileInCDB, analyzer_key: str, rate: float) -> float:
+        size = get_file_size(file.prep_file) if file.prep_file else 0
+        rf_num = file.rf_num if isinstance(file.rf_num, int) else None
+        history = (
+            self.cache_index.get_cost(file.identifier, analyzer_key)
+            if self.cache_index is not None
+            else None
+        )
+        if history is not None and history[0] is not None:
+            (cost, old_size, old_rf_num, _, _, _) = history
+            # Analysis time grows with the functions to be reanalyzed, fall
+            # back to the size of preprocessed file.
+            if rf_num is not None and old_rf_num is not None:
+                cost *= (rf_num + 1) / (old_rf_num + 1)
+            elif size and old_size:
+                cost *= size / old_size
+            return cost
+        # New file, estimate by other analyses of this file in this session.
+        analyzer_name = analyzer_key.split(" (")[0]
+        for key, cost in file.analyzers_time.items():
+            if key.startswith(f"{analyzer_name} (") and isinstance(cost, float):
+                if cost > 0:
+                    return cost
+        if analyzer_name == "CSA" and file.csa_analyze_time != "Unknown":
+            try:
+                return float(file.csa_analyze_time)
+            except ValueError:
+                pass
+        return size * rate
+
+    def predict_costs(
+        self, file_list: List[FileInCDB], analyzer_key: str
+    ) -> Dict[str, float]:
+        rate = self.seconds_per_byte(analyzer_key)
+        return {
+            file.identifier: self.predict(file, analyzer_key, rate)
+            for file in file_list
+        }
+
+    def predict_memory(self, file: FileInCDB, analyzer_key: str) -> int:
+        history = (
+            self.cache_index.get_cost(file.identifier, analyzer_key)
+            if self.cache_index is not None
+            else None
+        )
+        if history is not None and history[3]:
+            return history[3]
+        analyzer_name = analyzer_key.split(" (")[0]
+        for key, memory in file.analyzers_memory.items():
+            if key.startswith(f"{analyzer_name} (") and memory > 0:
+                return memory
+        return self.default_memory
+
+    def predict_memories(
+        self, file_list: List[FileInCDB], analyzer_key: str
+    ) -> Dict[str, int]:
+        return {
+            file.identifier: self.predict_memory(file, analyzer_key)
+            for file in file_list
+        }
+
+    def schedule(self, file_list: List[FileInCDB], analyzer_key: str):
+        # Longest job first, return the sorted files and their predicted costs.
+        costs = self.predict_costs(file_list, analyzer_key)
+        scheduled = sorted(file_list, key=lambda f: costs[f.identifier], reverse=True)
+        if scheduled:
+            logger.debug(
+                f"[Scheduler] {analyzer_key} predicted cost: {sum(costs.values()):.2f}s, longest: {scheduled[0].identifier} ({costs[scheduled[0].identifier]:.2f}s)"
+            )
+        return scheduled, costs
+
+    def record(self, file_list: List[FileInCDB], analyzer_key: str):
+        if self.cache_index is None:
+            return
+        rows = []
+        for file in file_list:
+            cost = file.analyzers_time.get(analyzer_key)
+            timed_out = None
+            if cost == "timeout":
+                timed_out = 1
+            elif isinstance(cost, float) and cost > 0:
+                timed_out = 0
+            if not isinstance(cost, float) or cost <= 0:
+                # Skipped or failed, the time is unknown.
+                cost = None
+            peak_memory = file.analyzers_memory.get(analyzer_key) or None
+            timeout = file.analyzers_timeout.get(analyzer_key) or None
+            if cost is None and peak_memory is None and timeout is None:
+                continue
+            rows.append(
+                (
+                    file.identifier,
+                    cost,
+                    get_file_size(file.prep_file) if file.prep_file else 0,
+                    file.rf_num if isinstance(file.rf_num, int) else None,
+                    peak_memory,
+                    timeout,
+                    timed_out,
+                )
+            )
+        self.cache_index.update_costs(analyzer_key, rows)
+
+
+class TimeoutPolicy:
+    # Derive the timeout of every file from history instead of a fixed one,
+    # so slow files finished before are not killed and hung ones are cut early.
+    # A file timed out last time gets a doubled timeout.
+    def __init__(
+        self, cost_model: CostModel, default: float, floor: float, ceiling: float
+    ):
+        self.cost_model = cost_model
+        self.default = default
+        self.floor = floor
+        self.ceiling = max(ceiling, floor)
+        # History doesn't change during analysis, compute percentiles once.
+        self.fallbacks: Dict[str, float] = {}
+
+    def clamp(self, timeout: float) -> float:
+        return min(max(timeout, self.floor), self.ceiling)
+
+    def percentile_timeout(self, analyzer_key: str) -> float:
+        if self.cost_model.cache_index is None:
+            return self.default
+        if analyzer_key not in self.fallbacks:
+            times = self.cost_model.cache_index.get_times(analyzer_key)
+            if not times:
+                self.fallbacks[analyzer_key] = self.default
+            else:
+                # Nearest-rank percentile.
+                rank = math.ceil(TIMEOUT_PERCENTILE * len(times))
+                self.fallbacks[analyzer_key] = self.clamp(
+                    times[rank - 1] * TIMEOUT_FACTOR
+                )
+        return self.fallbacks[analyzer_key]
+
+    def timeouts(
+        self, file_list: List[FileInCDB], analyzer_key: str, costs: Dict[str, float]
+    ) -> Dict[str, float]:
+        fallback = self.percentile_timeout(analyzer_key)
+        timeouts = {}
+        for file in file_list:
+            history = (
+                self.cost_model.cache_index.get_cost(file.identifier, analyzer_key)
+                if self.cost_model.cache_index is not None
+                else None
+            )
+            if history is None:
+                timeouts[file.identifier] = fallback
+            elif history[5] and history[4]:
+                # Timed out last time, its recorded time (if any) is stale.
+                timeouts[file.identifier] = self.clamp(history[4] * 2)
+            elif history[0] is not None:
+                timeouts[file.identifier] = self.clamp(
+                    costs[file.identifier] * TIMEOUT_FACTOR
+                )
+            else:
+                timeouts[file.identifier] = fallback
+        return timeouts
+
+
+class JobQueue:
+    # Run per-file jobs of several analyzers in one pool of `jobs` workers, so
+    # the tail of one analyzer doesn't leave cores idle. Jobs of every analyzer
+    # are kept in dispatch order, a free worker takes the most expensive head
+    # job among analyzers that are below their own worker limit. Timed out
+    # files are re-analyzed with degraded settings after all other jobs.
+    # Jobs can also be fed while running, until `close` is called, retries
+    # wait for it.
+    def __init__(self, jobs: int, closed: bool = True):
+        self.jobs = jobs
+        self.queues: Dict = {}
+        self.lock = threading.Lock()
+        self.fed: List[Tuple] = []
+        self.closed = closed
+        self.cancelled = False
+        # Done when there are new jobs or the queue is closed.
+        self.wakeup: concurrent.futures.Future = concurrent.futures.Future()
+
+    def add(self, analyzer, file_list: List[FileInCDB], costs=None):
+        self.queues[analyzer] = deque(
+            (costs[file.identifier] if costs else 0.0, file) for file in file_list
+        )
+
+    def feed(self, analyzer, file: FileInCDB, cost: float = 0.0):
+        # Thread safe, `analyzer` must have been added.
+        with self.lock:
+            self.fed.append((analyzer, cost, file))
+            if not self.wakeup.done():
+                self.wakeup.set_result(None)
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            if not self.wakeup.done():
+                self.wakeup.set_result(None)
+
+    def cancel(self):
+        # Don't start queued jobs anymore, running ones are waited.
+        with self.lock:
+            self.cancelled = True
+            self.closed = True
+            if not self.wakeup.done():
+                self.wakeup.set_result(None)
+
+    def take_fed(self, totals: Dict) -> bool:
+        # Move fed jobs into queues, return if more jobs may come.
+        with self.lock:
+            for analyzer, cost, file in self.fed:
+                self.queues[analyzer].append((cost, file))
+                totals[analyzer] += 1
+            self.fed = []
+            if self.cancelled:
+                for queue in self.queues.values():
+                    queue.clear()
+            if self.wakeup.done() and not self.closed:
+                self.wakeup = concurrent.futures.Future()
+            return not self.closed
+
+    def run(self):
+        # Return whether all jobs of every analyzer succeeded, and the time when
+        # its last job finished.
+        start_time = time.time()
+        results = {analyzer: True for analyzer in self.queues}
+        finish_times = {analyzer: 0.0 for analyzer in self.queues}
+        totals = {analyzer: len(queue) for analyzer, queue in self.queues.items()}
+        finished = {analyzer: 0 for analyzer in self.queues}
+        active = {analyzer: 0 for analyzer in self.queues}
+        retries: deque = deque()
+        running: Dict[concurrent.futures.Future, Tuple] = {}
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.jobs) as executor:
+            while True:
+                more = self.take_fed(totals)
+                if self.cancelled:
+                    retries.clear()
+                while len(running) < self.jobs:
+                    candidates = [
+                        analyzer
+                        for analyzer, queue in self.queues.items()
+                        if queue and active[analyzer] < analyzer.get_workers()
+                    ]
+                    if candidates:
+                        analyzer = max(candidates, key=lambda a: self.queues[a][0][0])
+                        (_, file) = self.queues[analyzer].popleft()
+                        degraded = False
+                    else:
+                        if more or any(self.queues.values()):
+                            # Retries run after all other jobs, including
+                            # those not fed yet.
+                            break
+                        retry = next(
+                            (
+                                (analyzer, file)
+                                for (analyzer, file) in retries
+                                if active[analyzer] < analyzer.get_workers()
+                            ),
+                            None,
+                        )
+                        if retry is None:
+                            break
+                        retries.remove(retry)
+                        (analyzer, file) = retry
+                        degraded = True
+                    future = executor.submit(analyzer.analyze_one_file, file, degraded)
+                    running[future] = (analyzer, file, degraded)
+                    active[analyzer] += 1
+                if not running and not more:
+                    break
+                (done, _) = concurrent.futures.wait(
+                    [*running, self.wakeup] if more else running,
+                    return_when=concurrent.futures.FIRST_COMPLETED,
+                )
+                for future in done:
+                    if future not in running:
+                        # New jobs are fed.
+                        continue
+                    (analyzer, file, degraded) = running.pop(future)
+                    active[analyzer] -= 1
+                    finished[analyzer] += 1
+                    (stat, file_identifier) = future.result()
+                    analyzer.log_result(
+                        finished[analyzer],
+                        totals[analyzer],
+                        stat,
+                        file_identifier,
+                        degraded,
+                    )
+                    if (
+                        not degraded
+                        and stat == Process.Stat.timeout[0]
+                        and analyzer.can_degrade()
+                    ):
+                        retries.append((analyzer, file))
+                        totals[analyzer] += 1
+                    results[analyzer] = results[analyzer] and stat == Process.Stat.ok
+                    finish_times[analyzer] = time.time() - start_time
+        return results, finish_times
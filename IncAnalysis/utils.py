@@ -1,11 +1,13 @@
 import concurrent.futures
 import csv
+import hashlib
+import json
 import os
 import re
 import shutil
 from enum import Enum, auto
 from pathlib import Path
-from typing import List
+from typing import List, Optional
 
 from IncAnalysis.logger import logger
 
@@ -26,6 +28,24 @@ def remake_dir(path: Path, debug_TAG=None):
     os.makedirs(path)
 
 
+def dump_json_list(items, file):
+    # Write items one by one in compact format, one item per line, so the
+    # whole list never needs to be built in memory.
+    with open(file, "w") as f:
+        f.write("[")
+        for idx, item in enumerate(items):
+            f.write(",\n" if idx else "\n")
+            f.write(json.dumps(item, separators=(",", ":")))
+        f.write("\n]\n")
+
+
+def get_file_size(file: str) -> int:
+    try:
+        return os.path.getsize(file)
+    except OSError:
+        return 0
+
+
 def remove_file(file: str):
     if os.path.exists(file):
         os.remove(file)
@@ -65,6 +85,28 @@ def replace_loc_info(pair):
         print(f"Error processing {src}: {e}")
 
 
+# Line markers and blank lines never make `diff -B -I '^# [[:digit:]]'` report
+# changes, drop them before hashing so digest is the same with or without `--udp`.
+TRIVIAL_LINES = re.compile(rb"^(?:# \d[^\n]*)?\n", re.MULTILINE)
+
+
+def preprocessed_file_digest(file: str, chunk_size=1 << 20):
+    blake2b = hashlib.blake2b()
+    try:
+        with open(file, "rb") as f:
+            rest = b""
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                chunk = rest + chunk
+                end = chunk.rfind(b"\n") + 1
+                rest = chunk[end:]
+                blake2b.update(TRIVIAL_LINES.sub(b"", chunk[:end]))
+            blake2b.update(rest)
+    except OSError as e:
+        logger.error(f"[File Digest] {e}")
+        return None
+    return blake2b.hexdigest()
+
+
 def get_origin_file_name(file: str, prefix: str, extnames: List[str]):
     file = file[len(prefix) :]
     for ext in extnames:
@@ -126,19 +168,59 @@ def process_file_list(method, file_list: List, jobs):
     #     thread.join()
     ret = True
     with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as executor:
-        futures = [
-            executor.submit(getattr(file, method.__name__)) for file in file_list
-        ]
+        futures = {
+            executor.submit(getattr(file, method.__name__)): file for file in file_list
+        }
 
         for idx, future in enumerate(concurrent.futures.as_completed(futures)):
             result = future.result()  # 获取任务结果，如果有的话
             logger.info(
-                f"[{method.__name__} {idx+1}/{len(file_list)}] [{result}] {file_list[idx].identifier}"
+                f"[{method.__name__} {idx+1}/{len(file_list)}] [{result}] {futures[future].identifier}"
             )
             ret = ret and result
     return ret
 
 
+def get_available_memory() -> Optional[int]:
+    # MemAvailable in /proc/meminfo, in bytes.
+    try:
+        with open("/proc/meminfo", "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def get_process_rss(pid: int) -> int:
+    # VmRSS of process `pid` and all its descendants, in bytes.
+    rss = 0
+    pids = [pid]
+    while pids:
+        pid = pids.pop()
+        try:
+            with open(f"/proc/{pid}/status", "r") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        rss += int(line.split()[1]) * 1024
+                        break
+            for tid in os.listdir(f"/proc/{pid}/task"):
+                with open(f"/proc/{pid}/task/{tid}/children", "r") as f:
+                    pids.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError, IndexError):
+            continue
+    return rss
+
+
+def memory_capped_jobs(jobs: int, job_memory_mb: int) -> int:
+    # Don't start more jobs than available memory can hold.
+    available = get_available_memory()
+    if available is None or job_memory_mb <= 0:
+        return jobs
+    return max(1, min(jobs, available // (job_memory_mb * 1024 * 1024)))
+
+
 def commands_to_shell_script(commands):
     assert commands is not None
     from shlex import join
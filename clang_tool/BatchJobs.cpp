@@ -0,0 +1,118 @@
+#include "BatchJobs.h"
+#include <llvm/Support/Error.h>
+#include <llvm/Support/FileSystem.h>
+#include <llvm/Support/JSON.h>
+#include <llvm/Support/MemoryBuffer.h>
+#include <llvm/Support/Path.h>
+#include <llvm/Support/raw_ostream.h>
+
+static std::string getAbsolutePath(llvm::StringRef File) {
+  llvm::SmallString<256> AbsolutePath(File);
+  llvm::sys::fs::make_absolute(AbsolutePath);
+  llvm::sys::path::remove_dots(AbsolutePath, true);
+  return std::string(AbsolutePath.str());
+}
+
+bool BatchJobs::Load(llvm::StringRef BatchFile, const IncOptions &DefaultOpt) {
+  auto Buffer = llvm::MemoryBuffer::getFile(BatchFile);
+  if (!Buffer) {
+    llvm::errs() << "Error: Could not open batch file " << BatchFile << ".\n";
+    return false;
+  }
+  return Parse((*Buffer)->getBuffer(), DefaultOpt);
+}
+
+bool BatchJobs::Parse(llvm::StringRef JSON, const IncOptions &DefaultOpt) {
+  auto Parsed = llvm::json::parse(JSON);
+  if (!Parsed) {
+    llvm::errs() << "Error: Could not parse batch jobs: "
+                 << llvm::toString(Parsed.takeError()) << "\n";
+    return false;
+  }
+  if (auto *Object = Parsed->getAsObject()) {
+    return AddJob(*Object, DefaultOpt);
+  }
+  auto *Array = Parsed->getAsArray();
+  if (!Array) {
+    llvm::errs() << "Error: Batch jobs should be a job or a list of jobs.\n";
+    return false;
+  }
+  for (auto &Value : *Array) {
+    if (auto *Object = Value.getAsObject())
+      AddJob(*Object, DefaultOpt);
+  }
+  return true;
+}
+
+bool BatchJobs::AddJob(const llvm::json::Object &Object,
+                       const IncOptions &DefaultOpt) {
+  auto File = Object.getString("file");
+  if (!File) {
+    llvm::errs() << "Error: Skip batch job without file.\n";
+    return false;
+  }
+  BatchJob Job;
+  Job.File = getAbsolutePath(*File);
+  Job.IncOpt = DefaultOpt;
+  if (auto Directory = Object.getString("directory"))
+    Job.Directory = Directory->str();
+  else
+    Job.Directory = ".";
+  if (auto Diff = Object.getString("diff"))
+    Job.DiffPath = Diff->str();
+  if (auto RF = Object.getString("rf-file"))
+    Job.IncOpt.RFPath = RF->str();
+  if (auto CGDelta = Object.getString("cg-delta-file"))
+    Job.IncOpt.CGDeltaPath = CGDelta->str();
+  if (auto CppcheckRF = Object.getString("cppcheck-rf-file"))
+    Job.IncOpt.CppcheckRFPath = CppcheckRF->str();
+  if (auto GCCRF = Object.getString("gcc-rf-file"))
+    Job.IncOpt.GCCRFPath = GCCRF->str();
+  if (auto OriginFile = Object.getString("file-path"))
+    Job.IncOpt.FilePath = OriginFile->str();
+  if (auto *Arguments = Object.getArray("arguments")) {
+    for (auto &Argument : *Arguments) {
+      if (auto Str = Argument.getAsString())
+        Job.Arguments.push_back(Str->str());
+    }
+  }
+  FileToJob[Job.File] = Jobs.size();
+  Jobs.push_back(std::move(Job));
+  return true;
+}
+
+BatchJob *BatchJobs::getJob(llvm::StringRef File) {
+  auto It = FileToJob.find(File);
+  if (It == FileToJob.end()) {
+    It = FileToJob.find(getAbsolutePath(File));
+    if (It == FileToJob.end())
+      return nullptr;
+  }
+  return &Jobs[It->second];
+}
+
+std::vector<std::string> BatchJobs::getSourcePaths() const {
+  std::vector<std::string> SourcePaths;
+  for (auto &Job : Jobs) {
+    SourcePaths.push_back(Job.File);
+  }
+  return SourcePaths;
+}
+
+std::vector<tooling::CompileCommand>
+BatchCompilationDatabase::getCompileCommands(llvm::StringRef FilePath) const {
+  BatchJob *Job = Jobs.getJob(FilePath);
+  if (!Job)
+    return {};
+  // Same as FixedCompilationDatabase, the source file is the last argument.
+  std::vector<std::string> CommandLine = {"clang-tool"};
+  CommandLine.insert(CommandLine.end(), Job->Arguments.begin(),
+                     Job->Arguments.end());
+  CommandLine.push_back(Job->File);
+  return {tooling::CompileCommand(Job->Directory, Job->File,
+                                  std::move(CommandLine), "")};
+}
+
+std::vector<std::string> BatchCompilationDatabase::getAllFiles() const {
+  return Jobs.getSourcePaths();
+}
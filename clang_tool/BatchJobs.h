@@ -0,0 +1,64 @@
+#ifndef BATCH_JOBS_H
+#define BATCH_JOBS_H
+
+#include <clang/Tooling/CompilationDatabase.h>
+#include <llvm/ADT/StringMap.h>
+#include <llvm/ADT/StringRef.h>
+#include <llvm/Support/JSON.h>
+#include <string>
+#include <vector>
+
+#include "IncInfoCollectASTVisitor.h"
+
+using namespace clang;
+
+// Options of one translation unit in batch mode.
+class BatchJob {
+public:
+  std::string File;
+  std::string Directory;
+  std::string DiffPath;
+  // Compile flags without the source file.
+  std::vector<std::string> Arguments;
+  IncOptions IncOpt;
+};
+
+// Jobs read from `-batch` file or `-serve` requests, every job looks like:
+// {"file": "prep_file", "directory": "dir", "arguments": [...],
+//  "diff": "...", "rf-file": "...", "cppcheck-rf-file": "...",
+//  "gcc-rf-file": "...", "file-path": "...", "cg-delta-file": "..."}
+// Options not specified use the values from command line.
+class BatchJobs {
+public:
+  bool Load(llvm::StringRef BatchFile, const IncOptions &DefaultOpt);
+
+  // Parse one job or a list of jobs.
+  bool Parse(llvm::StringRef JSON, const IncOptions &DefaultOpt);
+
+  bool AddJob(const llvm::json::Object &Object, const IncOptions &DefaultOpt);
+
+  BatchJob *getJob(llvm::StringRef File);
+
+  std::vector<std::string> getSourcePaths() const;
+
+  std::vector<BatchJob> Jobs;
+
+private:
+  llvm::StringMap<size_t> FileToJob;
+};
+
+// Provide compile commands of batch jobs to ClangTool.
+class BatchCompilationDatabase : public tooling::CompilationDatabase {
+public:
+  explicit BatchCompilationDatabase(BatchJobs &jobs) : Jobs(jobs) {}
+
+  std::vector<tooling::CompileCommand>
+  getCompileCommands(llvm::StringRef FilePath) const override;
+
+  std::vector<std::string> getAllFiles() const override;
+
+private:
+  BatchJobs &Jobs;
+};
+
+#endif // BATCH_JOBS_H
@@ -7,6 +7,7 @@
 #include <clang/AST/Expr.h>
 #include <clang/AST/ExprCXX.h>
 #include <clang/AST/Stmt.h>
+#include <algorithm>
 #include <clang/Basic/LLVM.h>
 #include <fstream>
 #include <iostream>
@@ -18,19 +19,26 @@
 #include <llvm/Support/Timer.h>
 #include <llvm/Support/raw_ostream.h>
 #include <memory>
+#include <numeric>
 #include <ostream>
 #include <string>
+#include <unistd.h>
+#include <vector>
 
 #include "llvm/Support/CommandLine.h"
 #include <clang/Analysis/AnalysisDeclContext.h>
+#include <clang/Basic/FileManager.h>
 #include <clang/Frontend/CompilerInstance.h>
 #include <clang/Frontend/FrontendAction.h>
 #include <clang/Index/USRGeneration.h>
 #include <clang/Tooling/CommonOptionsParser.h>
 #include <clang/Tooling/Tooling.h>
+#include <llvm/ADT/DenseMap.h>
 #include <llvm/ADT/PostOrderIterator.h>
+#include <llvm/Support/VirtualFileSystem.h>
 #include <llvm/Support/raw_ostream.h>
 
+#include "BatchJobs.h"
 #include "IncInfoCollectASTVisitor.h"
 #include "ReverseCallGraph.h"
 
@@ -113,20 +121,21 @@ public:
 
     if (DLM.isNewFile()) {
       // If this is a new file, we just output its callgraph.
+      if (IncOpt.DumpCGBinary) {
+        // Cross TU propagation needs functions of new files.
+        BuildCallGraph();
+        DumpCallGraphBinary();
+      }
       DumpIncSummary(1);
       llvm::errs() << DLM.MainFilePath
                    << " is new, do not analyze changed functions.\n";
       return;
     }
 
-    // Same as CSA, we just consider initialzed local decl, ignore
-    // addition declarations from pch deserialization.
-    const unsigned LocalTUDeclsSize = LocalTUDecls.size();
-    for (int i = 0; i < LocalTUDeclsSize; i++) {
-      auto D = LocalTUDecls[i];
-      CG.addToReverseCallGraph(D);
-    }
+    BuildCallGraph();
     DumpCallGraph();
+    if (IncOpt.CGDeltaPath.empty())
+      DumpCallGraphBinary();
 
     toolTimer->stopTimer();
     llvm::errs() << "Prepare CG ";
@@ -168,6 +177,7 @@ public:
     IncVisitor.DumpGlobalConstantSet();
     IncVisitor.DumpTaintDecls();
     DumpFunctionsNeedReanalyze();
+    DumpCallGraphDelta();
 
     toolTimer->stopTimer();
     llvm::TimeRecord toolEnd = toolTimer->getTotalTime();
@@ -181,6 +191,16 @@ public:
     DumpFunctionsNeedReanalyzeForGCC();
   }
 
+  void BuildCallGraph() {
+    // Same as CSA, we just consider initialzed local decl, ignore
+    // addition declarations from pch deserialization.
+    const unsigned LocalTUDeclsSize = LocalTUDecls.size();
+    for (int i = 0; i < LocalTUDeclsSize; i++) {
+      auto D = LocalTUDecls[i];
+      CG.addToReverseCallGraph(D);
+    }
+  }
+
   void Propogate() {
     for (auto &decl : FunctionsChanged) {
       ReverseCallGraphNode *node_from_cf = CG.getNode(decl);
@@ -284,6 +304,167 @@ public:
       outFile->close();
   }
 
+  static void writeUInt32(std::ostream &OS, uint32_t Value) {
+    char Bytes[4];
+    for (int i = 0; i < 4; i++)
+      Bytes[i] = static_cast<char>((Value >> (8 * i)) & 0xff);
+    OS.write(Bytes, 4);
+  }
+
+  static void writeUInt32s(std::ostream &OS,
+                           const std::vector<uint32_t> &Values) {
+    for (uint32_t Value : Values)
+      writeUInt32(OS, Value);
+  }
+
+  void DumpCallGraphBinary() {
+    // Same graph as .cg in CSR form, so it can be used without parsing.
+    // All integers are little-endian uint32:
+    //   "ICGB", version, node num N, edge num E, name bytes S, USR bytes U
+    //   name offsets[N + 1], USR offsets[N + 1], caller offsets[N + 1],
+    //   callers[E], nodes sorted by name[N], nodes sorted by USR[N],
+    //   has body in this TU[N] (one byte each), names[S], USRs[U]
+    // Nodes are numbered in the order of .cg, callers of node i are
+    // callers[caller offsets[i]:caller offsets[i + 1]]. Names are the same
+    // as in .cg, USRs identify functions across TUs.
+    if (!IncOpt.DumpCGBinary) {
+      return;
+    }
+    llvm::ReversePostOrderTraversal<clang::ReverseCallGraph *> RPOT(&CG);
+    std::vector<ReverseCallGraphNode *> Nodes;
+    llvm::DenseMap<ReverseCallGraphNode *, uint32_t> NodeIndex;
+    for (ReverseCallGraphNode *N : RPOT) {
+      if (N == CG.getRoot())
+        continue;
+      NodeIndex[N] = Nodes.size();
+      Nodes.push_back(N);
+    }
+
+    std::string Names;
+    std::string USRs;
+    std::vector<uint32_t> NameOffsets({0});
+    std::vector<uint32_t> USROffsets({0});
+    std::vector<uint32_t> CallerOffsets({0});
+    std::vector<uint32_t> Callers;
+    std::string HasBody;
+    for (ReverseCallGraphNode *N : Nodes) {
+      Decl *D = N->getDecl();
+      std::string Name, USR;
+      getDumpName(D, Name);
+      Names += Name;
+      NameOffsets.push_back(Names.size());
+      getUSR(D, USR);
+      USRs += USR;
+      USROffsets.push_back(USRs.size());
+      HasBody.push_back(D->hasBody() ? 1 : 0);
+      for (ReverseCallGraphNode *CR : N->callers()) {
+        auto It = NodeIndex.find(CR);
+        if (It != NodeIndex.end())
+          Callers.push_back(It->second);
+      }
+      CallerOffsets.push_back(Callers.size());
+    }
+
+    // Look up nodes by binary search on names or USRs.
+    auto SortBy = [&](const std::string &Strings,
+                      const std::vector<uint32_t> &Offsets) {
+      auto StringOf = [&](uint32_t I) {
+        return llvm::StringRef(Strings).slice(Offsets[I], Offsets[I + 1]);
+      };
+      std::vector<uint32_t> Sorted(Nodes.size());
+      std::iota(Sorted.begin(), Sorted.end(), 0);
+      std::sort(Sorted.begin(), Sorted.end(), [&](uint32_t A, uint32_t B) {
+        return StringOf(A) < StringOf(B);
+      });
+      return Sorted;
+    };
+
+    std::string CGBFile = MainFilePath.str() + ".cgb";
+    std::ofstream OS(CGBFile, std::ios::binary);
+    if (!OS.is_open()) {
+      llvm::errs() << "Error: Could not open file " << CGBFile
+                   << " for writing.\n";
+      return;
+    }
+    OS.write("ICGB", 4);
+    writeUInt32(OS, 2);
+    writeUInt32(OS, Nodes.size());
+    writeUInt32(OS, Callers.size());
+    writeUInt32(OS, Names.size());
+    writeUInt32(OS, USRs.size());
+    writeUInt32s(OS, NameOffsets);
+    writeUInt32s(OS, USROffsets);
+    writeUInt32s(OS, CallerOffsets);
+    writeUInt32s(OS, Callers);
+    writeUInt32s(OS, SortBy(Names, NameOffsets));
+    writeUInt32s(OS, SortBy(USRs, USROffsets));
+    OS.write(HasBody.data(), HasBody.size());
+    OS.write(Names.data(), Names.size());
+    OS.write(USRs.data(), USRs.size());
+    OS.close();
+  }
+
+  void getDumpName(const Decl *D, std::string &Str) {
+    if (IncOpt.DumpUSR) {
+      getUSRName(D, Str);
+    } else {
+      Str = AnalysisDeclContext::getFunctionName(D->getCanonicalDecl());
+    }
+  }
+
+  static void getUSR(const Decl *D, std::string &Str) {
+    SmallString<128> USR;
+    index::generateUSRForDecl(D->getCanonicalDecl(), USR);
+    Str = USR.str();
+  }
+
+  void DumpCallGraphDelta() {
+    // Instead of the whole .cgb, only dump calls of changed functions, the
+    // call graph of last version is patched with them. One record per line,
+    // fields are separated by tabs:
+    //   F <has body> <USR> <name>  a changed function, followed by
+    //   C <has body> <USR> <name>  every function it calls
+    //   R <USR>                    a function needs reanalyze
+    if (!IncOpt.DumpCGBinary || IncOpt.CGDeltaPath.empty()) {
+      return;
+    }
+    std::ofstream OS(IncOpt.CGDeltaPath);
+    if (!OS.is_open()) {
+      llvm::errs() << "Error: Could not open file " << IncOpt.CGDeltaPath
+                   << " for writing.\n";
+      return;
+    }
+    // The graph only records callers, collect callees of changed functions.
+    llvm::DenseMap<const Decl *, std::vector<const Decl *>> Callees;
+    for (auto &Entry : CG) {
+      ReverseCallGraphNode *N = Entry.second.get();
+      if (N == CG.getRoot() || !N->getDecl())
+        continue;
+      for (ReverseCallGraphNode *CR : N->callers()) {
+        if (FunctionsChanged.contains(CR->getDecl()))
+          Callees[CR->getDecl()].push_back(N->getDecl());
+      }
+    }
+    auto WriteFunction = [&](char Kind, const Decl *D) {
+      std::string USR, Name;
+      getUSR(D, USR);
+      getDumpName(D, Name);
+      OS << Kind << "\t" << (D->hasBody() ? 1 : 0) << "\t" << USR << "\t"
+         << Name << "\n";
+    };
+    for (const Decl *D : FunctionsChanged) {
+      WriteFunction('F', D);
+      for (const Decl *Callee : Callees[D])
+        WriteFunction('C', Callee);
+    }
+    for (const Decl *D : FunctionsNeedReanalyze) {
+      std::string USR;
+      getUSR(D, USR);
+      OS << "R\t" << USR << "\n";
+    }
+    OS.close();
+  }
+
   void DumpFunctionsNeedReanalyze() {
     if (FunctionsNeedReanalyze.empty()) {
       return;
@@ -516,12 +697,21 @@ private:
 class IncInfoCollectAction : public clang::ASTFrontendAction {
 public:
   IncInfoCollectAction(std::string &diffPath, std::string &fsPath,
-                       const IncOptions &incOpt)
-      : DiffPath(diffPath), FSPath(fsPath), IncOpt(incOpt) {}
+                       const IncOptions &incOpt, BatchJobs *jobs)
+      : DiffPath(diffPath), FSPath(fsPath), IncOpt(incOpt), Jobs(jobs) {}
 
   std::unique_ptr<clang::ASTConsumer>
   CreateASTConsumer(clang::CompilerInstance &CI,
                     llvm::StringRef file) override {
+    if (Jobs) {
+      // Batch mode, every file has its own options.
+      if (BatchJob *Job = Jobs->getJob(file)) {
+        return std::make_unique<IncInfoCollectConsumer>(CI, Job->DiffPath,
+                                                        Job->IncOpt);
+      }
+      llvm::errs() << "Warning: No batch job for " << file
+                   << ", use command line options.\n";
+    }
     return std::make_unique<IncInfoCollectConsumer>(CI, DiffPath, IncOpt);
   }
 
@@ -529,22 +719,26 @@ private:
   std::string &DiffPath;
   std::string &FSPath;
   const IncOptions &IncOpt;
+  BatchJobs *Jobs;
 };
 
 class IncInfoCollectActionFactory : public FrontendActionFactory {
 public:
   IncInfoCollectActionFactory(std::string &diffPath, std::string &fsPath,
-                              const IncOptions &incOpt)
-      : DiffPath(diffPath), FSPath(fsPath), IncOpt(incOpt) {}
+                              const IncOptions &incOpt,
+                              BatchJobs *jobs = nullptr)
+      : DiffPath(diffPath), FSPath(fsPath), IncOpt(incOpt), Jobs(jobs) {}
 
   std::unique_ptr<FrontendAction> create() override {
-    return std::make_unique<IncInfoCollectAction>(DiffPath, FSPath, IncOpt);
+    return std::make_unique<IncInfoCollectAction>(DiffPath, FSPath, IncOpt,
+                                                  Jobs);
   }
 
 private:
   std::string &DiffPath;
   std::string &FSPath;
   const IncOptions &IncOpt;
+  BatchJobs *Jobs;
 };
 
 static llvm::cl::OptionCategory ToolCategory("Collect Inc Info Options");
@@ -569,6 +763,10 @@ static llvm::cl::opt<bool>
 static llvm::cl::opt<bool> DumpCG("dump-cg", llvm::cl::desc("Dump CG or not"),
                                   llvm::cl::value_desc("dump cg"),
                                   llvm::cl::init(false));
+static llvm::cl::opt<bool> DumpCGBinary(
+    "dump-cg-binary",
+    llvm::cl::desc("Dump CG in binary CSR form to <main file>.cgb"),
+    llvm::cl::value_desc("dump binary cg"), llvm::cl::init(false));
 static llvm::cl::opt<bool>
     DumpToFile("dump-file", llvm::cl::desc("Dump CG and CF to file"),
                llvm::cl::value_desc("dump to file or stream"),
@@ -583,6 +781,11 @@ static llvm::cl::opt<bool>
 static llvm::cl::opt<bool> CTU("ctu", llvm::cl::desc("Consider CTU analysis"),
                                llvm::cl::value_desc("consider CTU analysis"),
                                llvm::cl::init(false));
+static llvm::cl::opt<std::string> CGDeltaPath(
+    "cg-delta-file",
+    llvm::cl::desc("Dump calls of changed functions to the path instead of "
+                   "the whole binary CG, used with -dump-cg-binary"),
+    llvm::cl::value_desc("cg delta file"), llvm::cl::init(""));
 static llvm::cl::opt<std::string>
     RFPath("rf-file", llvm::cl::desc("Output RF to the path"),
            llvm::cl::value_desc("dump rf file"), llvm::cl::init(""));
@@ -595,6 +798,111 @@ static llvm::cl::opt<std::string>
 static llvm::cl::opt<std::string>
     FilePath("file-path", llvm::cl::desc("File path before preprocess"),
              llvm::cl::value_desc("origin file"), llvm::cl::init(""));
+static llvm::cl::opt<std::string> BatchPath(
+    "batch",
+    llvm::cl::desc("Process all jobs in the JSON file in one run, compile "
+                   "commands and per file options are read from the file"),
+    llvm::cl::value_desc("batch jobs file"), llvm::cl::init(""));
+
+static llvm::cl::opt<bool> Serve(
+    "serve",
+    llvm::cl::desc("Read one job per line from stdin until EOF, reply "
+                   "'@@done <return code>' to stdout after every job, other "
+                   "output goes to stderr"),
+    llvm::cl::value_desc("server mode"), llvm::cl::init(false));
+
+static bool hasOption(int argc, const char **argv, llvm::StringRef Name) {
+  for (int i = 1; i < argc; i++) {
+    llvm::StringRef Arg(argv[i]);
+    if (Arg == "--")
+      break;
+    Arg.consume_front("-");
+    Arg.consume_front("-");
+    if (Arg == Name || Arg.starts_with((Name + "=").str()))
+      return true;
+  }
+  return false;
+}
+
+static IncOptions getIncOptions() {
+  return IncOptions{.PrintLoc = PrintLoc,
+                    .ClassLevelTypeChange = ClassLevel,
+                    .FieldLevelTypeChange = FieldLevel,
+                    .DumpCG = DumpCG,
+                    .DumpCGBinary = DumpCGBinary,
+                    .DumpToFile = DumpToFile,
+                    .DumpUSR = DumpUSR,
+                    .DumpANR = DumpANR,
+                    .CTU = CTU,
+                    .RFPath = RFPath,
+                    .CGDeltaPath = CGDeltaPath,
+                    .CppcheckRFPath = CppcheckRFPath,
+                    .GCCRFPath = GCCRFPath,
+                    .FilePath = FilePath};
+}
+
+int runServer(int argc, const char **argv) {
+  if (!llvm::cl::ParseCommandLineOptions(argc, argv, "", &llvm::errs())) {
+    return 1;
+  }
+  IncOptions IncOpt = getIncOptions();
+  // clang diagnostics and the Dump* helpers may write to stdout, so move
+  // stdout to stderr and reply through a duplicate of the original stdout.
+  llvm::outs().flush();
+  std::cout.flush();
+  int ReplyFD = dup(STDOUT_FILENO);
+  if (ReplyFD < 0 || dup2(STDERR_FILENO, STDOUT_FILENO) < 0) {
+    llvm::errs() << "Error: Could not redirect stdout to stderr.\n";
+    return 1;
+  }
+  llvm::raw_fd_ostream Replies(ReplyFD, /*shouldClose=*/true);
+  // Keep FileManager alive between jobs, so file system lookups are cached.
+  llvm::IntrusiveRefCntPtr<FileManager> Files(
+      new FileManager(FileSystemOptions(), llvm::vfs::getRealFileSystem()));
+  auto PCHContainerOps = std::make_shared<PCHContainerOperations>();
+  std::string Line;
+  while (std::getline(std::cin, Line)) {
+    if (Line.empty())
+      continue;
+    int ret = 1;
+    BatchJobs Jobs;
+    if (Jobs.Parse(Line, IncOpt) && !Jobs.Jobs.empty()) {
+      BatchCompilationDatabase Compilations(Jobs);
+      ClangTool Tool(Compilations, Jobs.getSourcePaths(), PCHContainerOps,
+                     llvm::vfs::getRealFileSystem(), Files);
+      IncInfoCollectActionFactory Factory(DiffPath, FSPath, IncOpt, &Jobs);
+      ret = Tool.run(&Factory);
+    }
+    std::cout.flush();
+    llvm::outs().flush();
+    Replies << "@@done " << ret << "\n";
+    Replies.flush();
+  }
+  return 0;
+}
+
+int runBatch(int argc, const char **argv) {
+  // There is no source path and compilation database in command line,
+  // CommonOptionsParser requires them, so parse options directly.
+  if (!llvm::cl::ParseCommandLineOptions(argc, argv, "", &llvm::errs())) {
+    return 1;
+  }
+  IncOptions IncOpt = getIncOptions();
+  BatchJobs Jobs;
+  if (!Jobs.Load(BatchPath, IncOpt)) {
+    return 1;
+  }
+  if (Jobs.Jobs.empty()) {
+    return 0;
+  }
+  BatchCompilationDatabase Compilations(Jobs);
+  // All files share FileManager of the tool, headers are only looked up once.
+  ClangTool Tool(Compilations, Jobs.getSourcePaths());
+  IncInfoCollectActionFactory Factory(DiffPath, FSPath, IncOpt, &Jobs);
+  // Failure of one file doesn't stop the others, caller checks outputs of
+  // every file.
+  return Tool.run(&Factory);
+}
 
 int main(int argc, const char **argv) {
   std::unique_ptr<llvm::Timer> toolTimer =
@@ -602,6 +910,20 @@ int main(int argc, const char **argv) {
   toolTimer->startTimer();
   llvm::TimeRecord toolStart = toolTimer->getTotalTime();
 
+  if (hasOption(argc, argv, "serve")) {
+    return runServer(argc, argv);
+  }
+
+  if (hasOption(argc, argv, "batch")) {
+    auto ret = runBatch(argc, argv);
+    toolTimer->stopTimer();
+    llvm::TimeRecord toolStop = toolTimer->getTotalTime();
+    toolStop -= toolStart;
+    llvm::errs() << "Tool Stop ";
+    DisplayTime(toolStop);
+    return ret;
+  }
+
   auto ExpectedParser = CommonOptionsParser::create(argc, argv, ToolCategory);
   if (!ExpectedParser) {
     // Fail gracefully for unsupported options.
@@ -612,18 +934,7 @@ int main(int argc, const char **argv) {
 
   ClangTool Tool(OptionsParser.getCompilations(),
                  OptionsParser.getSourcePathList());
-  IncOptions IncOpt{.PrintLoc = PrintLoc,
-                    .ClassLevelTypeChange = ClassLevel,
-                    .FieldLevelTypeChange = FieldLevel,
-                    .DumpCG = DumpCG,
-                    .DumpToFile = DumpToFile,
-                    .DumpUSR = DumpUSR,
-                    .DumpANR = DumpANR,
-                    .CTU = CTU,
-                    .RFPath = RFPath,
-                    .CppcheckRFPath = CppcheckRFPath,
-                    .GCCRFPath = GCCRFPath,
-                    .FilePath = FilePath};
+  IncOptions IncOpt = getIncOptions();
   IncInfoCollectActionFactory Factory(DiffPath, FSPath, IncOpt);
 
   toolTimer->stopTimer();
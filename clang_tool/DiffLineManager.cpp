@@ -22,7 +22,7 @@ void DiffLineManager::Initialize(std::string &DiffPath,
   while (std::getline(file, line)) {
     if (line == "new") {
       DiffLines = std::nullopt;
-      llvm::outs() << MainFilePath << " is new file.\n";
+      llvm::errs() << MainFilePath << " is new file.\n";
       break;
     }
     if (line.empty()) {
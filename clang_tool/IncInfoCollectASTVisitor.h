@@ -41,12 +41,14 @@ public:
   bool FieldLevelTypeChange = false;
 
   bool DumpCG = false;
+  bool DumpCGBinary = false;
   bool DumpToFile = true;
   bool DumpUSR = false;
   bool DumpANR = false;
   bool CTU = false;
 
   std::string RFPath;
+  std::string CGDeltaPath;
   std::string CppcheckRFPath;
   std::string GCCRFPath;
   std::string FilePath;
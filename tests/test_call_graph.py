@@ -0,0 +1,80 @@
+from IncAnalysis.call_graph import ArrayCallGraph
+
+# main -> helper -> leaf, main -> other -> leaf, unused -> other
+# .cg lists every function followed by its callers, in reverse post order.
+CG = """main
+[
+]
+helper
+[
+main
+]
+other
+[
+main
+unused
+]
+leaf
+[
+helper
+other
+]
+unused
+[
+]
+"""
+
+
+def load(tmp_path, content=CG) -> ArrayCallGraph:
+    cg_file = tmp_path / "a.i.cg"
+    cg_file.write_text(content)
+    return ArrayCallGraph(str(cg_file))
+
+
+def names(call_graph, nodes):
+    return {call_graph.fname(node) for node in nodes}
+
+
+def test_parse_callers(tmp_path):
+    call_graph = load(tmp_path)
+    assert len(call_graph) == 5
+    node = call_graph.get_node_if_exist
+    # Functions in brackets call the function before them.
+    assert names(call_graph, call_graph.callers(node("leaf"))) == {"helper", "other"}
+    assert names(call_graph, call_graph.callers(node("other"))) == {"main", "unused"}
+    assert names(call_graph, call_graph.callers(node("helper"))) == {"main"}
+    assert list(call_graph.callers(node("main"))) == []
+    assert node("missing") is None
+
+
+def test_mark_reachable_callers(tmp_path):
+    call_graph = load(tmp_path)
+    node = call_graph.get_node_if_exist
+    marked = call_graph.mark_reachable_callers([node("helper")])
+    assert names(call_graph, marked) == {"helper", "main"}
+    # Marked nodes are not returned again, the search stops at them.
+    marked = call_graph.mark_reachable_callers([node("leaf"), node("helper")])
+    assert names(call_graph, marked) == {"leaf", "other", "unused"}
+    assert call_graph.functions_need_reanalyzed == {
+        "main",
+        "helper",
+        "other",
+        "leaf",
+        "unused",
+    }
+    assert all(call_graph.should_reanalyze(n) for n in range(len(call_graph)))
+
+
+def test_mark_from_several_functions(tmp_path):
+    call_graph = load(tmp_path)
+    node = call_graph.get_node_if_exist
+    call_graph.mark_reachable_callers([node("other"), node("unused")])
+    assert call_graph.functions_need_reanalyzed == {"other", "main", "unused"}
+    assert not call_graph.should_reanalyze(node("helper"))
+    assert not call_graph.should_reanalyze(node("leaf"))
+
+
+def test_cycle(tmp_path):
+    call_graph = load(tmp_path, "a\n[\nb\n]\nb\n[\na\n]\nc\n[\n]\n")
+    marked = call_graph.mark_reachable_callers([call_graph.get_node_if_exist("a")])
+    assert names(call_graph, marked) == {"a", "b"}
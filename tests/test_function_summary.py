@@ -0,0 +1,132 @@
+import random
+
+from IncAnalysis.call_graph import ArrayCallGraph
+from IncAnalysis.function_summary import FunctionSummaryTable, load_function_summaries
+
+# .fs file: function name, then TotalBasicBlocks,InlineChecked,MayInline,TimesInlined
+FS = """leaf
+3,1,0,0
+helper
+5,1,1,2
+helper
+6,1,0,0
+wide
+7,1,0,0,42
+main
+9,0,0,0
+
+ignored
+1,1,0,0
+"""
+
+
+def test_parse(tmp_path):
+    fs_file = tmp_path / "a.fs"
+    fs_file.write_text(FS)
+    table = FunctionSummaryTable(str(fs_file))
+    # The last summary of duplicate names wins, reading stops at a blank line.
+    assert table.names == ["leaf", "helper", "wide", "main"]
+    assert len(table) == 4
+    helper = table.get("helper")
+    assert helper is not None
+    assert (
+        helper.TotalBasicBlocks,
+        helper.InlineChecked,
+        helper.MayInline,
+        helper.TimesInlined,
+    ) == (6, 1, 0, 0)
+    # Fields after the first four are ignored.
+    assert table.get("wide").TotalBasicBlocks == 7  # type: ignore
+    assert table.get("ignored") is None
+    fnames = ["leaf", "helper", "wide", "main", "new"]
+    assert table.ok_to_ignore(fnames) == [
+        table.get(fname) is not None and table.get(fname).ok_to_ignore()  # type: ignore
+        for fname in fnames
+    ]
+    assert table.ok_to_ignore(fnames) == [True, True, True, False, False]
+
+
+def test_load_is_shared(tmp_path):
+    fs_file = tmp_path / "a.fs"
+    fs_file.write_text(FS)
+    table = load_function_summaries(str(fs_file))
+    assert table is not None
+    assert load_function_summaries(str(fs_file)) is table
+    assert load_function_summaries(str(tmp_path / "missing.fs")) is None
+
+
+def worklist_propagation(callers, summaries, changed):
+    # Propagation of inline level before frontier-wise ok_to_ignore.
+    marked = set()
+    for node in changed:
+        marked.add(node)
+        worklist = list(callers[node])
+        while worklist:
+            caller = worklist.pop()
+            if caller in marked:
+                continue
+            marked.add(caller)
+            summary = summaries.get(f"f{caller}")
+            if summary is None or not summary.ok_to_ignore():
+                worklist.extend(callers[caller])
+    return {f"f{node}" for node in marked}
+
+
+def test_inline_propagation(tmp_path):
+    for seed in range(100):
+        rand = random.Random(seed)
+        n = rand.randint(1, 40)
+        callers = {
+            node: rand.sample(range(n), rand.randint(0, min(4, n))) for node in range(n)
+        }
+        cg_file = tmp_path / "a.i.cg"
+        with open(cg_file, "w") as f:
+            for node in range(n):
+                f.write(f"f{node}\n[\n")
+                f.writelines(f"f{caller}\n" for caller in callers[node])
+                f.write("]\n")
+        fs_file = tmp_path / f"{seed}.fs"
+        with open(fs_file, "w") as f:
+            for node in range(n):
+                # Functions without summary are new functions.
+                if rand.random() < 0.8:
+                    f.write(
+                        f"f{node}\n{rand.randint(1, 9)},{rand.choice([0, 1])},"
+                        f"{rand.choice([0, 0, 1])},{rand.choice([0, 0, 1])}\n"
+                    )
+        table = FunctionSummaryTable(str(fs_file))
+        call_graph = ArrayCallGraph(str(cg_file))
+        changed = rand.sample(range(n), rand.randint(1, min(5, n)))
+        call_graph.mark_reachable_callers(
+            [call_graph.get_node_if_exist(f"f{node}") for node in changed],  # type: ignore
+            lambda frontier: table.ok_to_ignore(
+                [call_graph.fname(node) for node in frontier]
+            ),
+        )
+        summaries = {name: table.get(name) for name in table.names}
+        assert call_graph.functions_need_reanalyzed == worklist_propagation(
+            callers, summaries, changed
+        ), seed
+
+
+def test_changed_functions_are_always_traversed(tmp_path):
+    # b is ok to ignore, but its callers are reanalyzed when it changes.
+    cg_file = tmp_path / "a.i.cg"
+    cg_file.write_text("c\n[\nb\n]\nb\n[\na\n]\na\n[\n]\n")
+    fs_file = tmp_path / "a.fs"
+    fs_file.write_text("b\n1,1,0,0\nc\n1,0,0,0\n")
+    table = FunctionSummaryTable(str(fs_file))
+
+    def propagate(changed):
+        call_graph = ArrayCallGraph(str(cg_file))
+        call_graph.mark_reachable_callers(
+            [call_graph.get_node_if_exist(changed)],  # type: ignore
+            lambda frontier: table.ok_to_ignore(
+                [call_graph.fname(node) for node in frontier]
+            ),
+        )
+        return call_graph.functions_need_reanalyzed
+
+    assert propagate("b") == {"a", "b"}
+    # b is reached as a caller of c, it's marked but not traversed upward.
+    assert propagate("c") == {"b", "c"}
@@ -0,0 +1,108 @@
+import shutil
+import subprocess
+
+import pytest
+
+from IncAnalysis.line_diff import diff_preprocessed_files
+
+# Same options as `Environment.DIFF_COMMAND` with `--diff-engine gnu`.
+GNU_DIFF = [
+    "-b",
+    "-B",
+    "-d",
+    "-I",
+    "^# [[:digit:]]",
+    "--old-group-format=%de,%dn %dE,%dN\n",
+    "--unchanged-group-format=",
+    "--new-group-format=%de,%dn %dE,%dN\n",
+    "--changed-group-format=%de,%dn %dE,%dN\n",
+]
+
+# name: (old, new, DIFF_INFO)
+CASES = {
+    "modify": (
+        '# 1 "a.c"\nint a;\nint f() {\n  return 1;\n}\n',
+        '# 1 "a.c"\nint a;\nint f() {\n  return 2;\n}\n',
+        "3,1 3,1\n",
+    ),
+    "insert": ("int a;\nint b;\n", "int a;\nint x;\nint b;\n", "1,0 1,1\n"),
+    "delete": ("int a;\nint x;\nint b;\n", "int a;\nint b;\n", "1,1 1,0\n"),
+    "append": ("int a;\n", "int a;\nint b;\n", "1,0 1,1\n"),
+    "line_markers": (
+        '# 1 "a.c"\nint a;\n# 3 "a.c"\nint b;\n',
+        '# 1 "a.c"\n# 2 "a.c"\nint a;\n# 7 "a.c"\nint b;\n',
+        "",
+    ),
+    "blank_lines": ("int a;\n\nint b;\n", "int a;\n\n\n\nint b;\n", ""),
+    "white_spaces": ("int  a ;\nint b;\n", "int a ;   \nint b;\n", ""),
+    "blank_around_change": (
+        "int a;\n\nint b;\n\nint c;\n",
+        "int a;\n\nint B;\n\nint c;\n",
+        "2,1 2,1\n",
+    ),
+    "two_hunks": (
+        "int a;\nint b;\nint c;\nint d;\n",
+        "int A;\nint b;\nint c;\nint D;\nint e;\n",
+        "0,1 0,1\n3,1 3,2\n",
+    ),
+}
+
+
+def native_diff(tmp_path, old, new, ignore_markers=True):
+    (tmp_path / "old.i").write_text(old)
+    (tmp_path / "new.i").write_text(new)
+    diff_info = tmp_path / "new.i.diff"
+    changed = diff_preprocessed_files(
+        (
+            str(tmp_path / "old.i"),
+            str(tmp_path / "new.i"),
+            str(diff_info),
+            ignore_markers,
+        )
+    )
+    return changed, diff_info.read_text() if diff_info.exists() else ""
+
+
+@pytest.mark.parametrize("name", CASES)
+def test_diff_info(tmp_path, name):
+    (old, new, expected) = CASES[name]
+    (changed, diff_info) = native_diff(tmp_path, old, new)
+    assert changed == bool(expected)
+    assert diff_info == expected
+
+
+@pytest.mark.skipif(shutil.which("diff") is None, reason="diff is not installed")
+@pytest.mark.parametrize("name", CASES)
+def test_same_as_gnu_diff(tmp_path, name):
+    (old, new, _) = CASES[name]
+    (_, diff_info) = native_diff(tmp_path, old, new)
+    gnu = subprocess.run(
+        [shutil.which("diff"), *GNU_DIFF, "old.i", "new.i"],
+        cwd=tmp_path,
+        capture_output=True,
+        text=True,
+    )
+    assert gnu.returncode in (0, 1)
+    assert diff_info == gnu.stdout
+
+
+def test_line_markers_are_lines_without_ignore_markers(tmp_path):
+    (changed, diff_info) = native_diff(
+        tmp_path, '# 1 "a.c"\nint a;\n', '# 2 "a.c"\nint a;\n', ignore_markers=False
+    )
+    assert changed
+    assert diff_info == "0,1 0,1\n"
+
+
+def test_missing_file(tmp_path):
+    assert (
+        diff_preprocessed_files(
+            (
+                str(tmp_path / "old.i"),
+                str(tmp_path / "new.i"),
+                str(tmp_path / "new.i.diff"),
+                True,
+            )
+        )
+        is None
+    )